@@ -0,0 +1,277 @@
+import asyncio
+import re
+import time
+ 
+from utils.cmd_logger import CmdLogger
+from utils.conn_Info import get_port, get_password
+from utils.connection_base import PROMPT_STRINGS, RE_EXP
+ 
+ 
+class AsyncCmdTimeout(Exception):
+    def __init__(self, host: str, cmd: str, timeout: float, message="Command response timeout"):
+        self.host = host
+        self.cmd = cmd
+        self.message = f'{message}-{timeout} secs: {host} - {cmd}'
+        super().__init__(self.message)
+ 
+ 
+class _AsyncsshSession:
+    """
+    Interactive shell over an asyncssh connection, exposing the minimal read/write/close
+    interface used by AsyncConnection
+    """
+    def __init__(self, conn, process):
+        self._conn = conn
+        self._process = process
+ 
+    async def read(self, n: int) -> str:
+        return await self._process.stdout.read(n)
+ 
+    def write(self, data: str) -> None:
+        self._process.stdin.write(data)
+ 
+    def is_closing(self) -> bool:
+        return self._process.is_closing() if hasattr(self._process, 'is_closing') else False
+ 
+    async def close(self) -> None:
+        self._process.close()
+        self._conn.close()
+        await self._conn.wait_closed()
+ 
+ 
+async def asyncssh_connector(host: str, port: int, username: str, password: str, timeout: float):
+    """
+    Default AsyncConnection connector. Opens an SSH connection and an interactive shell with asyncssh,
+    which is only imported when this connector is used.
+ 
+    A connector is any coroutine function taking (host, port, username, password, timeout) and returning
+    an object with: async read(n) -> str ('' at EOF), write(str), is_closing() -> bool, async close()
+    """
+    import asyncssh
+    conn = await asyncio.wait_for(asyncssh.connect(host, port=port, username=username, password=password,
+                                                   known_hosts=None), timeout)
+    process = await conn.create_process(term_type='vt100', term_size=(511, 24))
+    return _AsyncsshSession(conn, process)
+ 
+ 
+class AsyncConnection:
+    # Only the end of the received data is searched for prompts, output lines are shorter than this
+    _TAIL = 1024
+ 
+    def __init__(self, host: str, user: str, log_action='open', timeout: float = 30.0, read_timeout: float = 60.0,
+                 port: int = None, response_return="\n", connector=None):
+        """
+        asyncio counterpart of Connection. A single event loop can drive thousands of sessions,
+        e.g. asyncio.gather(*(conn.execute(cmd) for conn in conns))
+ 
+        Usage:
+            conn = AsyncConnection(host, 'admin')
+            await conn.connect()
+            rtn = await conn.execute('show card')
+            await conn.close()
+ 
+        :param host: NE host IP address
+        :param user: User login string - [root | admin]
+        :param log_action: (Optional) log_action: [open | append] or an already created CmdLogger to share
+        :param timeout: (Optional) ssh connection timeout (secs)
+        :param read_timeout: (Optional) command response timeout (secs)
+        :param port: (Optional) normally set automatically based on user string
+        :param response_return: (Optional) line terminator sent after each command
+        :param connector: (Optional) coroutine function opening the shell session, see asyncssh_connector.
+                            Tests can pass an in-process stand-in, e.g. NESimulator.connector()
+        """
+        self.host = host
+        self.user = user
+        self.port = port if port is not None else get_port(user)
+        self.timeout = timeout
+        self.read_timeout = read_timeout
+        self.domain = 'root'
+        self.response_return = response_return
+        self.connector = connector if connector is not None else asyncssh_connector
+        self.session = None
+        self.base_prompt = ''
+        self._default_prompt = ''
+        self._default_prompt_re = None
+        self._default_hostname = ''
+ 
+        # Create command logger class to record all actions and responses for all hosts. If the user
+        # passed in an already created CmdLogger object just use it.
+        if isinstance(log_action, CmdLogger) is False:
+            self.logger = CmdLogger(self.host, action=log_action)
+        else:
+            self.logger = log_action
+ 
+    async def __aenter__(self):
+        await self.connect()
+        return self
+ 
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+ 
+    async def _log(self, *args, **kwargs) -> dict:
+        """
+        Run CmdLogger.log_cmd, which parses and writes to disk, on the default executor so the
+        event loop is not blocked
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: self.logger.log_cmd(*args, **kwargs))
+ 
+    async def connect(self) -> bool:
+        """
+        Open the session, detect the prompt, read the hostname and the NE timezone
+        :return: True if connected, else False (failure is logged)
+        """
+        start_secs = time.monotonic()
+        try:
+            self.session = await self.connector(self.host, self.port, self.user, get_password(self.user),
+                                                self.timeout)
+            # Wake up the shell and detect the user prompt
+            self.session.write(self.response_return)
+            output = await self._read_until(re.compile(PROMPT_STRINGS[self.user]), self.timeout)
+        except (OSError, asyncio.TimeoutError, AsyncCmdTimeout, ConnectionError) as err:
+            self.session = None
+            await self._log(f'{self.user} Host connection failed', 'na', str(err),
+                            round(time.monotonic() - start_secs, 4), self.domain)
+            return False
+        except Exception as err:
+            # Library specific connect/auth errors, e.g. asyncssh.PermissionDenied
+            self.session = None
+            await self._log(f'{self.user} Host connection failed', 'na', f'{type(err).__name__}: {err}',
+                            round(time.monotonic() - start_secs, 4), self.domain)
+            return False
+ 
+        prompt_line = RE_EXP['ansi'].sub('', output).rstrip().rsplit('\n', 1)[-1].strip()
+        self.base_prompt = prompt_line[:-1] if prompt_line.endswith(('#', '>', '$')) else prompt_line
+        self._set_default_prompt()
+ 
+        self._default_hostname = await self.send_command('hostname')
+        await self.get_TZ()
+        return True
+ 
+    def _set_default_prompt(self) -> None:
+        self._default_prompt = f"{PROMPT_STRINGS[self.user]}|{PROMPT_STRINGS['more']}|{re.escape(self.base_prompt)}"
+        self._default_prompt_re = re.compile(self._default_prompt)
+ 
+    async def close(self) -> None:
+        if self.session is not None:
+            try:
+                await self.session.close()
+            except Exception:
+                pass
+            self.session = None
+ 
+    def is_alive(self) -> bool:
+        return self.session is not None and self.session.is_closing() is False
+ 
+    async def _read_until(self, pattern, timeout: float, echo: str = None) -> str:
+        """
+        Read from the session until the last line received, ANSI codes removed, matches pattern
+        :param echo: (Optional) only accept a prompt once this command echo has been received, so a
+                        stale prompt left in the channel is not taken as the end of the response
+        :return: all data read, raw
+        """
+        chunks = []
+        tail = ''
+        seen_echo = echo is None
+        window = self._TAIL if echo is None else max(self._TAIL, len(echo) * 2)
+ 
+        async def _read():
+            nonlocal tail, seen_echo
+            while True:
+                data = await self.session.read(65536)
+                if data == '':
+                    raise ConnectionResetError(f'{self.host} session closed')
+                chunks.append(data)
+                tail += data
+                if seen_echo is False:
+                    # Search before the tail is cut down, the echo and a long response can come in one read
+                    echo_at = tail.find(echo)
+                    if echo_at < 0:
+                        tail = tail[-window:]
+                        continue
+                    seen_echo = True
+                    tail = tail[echo_at + len(echo):]
+                tail = tail[-window:]
+                last_line = RE_EXP['ansi'].sub('', tail).rsplit('\n', 1)[-1]
+                if pattern.search(last_line) is not None:
+                    return
+ 
+        try:
+            await asyncio.wait_for(_read(), timeout)
+        except asyncio.TimeoutError:
+            raise AsyncCmdTimeout(self.host, pattern.pattern, timeout)
+        return ''.join(chunks)
+ 
+    def _clean(self, cmd: str, output: str) -> str:
+        """
+        Strip ANSI codes, the command echo and the trailing prompt line from a command response
+        """
+        output = RE_EXP['ansi'].sub('', output).replace('\r\n', '\n').replace('\r', '')
+        # Drop everything up to and including the command echo line
+        echo_at = output.find(cmd) if cmd != '' else -1
+        if echo_at >= 0:
+            output = output[echo_at:]
+        lines = output.split('\n')
+        if bool(lines) is True and cmd != '' and cmd in lines[0]:
+            lines = lines[1:]
+        if bool(lines) is True and self._default_prompt_re.search(lines[-1]) is not None:
+            lines = lines[:-1]
+        return '\n'.join(lines)
+ 
+    async def send_command(self, cmd: str, prompt: str = '', read_timeout: float = None) -> str:
+        """
+        Send a command and return its response, answering any more-prompt with 'y' and a line end. Nothing is logged
+        :param cmd: NE Command string
+        :param prompt: (Optional) regular expression expected prompt
+        :param read_timeout: (Optional) Command response timeout (secs)
+        :return: cleaned command response
+        """
+        prompt_re = re.compile(prompt) if prompt != '' else self._default_prompt_re
+        if read_timeout is None:
+            read_timeout = self.read_timeout
+ 
+        pages = []
+        echo = cmd if cmd != '' else None
+        self.session.write(f'{cmd}{self.response_return}')
+        while True:
+            page = await self._read_until(prompt_re, read_timeout, echo=echo)
+            echo = None
+            last_line = RE_EXP['ansi'].sub('', page).rsplit('\n', 1)[-1]
+            m = RE_EXP['more'].search(last_line)
+            if m is None:
+                pages.append(page)
+                break
+            # Drop the more-prompt itself and request the next page
+            pages.append(page[:page.rfind('...more?')])
+            self.session.write(f'y{self.response_return}')
+        return self._clean(cmd, ''.join(pages))
+ 
+    async def get_TZ(self) -> None:
+        output = await self.send_command('date')
+        m = re.search(r"\S+\s*\S+\d{1,2}\s*\d{2}:\d{2}:\d{2}\s*(\S+)", output)
+        if m is not None:
+            self.logger.timezone_NE = m.groups(1)[0]
+        else:
+            self.logger.timezone_NE = 'Not Set'
+ 
+    async def execute(self, cmd: str, prompt: str = '', read_timeout: float = None) -> dict:
+        """
+        Basic execution method
+        :param cmd: NE Command string
+        :param prompt: (Optional) regular expression expected prompt
+        :param read_timeout: (Optional) Command response timeout (secs)
+        :return: Last command response as a log response dictionary
+        """
+        if self.is_alive() is False:
+            return await self._log('ssh.is_alive()', '', 'abnormal connection closure', 0.0, self.domain)
+ 
+        start_secs = time.monotonic()
+        try:
+            output = await self.send_command(cmd, prompt=prompt, read_timeout=read_timeout)
+            stderr = ''
+        except (AsyncCmdTimeout, ConnectionError) as err:
+            output = 'Failed command response'
+            stderr = str(err)
+ 
+        cmd_duration = round(time.monotonic() - start_secs, 4)
+        return await self._log(cmd, output, stderr, cmd_duration, self.domain)
@@ -18,10 +18,11 @@ import paramiko
 from paramiko_expect import SSHClientInteraction
  
 from utils.cmd_logger import CmdLogger
+from utils.timing import emit_timing, lap
 from utils.conn_Info import RootConnInfo, AdminConnInfo, get_password, get_port
  
 RE_EXP = {
-        'ansi escape': re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~]) '),
+        'ansi escape': re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])'),
         'more prompt': re.compile('\.\.\.more\? y=\[yes\]', re.MULTILINE),
         'root prompt': re.compile("^\s*[b']*root@.*# "),
         'last login': re.compile("\s*Last login:.* "),
@@ -148,6 +149,10 @@ class SSH_Connection:
  
  
     def openConnection(self):
+        # Duration (secs) of each connection phase, also reported to the timing hooks
+        phases = {}
+        start = time.perf_counter()
+        start_time = time.monotonic()
         try:
             # Create a new SSH client object
             self.session = paramiko.SSHClient()
@@ -155,17 +160,20 @@ class SSH_Connection:
             # Set SSH key parameters to auto accept unknown hosts
             self.session.load_system_host_keys()
             self.session.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+            start = lap(phases, 'load_host_keys', start)
             start_time = time.monotonic()
  
-            # Connect to the host
+            # Connect to the host, TCP connect, SSH handshake and authentication
             self.session.connect(hostname=self.host, username=self.user, password=get_password(self.user), port=self.port, timeout=self.timeout)
+            start = lap(phases, 'ssh_connect', start)
  
         except TimeoutError as err:
             # Connection failure
+            start = lap(phases, 'ssh_connect', start)
             cmd_duration = round(time.monotonic() - start_time, 4)
             self.logger.log_cmd(f'connect(port={self.port}, \
                                     username={self.user}, password=****)', 'na', f'Connection Failed: {err}',
-                                cmd_duration, self.domain)
+                                cmd_duration, self.domain, phases=phases)
             SSH_Conn_Failure(self.host, self.user, self.port, err)
         except Exception:
             traceback.print_exc()
@@ -174,7 +182,8 @@ class SSH_Connection:
             cmd_duration = round(time.monotonic() - start_time, 4)
             self.logger.log_cmd(f'connect(port={self.port}, \
                                     username={self.user}, password=****)', 'na', f'Connected: {self.host}',
-                                cmd_duration, self.domain)
+                                cmd_duration, self.domain, phases=phases)
+            emit_timing('open_connection', self.host, f'{self.user} connect', phases)
  
     def closeConnection(self):
         try:
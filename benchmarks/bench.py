@@ -0,0 +1,414 @@
+"""
+Benchmarks for the parser, logger and execute hot paths.
+ 
+Each stage is timed against recorded NE output fixtures, from a one line uptime to a multi-page
+show xc *. For every (stage, fixture) pair the run reports throughput, latency percentiles and
+the peak memory allocated by one call, saves the results as JSON and compares them against a
+stored baseline.
+ 
+The baseline holds absolute timings of the machine it was recorded on, see its meta. The
+baseline.json shipped here only documents one reference run; before --compare means anything on
+another machine, regenerate it there with --save-baseline from the commit to compare against.
+ 
+Usage, from the directory that contains the utils package:
+    python -m utils.benchmarks.bench                            # run all, compare to baseline.json
+    python -m utils.benchmarks.bench --stages parse_cmd,pager --fixtures show_xc_5000
+    python -m utils.benchmarks.bench --output results.json --save-baseline
+"""
+import argparse
+import asyncio
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+ 
+from netmiko.base_connection import BaseConnection
+ 
+import utils.cmd_parser as cmd_parser
+from utils.async_connection import AsyncConnection
+from utils.cmd_logger import CmdLogger
+from utils.cmd_parser import parse_cmd, zip_results, result_cache, StreamParser
+from utils.connection_base import Connection, MorePager, PROMPT_STRINGS
+from utils.log_stats import _fields
+from utils.ne_simulator import NESimulator
+from utils.benchmarks.fixtures import load_fixtures, fixture_resolver, BASE_PROMPT, PAGE_LINES
+ 
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+RESULTS_VERSION = 1
+ 
+ 
+class ReplayChannel:
+    """
+    Stand-in for the netmiko connection that replays the raw pages of a fixture, one page per read.
+    Prompt and ANSI handling are netmiko's own
+    """
+    RESPONSE_RETURN = '\n'
+    RETURN = '\n'
+    strip_prompt = BaseConnection.strip_prompt
+    strip_ansi_escape_codes = BaseConnection.strip_ansi_escape_codes
+ 
+    def __init__(self, pages: list):
+        self.base_prompt = BASE_PROMPT
+        self.pages = pages
+        self._next = 0
+ 
+    def rewind(self) -> None:
+        self._next = 0
+ 
+    def is_alive(self) -> bool:
+        return True
+ 
+    def write_channel(self, data: str) -> None:
+        pass
+ 
+    def read_until_pattern(self, pattern: str, read_timeout: float = None) -> str:
+        page = self.pages[self._next]
+        self._next += 1
+        return page
+ 
+    def send_command(self, cmd: str, read_timeout: float = None, expect_string: str = None,
+                     cmd_verify: bool = True) -> str:
+        page = self.read_until_pattern(expect_string)
+        return self.strip_prompt(page) if len(self.pages) == 1 else page
+ 
+    def disconnect(self) -> None:
+        pass
+ 
+ 
+def _replay_connection(fixture, logger: CmdLogger) -> Connection:
+    """
+    Helper func - Connection wired to a ReplayChannel, no SSH session is opened
+    """
+    conn = Connection.__new__(Connection)
+    conn.host = 'bench'
+    conn.user = 'admin' if fixture.domain == 'ne' else 'root'
+    conn.domain = fixture.domain
+    conn.read_timeout = 60.0
+    conn.response_return = '\n'
+    conn.logger = logger
+    conn.ssh = ReplayChannel(fixture.pages)
+    conn._default_prompt = f"{PROMPT_STRINGS[conn.user]}|{PROMPT_STRINGS['more']}|{BASE_PROMPT}"
+    return conn
+ 
+ 
+def _stage_parse_cmd(fixture, ctx):
+    return lambda: parse_cmd(fixture.cmd, fixture.output, fixture.domain, use_cache=False), None
+ 
+ 
+def _stage_parse_cmd_cached(fixture, ctx):
+    parse_cmd(fixture.cmd, fixture.output, fixture.domain)
+    return lambda: parse_cmd(fixture.cmd, fixture.output, fixture.domain), None
+ 
+ 
+def _stage_zip_results(fixture, ctx):
+    # Every call parses, the result cache is cleared outside of the timed call
+    return lambda: zip_results(fixture.cmd, fixture.output, fixture.domain), result_cache.clear
+ 
+ 
+def _stage_zip_results_columnar(fixture, ctx):
+    return lambda: zip_results(fixture.cmd, fixture.output, fixture.domain, columnar=True), result_cache.clear
+ 
+ 
+def _stage_stream_parse(fixture, ctx):
+    def run():
+        parser = StreamParser(fixture.cmd, fixture.domain)
+        for start in range(0, len(fixture.output), 4096):
+            parser.feed(fixture.output[start:start + 4096])
+        parser.close()
+    return run, None
+ 
+ 
+def _log_stage(fmt: str, writer: str = 'sync'):
+    def stage(fixture, ctx):
+        logger = CmdLogger(f'bench-{fmt}-{writer}', format=fmt, writer=writer)
+        ctx['loggers'].append(logger)
+        # Parsing is measured by the parse stages, log pre-parsed results
+        results = zip_results(fixture.cmd, fixture.output, fixture.domain)
+ 
+        def drain():
+            while logger._write_q.empty() is False:
+                time.sleep(0.001)
+        # Only the hand off to the writer thread is timed, let it catch up between calls so the backlog
+        # stays bounded
+        setup = drain if writer == 'thread' else None
+        return lambda: logger.log_cmd(fixture.cmd, fixture.output, '', 0.1, fixture.domain, results=results), setup
+    return stage
+ 
+ 
+def _stage_log_stats_fields(fixture, ctx):
+    # The log_stats NDJSON fast path must match the records CmdLogger writes, else every line falls back
+    # to json.loads and the stage would silently time the wrong code
+    logger = CmdLogger(f'bench-fields-{fixture.name}', format='ndjson')
+    logger.log_cmd(fixture.cmd, fixture.output, '', 0.1, fixture.domain,
+                   results=zip_results(fixture.cmd, fixture.output, fixture.domain))
+    logger.close()
+    with open(logger.file_name, 'rb') as fid:
+        line = fid.readline()
+    if _fields(line) is None:
+        raise RuntimeError(f'log_stats NDJSON fast path does not match the CmdLogger record of {fixture.name}')
+    return lambda: _fields(line), None
+ 
+ 
+def _stage_pager(fixture, ctx):
+    channel = ReplayChannel(fixture.pages)
+ 
+    def run():
+        channel.rewind()
+        first = channel.send_command(fixture.cmd)
+        MorePager(channel, BASE_PROMPT, 60.0).collect(first)
+    return run, None
+ 
+ 
+def _stage_execute(fixture, ctx):
+    logger = CmdLogger('bench-execute', format='ndjson')
+    ctx['loggers'].append(logger)
+    conn = _replay_connection(fixture, logger)
+    sink = io.StringIO()
+ 
+    def run():
+        # execute prints a progress line per command
+        with redirect_stdout(sink):
+            conn.execute(fixture.cmd)
+        sink.seek(0)
+        sink.truncate()
+    def setup():
+        # Replay from the first page and parse for real, not from the result cache
+        conn.ssh.rewind()
+        result_cache.clear()
+    return run, setup
+ 
+ 
+def _stage_async_execute(fixture, ctx):
+    # AsyncConnection driven through the in-process NESimulator connector. The session is coalesced,
+    # so the command echo arrives in the same read as a whole response page
+    domain = 'admin' if fixture.domain == 'ne' else 'root'
+    sim = NESimulator(responses={domain: {fixture.cmd: fixture.output}}, page_lines=PAGE_LINES)
+    sim.start()
+    loop = asyncio.new_event_loop()
+    ctx['cleanup'] += [sim.stop, loop.close]
+    logger = CmdLogger('bench-async-execute', format='ndjson')
+    ctx['loggers'].append(logger)
+    conn = AsyncConnection('bench', domain, log_action=logger, timeout=10.0, read_timeout=10.0,
+                           connector=sim.connector(coalesce=True))
+    ctx['cleanup'].insert(0, lambda: loop.run_until_complete(conn.close()))
+    with redirect_stdout(io.StringIO()):
+        if loop.run_until_complete(conn.connect()) is False:
+            raise RuntimeError('AsyncConnection could not connect to the in-process NE simulator')
+        rtn = loop.run_until_complete(conn.execute(fixture.cmd))
+    if rtn['stdout'] != fixture.output:
+        raise RuntimeError(f'AsyncConnection response of {fixture.name} does not match the fixture: '
+                           f"{rtn.get('stderr')}")
+    return lambda: loop.run_until_complete(conn.execute(fixture.cmd)), None
+ 
+ 
+# stage name: builder(fixture, ctx) -> (timed callable, untimed per call setup or None)
+STAGES = {
+    'parse_cmd': _stage_parse_cmd,
+    'parse_cmd_cached': _stage_parse_cmd_cached,
+    'zip_results': _stage_zip_results,
+    'zip_results_columnar': _stage_zip_results_columnar,
+    'stream_parse': _stage_stream_parse,
+    'log_cmd_json': _log_stage('json'),
+    'log_cmd_ndjson': _log_stage('ndjson'),
+    'log_cmd_thread': _log_stage('ndjson', writer='thread'),
+    'log_stats_fields': _stage_log_stats_fields,
+    'pager': _stage_pager,
+    'execute': _stage_execute,
+    'async_execute': _stage_async_execute,
+    }
+ 
+ 
+def _percentile(values: list, pct: float) -> float:
+    return values[min(len(values) - 1, int(pct / 100 * len(values)))]
+ 
+ 
+def measure(run, setup=None, min_time: float = 0.5, min_iterations: int = 5, max_iterations: int = 10000) -> dict:
+    """
+    Time run() until min_time secs and min_iterations calls are reached, then measure the peak
+    memory of one more call with tracemalloc, which is not part of the timings. Untimed setup calls
+    count towards a wall clock limit of 4 * min_time
+ 
+    :return: dict - {'iterations', 'ops_per_sec', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'peak_kb'}
+    """
+    run()   # warm up caches, compiled templates, file handles...
+    samples = []
+    total = 0.0
+    wall_limit = time.perf_counter() + 4 * min_time
+    while len(samples) < max_iterations and (len(samples) < min_iterations or
+                                             (total < min_time and time.perf_counter() < wall_limit)):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        samples.append(elapsed)
+        total += elapsed
+ 
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+ 
+    samples.sort()
+    return {'iterations': len(samples),
+            'ops_per_sec': round(len(samples) / total, 2) if total > 0 else None,
+            'mean_ms': round(total / len(samples) * 1000, 4),
+            'p50_ms': round(_percentile(samples, 50) * 1000, 4),
+            'p95_ms': round(_percentile(samples, 95) * 1000, 4),
+            'p99_ms': round(_percentile(samples, 99) * 1000, 4),
+            'max_ms': round(samples[-1] * 1000, 4),
+            'peak_kb': round(peak / 1024, 1),
+            }
+ 
+ 
+def run_benchmarks(stages: list = None, fixtures: list = None, min_time: float = 0.5,
+                   project_templates: bool = False) -> dict:
+    """
+    :param stages: (Optional) stage names, default all
+    :param fixtures: (Optional) fixture names, default all
+    :param min_time: (Optional) min secs spent timing each (stage, fixture)
+    :param project_templates: (Optional) If True parse with the project templates, else with the
+                                templates shipped with the fixtures
+    :return: results dict - {'version', 'meta', 'results': {'<stage>/<fixture>': measurements}}
+    """
+    stages = list(STAGES) if stages is None else stages
+    unknown = [name for name in stages if name not in STAGES]
+    if bool(unknown) is True:
+        raise ValueError(f'Unknown stages {unknown} - valid stages {list(STAGES)}')
+    loaded = load_fixtures(fixtures)
+ 
+    saved_resolver = cmd_parser.template_resolver
+    if project_templates is False:
+        cmd_parser.template_resolver = fixture_resolver()
+    result_cache.clear()
+ 
+    # Loggers write to a scratch directory, removed at the end of the run
+    cwd = os.getcwd()
+    scratch = tempfile.mkdtemp(prefix='cmd_bench_')
+    ctx = {'loggers': [], 'cleanup': []}
+    results = {}
+    try:
+        os.chdir(scratch)
+        for stage in stages:
+            for fixture in loaded.values():
+                run, setup = STAGES[stage](fixture, ctx)
+                measured = measure(run, setup, min_time=min_time)
+                if measured['ops_per_sec'] is not None:
+                    measured['mb_per_sec'] = round(measured['ops_per_sec'] * fixture.size / 1e6, 2)
+                measured['bytes'] = fixture.size
+                results[f'{stage}/{fixture.name}'] = measured
+                print(f"{stage:<18} {fixture.name:<14} {measured['ops_per_sec']:>12} ops/s  "
+                      f"p50 {measured['p50_ms']:>10} ms  p99 {measured['p99_ms']:>10} ms  "
+                      f"peak {measured['peak_kb']:>10} KB")
+            for close in ctx['cleanup']:
+                close()
+            for logger in ctx['loggers']:
+                logger.close()
+            ctx['loggers'] = []
+            ctx['cleanup'] = []
+    finally:
+        for close in ctx['cleanup']:
+            close()
+        for logger in ctx['loggers']:
+            logger.close()
+        os.chdir(cwd)
+        shutil.rmtree(scratch, ignore_errors=True)
+        cmd_parser.template_resolver = saved_resolver
+        result_cache.clear()
+ 
+    return {'version': RESULTS_VERSION,
+            'meta': {'timestamp': str(datetime.datetime.now()),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'machine': platform.machine(),
+                     'min_time': min_time,
+                     'templates': 'project' if project_templates is True else 'fixtures',
+                     },
+            'results': results,
+            }
+ 
+ 
+def compare(current: dict, baseline: dict, threshold: float = 0.10) -> list:
+    """
+    Compare the p50 latency of each (stage, fixture) found in both runs
+ 
+    :param threshold: (Optional) relative p50 increase reported as a regression, 0.10 = 10% slower
+    :return: list of dicts - {'name', 'baseline_p50_ms', 'p50_ms', 'ratio', 'status'}
+                status is one of [regression | improvement | same]
+    """
+    rows = []
+    for name, cur in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if base is None or not base.get('p50_ms'):
+            continue
+        ratio = round(cur['p50_ms'] / base['p50_ms'], 3)
+        if ratio > 1 + threshold:
+            status = 'regression'
+        elif ratio < 1 - threshold:
+            status = 'improvement'
+        else:
+            status = 'same'
+        rows.append({'name': name, 'baseline_p50_ms': base['p50_ms'], 'p50_ms': cur['p50_ms'], 'ratio': ratio,
+                     'status': status})
+    return rows
+ 
+ 
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Parser, logger and execute benchmarks')
+    parser.add_argument('--stages', help=f'comma separated stage names, default all: {",".join(STAGES)}')
+    parser.add_argument('--fixtures', help='comma separated fixture names, default all')
+    parser.add_argument('--min-time', type=float, default=0.5, help='min secs timed per stage and fixture')
+    parser.add_argument('--output', help='write the results JSON to this file')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='baseline results JSON to compare against')
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.10, help='relative p50 increase flagged as regression')
+    parser.add_argument('--fail-on-regression', action='store_true', help='exit with status 1 on any regression')
+    parser.add_argument('--project-templates', action='store_true',
+                        help='parse with the project templates instead of the fixture templates')
+    args = parser.parse_args(argv)
+ 
+    current = run_benchmarks(stages=args.stages.split(',') if args.stages else None,
+                             fixtures=args.fixtures.split(',') if args.fixtures else None,
+                             min_time=args.min_time,
+                             project_templates=args.project_templates)
+    if args.output is not None:
+        with open(args.output, 'w') as fid:
+            json.dump(current, fid, indent=2)
+ 
+    regressions = []
+    if args.save_baseline is False and os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as fid:
+            baseline = json.load(fid)
+        print(f"\nCompared to baseline {args.baseline} ({baseline.get('meta', {}).get('timestamp')})")
+        differs = [key for key in ('platform', 'machine', 'python')
+                   if baseline.get('meta', {}).get(key) != current['meta'][key]]
+        if bool(differs) is True:
+            print(f"Baseline recorded with a different {', '.join(differs)}, the timings are not comparable. "
+                  f"Regenerate it here with --save-baseline")
+        for row in compare(current, baseline, threshold=args.threshold):
+            print(f"{row['name']:<34} {row['baseline_p50_ms']:>10} -> {row['p50_ms']:>10} ms  "
+                  f"x{row['ratio']:<7} {row['status']}")
+            if row['status'] == 'regression':
+                regressions.append(row)
+ 
+    if args.save_baseline is True:
+        with open(args.baseline, 'w') as fid:
+            json.dump(current, fid, indent=2)
+        print(f'\nBaseline saved to {args.baseline}')
+ 
+    return 1 if bool(regressions) is True and args.fail_on_regression is True else 0
+ 
+ 
+if __name__ == '__main__':
+    sys.exit(main())
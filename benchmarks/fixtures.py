@@ -0,0 +1,105 @@
+import os
+ 
+from utils.cmd_parser import TemplateResolver, Cmd_Normalize_Rules
+ 
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+ 
+# Templates for the fixture outputs, so the benchmarks do not depend on the project template tree.
+# Template names avoid characters that are not valid in file names on every platform
+TEMPLATE_DIRS = {
+    'root': os.path.join(FIXTURE_DIR, 'templates', 'root'),
+    'ne': os.path.join(FIXTURE_DIR, 'templates', 'ne'),
+    }
+CMD_MAP = {
+    'root': {'uptime': 'uptime'},
+    'ne': {'show card': 'show_card',
+           'show xc *': 'show_xc',
+           },
+    }
+ 
+BASE_PROMPT = 'NE-1'
+MORE_PROMPT = '\x1b[7m...more? y=[yes], n=[no]\x1b[0m'
+PAGE_LINES = 40
+ 
+ 
+def fixture_resolver() -> TemplateResolver:
+    return TemplateResolver(TEMPLATE_DIRS, CMD_MAP, Cmd_Normalize_Rules)
+ 
+ 
+class Fixture:
+    def __init__(self, name: str, cmd: str, domain: str, lines: list):
+        """
+        A recorded NE command response
+ 
+        :param name: fixture name used in the benchmark results
+        :param cmd: NE command string
+        :param domain: command domain [root | ne]
+        :param lines: response lines, without line terminators
+        """
+        self.name = name
+        self.cmd = cmd
+        self.domain = domain
+        self.output = '\n'.join(lines)
+        self.pages = self._paginate(lines)
+ 
+    @staticmethod
+    def _paginate(lines: list) -> list:
+        """
+        Split the response into the raw channel reads of a paged NE session. Every page but the last
+        ends with the more-prompt, a page that follows a more-prompt starts by erasing it, and the last
+        page ends with the NE prompt
+        """
+        pages = []
+        for start in range(0, max(1, len(lines)), PAGE_LINES):
+            page = '\r\n'.join(lines[start:start + PAGE_LINES])
+            if start > 0:
+                page = f'\r\x1b[K{page}'
+            if start + PAGE_LINES < len(lines):
+                page = f'{page}\r\n{MORE_PROMPT}'
+            else:
+                page = f'{page}\r\n{BASE_PROMPT}# '
+            pages.append(page)
+        return pages
+ 
+    @property
+    def size(self) -> int:
+        return len(self.output)
+ 
+ 
+def _read_lines(file_name: str) -> list:
+    with open(os.path.join(FIXTURE_DIR, file_name), 'r') as fid:
+        return fid.read().splitlines()
+ 
+ 
+def _xc_lines(rows: int) -> list:
+    """
+    Helper func - show xc * response with rows cross-connects, built from the recorded layout
+    """
+    lines = _read_lines('show_xc.txt')
+    header, sample = lines[:2], lines[2:]
+    out = list(header)
+    for i in range(rows):
+        shelf, slot, port = 1 + i // 960, 1 + (i // 80) % 12, 1 + i % 80
+        out.append(sample[i % len(sample)].format(shelf=shelf, slot=slot, port=port, dst_slot=1 + (slot % 12)))
+    out.append('')
+    out.append(f'Total cross-connects: {rows}')
+    return out
+ 
+ 
+def load_fixtures(names: list = None) -> dict:
+    """
+    :param names: (Optional) fixture names to load, default all
+    :return: {fixture name: Fixture} ordered from the smallest to the largest response
+    """
+    builders = {
+        'uptime': lambda: Fixture('uptime', 'uptime', 'root', _read_lines('uptime.txt')),
+        'show_card': lambda: Fixture('show_card', 'show card', 'ne', _read_lines('show_card.txt')),
+        'show_xc_500': lambda: Fixture('show_xc_500', 'show xc *', 'ne', _xc_lines(500)),
+        'show_xc_5000': lambda: Fixture('show_xc_5000', 'show xc *', 'ne', _xc_lines(5000)),
+        }
+    if names is None:
+        names = list(builders)
+    unknown = [name for name in names if name not in builders]
+    if bool(unknown) is True:
+        raise ValueError(f'Unknown fixtures {unknown} - valid fixtures {list(builders)}')
+    return {name: builders[name]() for name in names}
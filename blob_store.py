@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+ 
+# Default blob store directory, relative to the log file directory
+BLOB_DIR = 'blobs'
+BLOB_EXT = 'gz'
+ 
+ 
+class BlobRef:
+    """
+    Reference to a command output held in a BlobStore, the text is read back on load()
+    """
+    __slots__ = ('store', 'digest', 'length')
+ 
+    def __init__(self, store, digest: str, length: int):
+        self.store = store
+        self.digest = digest
+        self.length = length
+ 
+    def __repr__(self) -> str:
+        return f'BlobRef({self.digest}, {self.length} chars)'
+ 
+    def load(self) -> str:
+        return self.store.get(self.digest)
+ 
+ 
+class BlobStore:
+    def __init__(self, root: str = BLOB_DIR, compresslevel: int = 6, cache_size: int = 32, create: bool = True):
+        """
+        Content addressed store for large command outputs. Each distinct text is written once, gzip
+        compressed, to <root>/<digest[:2]>/<digest>.gz, where digest is the blake2b hash of the text.
+        The same output logged again, by any host or run sharing the store, only costs the hash.
+        Files are written to a temp name and renamed, so concurrent writers, threads or processes,
+        never expose a partial blob
+ 
+        :param root: (Optional) store directory, created when it does not exist
+        :param compresslevel: (Optional) gzip compression level
+        :param cache_size: (Optional) number of recently read texts kept in memory
+        :param create: (Optional) If False the root directory is not created, e.g. for read only use
+        """
+        self.root = root
+        self.compresslevel = compresslevel
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'written': 0, 'deduplicated': 0, 'reads': 0, 'cache_hits': 0}
+        if create is True:
+            os.makedirs(root, exist_ok=True)
+ 
+    @staticmethod
+    def digest(text: str) -> str:
+        return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=20).hexdigest()
+ 
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], f'{digest}.{BLOB_EXT}')
+ 
+    def put(self, text: str) -> BlobRef:
+        """
+        Store text, unless a blob with the same content is already present
+        :return: BlobRef of the text
+        """
+        digest = self.digest(text)
+        path = self.path(digest)
+        if os.path.isfile(path):
+            with self._lock:
+                self.stats['deduplicated'] += 1
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_name = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(tmp_name, 'wb') as fid:
+                fid.write(gzip.compress(text.encode('utf-8', 'surrogatepass'), compresslevel=self.compresslevel))
+            os.replace(tmp_name, path)
+            with self._lock:
+                self.stats['written'] += 1
+        return BlobRef(self, digest, len(text))
+ 
+    def get(self, digest: str) -> str:
+        """
+        :return: text of the blob
+        :raises FileNotFoundError: when the store has no blob with this digest
+        """
+        with self._lock:
+            self.stats['reads'] += 1
+            text = self._cache.get(digest)
+            if text is not None:
+                self.stats['cache_hits'] += 1
+                self._cache.move_to_end(digest)
+                return text
+        with open(self.path(digest), 'rb') as fid:
+            text = gzip.decompress(fid.read()).decode('utf-8', 'surrogatepass')
+        if self.cache_size > 0:
+            with self._lock:
+                self._cache[digest] = text
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return text
+ 
+    def resolve(self, entry: dict) -> dict:
+        """
+        Return the log entry with a stored stdout, 'stdout_blob' and 'stdout_len' fields, replaced by the
+        stdout text. Entries without a stored stdout, or whose blob is missing, are returned unchanged
+        """
+        if 'stdout_blob' not in entry:
+            return entry
+        try:
+            stdout = self.get(entry['stdout_blob'])
+        except OSError:
+            return entry
+        rtn = {}
+        for key, value in entry.items():
+            if key == 'stdout_blob':
+                rtn['stdout'] = stdout
+            elif key != 'stdout_len':
+                rtn[key] = value
+        return rtn
@@ -1,10 +1,22 @@
+import atexit
+import gzip
+import hashlib
 import json
 import os
+import shutil
 import re
 import datetime
 import queue
+import time
+import threading
+import weakref
+from collections.abc import ItemsView, KeysView, Mapping, ValuesView
+from concurrent.futures import Future
  
-from utils.cmd_parser import parse_cmd, to_dict, zip_results
+from utils.blob_store import BlobRef, BlobStore
+from utils.cmd_parser import parse_cmd, to_dict, zip_results, diff_results, diff_stdout
+from utils.log_db import SQLiteSink
+from utils.timing import emit_timing, has_timing_hooks, lap
  
 RUN_START = datetime.datetime.now()   # Record the start time for the current run. Used to calculate elapsed time
 HOST_TZ = datetime.datetime.now(datetime.timezone.utc).astimezone().tzname()  # TZ for the machine running the app
@@ -44,6 +56,35 @@ def _file_max_suffix(pattern: str, ext='json') -> str:
     :param ext: (Optional) File extension
     :return: file suffix as noted above
     """
+    matching_file_suffix = _file_suffixes(pattern, ext)
+ 
+    if bool(matching_file_suffix) is False:
+        # the file pattern does not exist
+        return f'{pattern}.{ext}'
+    else:
+        # File pattern exists, return one more than the current max matched file suffix
+        return f'{pattern}-{max(matching_file_suffix) + 1}.{ext}'
+ 
+def _file_last_suffix(pattern: str, ext='json'):
+    """
+    Looks for files that match pattern and return the name of the file with the max suffix
+    (e.g. file-10.json), or None if no file matches the pattern
+ 
+    :param pattern: file pattern
+    :param ext: (Optional) File extension
+    :return: file name or None
+    """
+    matching_file_suffix = _file_suffixes(pattern, ext)
+    if bool(matching_file_suffix) is False:
+        return None
+    last = max(matching_file_suffix)
+    return f'{pattern}.{ext}' if last == 0 else f'{pattern}-{last}.{ext}'
+ 
+def _file_suffixes(pattern: str, ext='json') -> list:
+    """
+    Helper func - returns the integer suffix of every file in the CWD that matches pattern,
+    a file without a suffix is reported as 0
+    """
     matching_file_suffix = []   # array to hold file name suffix
     pattern_re = re.compile(f'({pattern})-?([0-9]*).{ext}')
  
@@ -59,13 +100,7 @@ def _file_max_suffix(pattern: str, ext='json') -> str:
         elif match.group(1) == pattern and match.group(2) != '':
             # Add suffix for the file whose name matches pattern
             matching_file_suffix.append(int(match.group(2)))
- 
-    if bool(matching_file_suffix) is False:
-        # the file pattern does not exist
-        return f'{pattern}.{ext}'
-    else:
-        # File pattern exists, return one more than the current max matched file suffix
-        return f'{pattern}-{max(matching_file_suffix) + 1}.{ext}'
+    return matching_file_suffix
  
 def _json_prefix() -> str:
     return '[\n'
@@ -75,44 +110,783 @@ def _json_suffix() -> str:
     return '\n{ }]'
  
  
-# ToDo: add param to change location of default dir for log files from CWD to somewhere else
+# Supported log file formats
+#   json   - legacy pretty printed JSON array, readable once the logger is closed
+#   ndjson - newline delimited JSON, one compact record per line, readable while being written
+LOG_FORMATS = ('json', 'ndjson')
+ 
+def _format_entry(entry: dict, fmt: str) -> str:
+    """
+    Serialize a single log entry for the log file format fmt
+    """
+    if isinstance(entry, LogRecord):
+        return entry.to_json(fmt)
+    if fmt == 'ndjson':
+        return f"{json.dumps(entry, separators=(',', ':'))}\n"
+    return f"\t\t{json.dumps(entry, indent=4)}{_json_delim()}"
+ 
+def iter_log_file(file_name: str, chunk_size: int = 1 << 20):
+    """
+    Generator - lazily yields the records of a CmdLogger file in either format. Legacy JSON files do
+    not need to be terminated and the {} end of file sentinel is skipped. NDJSON lines that are not
+    complete records, e.g. a torn write ahead of an append, are skipped
+ 
+    :param file_name: log file name
+    :param chunk_size: (Optional) legacy JSON read size in chars
+    :return: log entry dicts
+    """
+    with open(file_name, 'r') as fid:
+        first = fid.read(1)
+        while first.isspace():
+            first = fid.read(1)
+        fid.seek(0)
+        if first == '[':
+            yield from _iter_json_array(fid, chunk_size)
+            return
+        for line in fid:
+            if line.strip() == '':
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if bool(entry) is True:
+                yield entry
+ 
+def _iter_json_array(fid, chunk_size: int):
+    """
+    Helper func - incrementally decode the records of a legacy JSON array log file
+    """
+    decoder = json.JSONDecoder()
+    buf = fid.read(chunk_size)
+    pos = 0
+    eof = len(buf) < chunk_size
+    while True:
+        # Skip separators between records: whitespace, the array brackets and delimiters
+        while pos < len(buf) and buf[pos] in ' \t\r\n,[]':
+            pos += 1
+        if pos >= len(buf):
+            if eof is True:
+                return
+            buf, pos = fid.read(chunk_size), 0
+            eof = len(buf) < chunk_size
+            continue
+        try:
+            entry, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof is True:
+                # Truncated record at the end of a file still being written
+                return
+            more = fid.read(chunk_size)
+            eof = len(more) < chunk_size
+            buf, pos = buf[pos:] + more, 0
+            continue
+        pos = end
+        if bool(entry) is True:
+            yield entry
+ 
+def json_to_ndjson(src: str, dst: str = None) -> str:
+    """
+    Convert a legacy JSON array log file to NDJSON
+ 
+    :param src: legacy log file name
+    :param dst: (Optional) output file name, defaults to src with a .ndjson extension
+    :return: output file name
+    """
+    if dst is None:
+        dst = f'{os.path.splitext(src)[0]}.ndjson'
+    with open(dst, 'w') as fid:
+        for entry in iter_log_file(src):
+            fid.write(_format_entry(entry, 'ndjson'))
+    return dst
+ 
+def ndjson_to_json(src: str, dst: str = None) -> str:
+    """
+    Convert an NDJSON log file to the legacy JSON array format
+ 
+    :param src: NDJSON log file name
+    :param dst: (Optional) output file name, defaults to src with a .json extension
+    :return: output file name
+    """
+    if dst is None:
+        dst = f'{os.path.splitext(src)[0]}.json'
+    with open(dst, 'w') as fid:
+        fid.write(_json_prefix())
+        for entry in iter_log_file(src):
+            fid.write(_format_entry(entry, 'json'))
+        fid.write(_json_suffix())
+    return dst
+ 
+ 
+_MISSING = object()     # LogRecord lookup default
+ 
+ 
+class _RecordContext:
+    """
+    Helper class - LogRecord fields that are the same for every record of a logger, stored once per logger
+    """
+    __slots__ = ('host', 'timezone_host')
+ 
+    def __init__(self, host: str):
+        self.host = host
+        self.timezone_host = HOST_TZ
+ 
+ 
+class LogRecord(dict):
+    """
+    Log entry built by CmdLogger.build_log_entry and returned by log_cmd. It is a dict with the keys, and
+    key order, of the log file record, so callers can index into it, json.dumps it or update it like the
+    plain dict it replaces.
+ 
+    The record keeps the creation time as a float, timestamp and elapsed_time strings are only formatted
+    when accessed or written, and host / timezone_host are read from the logger context shared by all of
+    the logger's records. These lazy fields are not in the dict storage, every dict method is overridden
+    to include them; assigning or deleting one replaces the lazy value. The JSON text is built when the
+    record is written, and reused until the record is changed.
+ 
+    A stdout kept in a BlobStore is held as a BlobRef and read back when record['stdout'] is accessed.
+    to_dict() and the log file record carry 'stdout_blob' (digest) and 'stdout_len' in its place
+    """
+    # Log file keys in log file order
+    KEYS = ('timestamp', 'host', 'stdin', 'stdout', 'stderr', 'results', 'cmd_duration (secs)',
+            'elapsed_time (h:m:s)', 'timezone_NE', 'timezone_host', 'domain', 'telnet_host', 'phases (secs)')
+    LAZY = ('timestamp', 'host', 'elapsed_time (h:m:s)', 'timezone_host')
+    _KEY_SET = frozenset(KEYS)
+    __slots__ = ('_ctx', '_created', '_lazy_keys', '_json')
+ 
+    def __init__(self, ctx: _RecordContext, created: float, stdin: str, stdout: str, stderr: str, results: dict,
+                 cmd_duration: float, timezone_NE: str, domain: str, telnet_host: str = None, phases: dict = None):
+        """
+        :param ctx: context of the logger that built the record
+        :param created: time.time() the record was built
+        """
+        super().__init__()
+        self._ctx = ctx
+        self._created = created
+        self._lazy_keys = self.LAZY
+        self._json = None       # (format, serialized text)
+        setitem = dict.__setitem__
+        setitem(self, 'stdin', stdin)
+        setitem(self, 'stdout', stdout)
+        setitem(self, 'stderr', stderr)
+        setitem(self, 'results', results)
+        setitem(self, 'cmd_duration (secs)', cmd_duration)
+        setitem(self, 'timezone_NE', timezone_NE)
+        setitem(self, 'domain', domain)
+        if telnet_host is not None:
+            setitem(self, 'telnet_host', telnet_host)
+        if bool(phases) is True:
+            setitem(self, 'phases (secs)', phases)
+ 
+    def _lazy(self, key: str):
+        if key == 'timestamp':
+            return str(datetime.datetime.fromtimestamp(self._created))
+        if key == 'elapsed_time (h:m:s)':
+            return str(datetime.datetime.fromtimestamp(self._created) - RUN_START)
+        if key == 'host':
+            return self._ctx.host
+        return self._ctx.timezone_host
+ 
+    def _drop_lazy(self, key) -> None:
+        if key in self._lazy_keys:
+            self._lazy_keys = tuple(k for k in self._lazy_keys if k != key)
+ 
+    def __getitem__(self, key):
+        if key in self._lazy_keys:
+            return self._lazy(key)
+        value = dict.__getitem__(self, key)
+        if value.__class__ is BlobRef:
+            return value.load()
+        return value
+ 
+    def __setitem__(self, key, value) -> None:
+        self._json = None
+        self._drop_lazy(key)
+        dict.__setitem__(self, key, value)
+ 
+    def __delitem__(self, key) -> None:
+        if key in self._lazy_keys:
+            self._json = None
+            self._drop_lazy(key)
+            return
+        dict.__delitem__(self, key)
+        self._json = None
+ 
+    def __contains__(self, key) -> bool:
+        return key in self._lazy_keys or dict.__contains__(self, key)
+ 
+    def __iter__(self):
+        lazy = self._lazy_keys
+        for key in self.KEYS:
+            if key in lazy or dict.__contains__(self, key):
+                yield key
+        for key in dict.__iter__(self):
+            if key not in self._KEY_SET:
+                yield key
+ 
+    def __reversed__(self):
+        return reversed(list(self))
+ 
+    def __len__(self) -> int:
+        return dict.__len__(self) + len(self._lazy_keys)
+ 
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+ 
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Mapping) is False:
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+ 
+    def __ne__(self, other) -> bool:
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+ 
+    __hash__ = None
+ 
+    def __reduce__(self):
+        # Pickles, e.g. for a process pool, and deep copies as a plain dict
+        return dict, (self.to_dict(),)
+ 
+    def __copy__(self):
+        return self.copy()
+ 
+    def __or__(self, other):
+        if isinstance(other, Mapping) is False:
+            return NotImplemented
+        rtn = dict(self.items())
+        rtn.update(other)
+        return rtn
+ 
+    def __ror__(self, other):
+        if isinstance(other, Mapping) is False:
+            return NotImplemented
+        rtn = dict(other)
+        rtn.update(self.items())
+        return rtn
+ 
+    def __ior__(self, other):
+        self.update(other)
+        return self
+ 
+    def keys(self):
+        return KeysView(self)
+ 
+    def values(self):
+        return ValuesView(self)
+ 
+    def items(self):
+        return ItemsView(self)
+ 
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+ 
+    def pop(self, key, default=_MISSING):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        if default is _MISSING:
+            raise KeyError(key)
+        return default
+ 
+    def popitem(self) -> tuple:
+        keys = list(self)
+        if bool(keys) is False:
+            raise KeyError('popitem(): record is empty')
+        return keys[-1], self.pop(keys[-1])
+ 
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+ 
+    def update(self, other=(), **kwargs) -> None:
+        if isinstance(other, Mapping) is True:
+            other = other.items()
+        elif hasattr(other, 'keys') is True:
+            other = [(key, other[key]) for key in other.keys()]
+        for key, value in other:
+            self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+ 
+    def clear(self) -> None:
+        self._json = None
+        self._lazy_keys = ()
+        dict.clear(self)
+ 
+    def copy(self):
+        """
+        Shallow copy, field values are shared
+        """
+        rtn = LogRecord.__new__(LogRecord)
+        dict.update(rtn, dict.items(self))
+        for slot in self.__slots__:
+            setattr(rtn, slot, getattr(self, slot))
+        return rtn
+ 
+    @property
+    def raw_stdout(self):
+        """
+        stdout as stored, the text or its BlobRef, which record['stdout'] would read back
+        """
+        return dict.get(self, 'stdout')
+ 
+    @raw_stdout.setter
+    def raw_stdout(self, value) -> None:
+        self._json = None
+        dict.__setitem__(self, 'stdout', value)
+ 
+    def to_dict(self) -> dict:
+        rtn = {}
+        for key in self:
+            if key in self._lazy_keys:
+                rtn[key] = self._lazy(key)
+                continue
+            value = dict.__getitem__(self, key)
+            if value.__class__ is BlobRef:
+                rtn['stdout_blob'] = value.digest
+                rtn['stdout_len'] = value.length
+                continue
+            rtn[key] = value
+        return rtn
+ 
+    def to_json(self, fmt: str) -> str:
+        """
+        Serialize the record for the log file format fmt, see _format_entry
+        """
+        cached = self._json
+        if cached is not None and cached[0] == fmt:
+            return cached[1]
+        text = _format_entry(self.to_dict(), fmt)
+        self._json = (fmt, text)
+        return text
+ 
+ 
 class CmdLogger:
-    def __init__(self, host: str, action: str = 'open'):
+    def __init__(self, host: str, action: str = 'open', deferred_parse: bool = False, parse_workers: int = 2,
+                 writer: str = 'sync', flush_interval: float = 1.0, batch_size: int = 100, fsync: str = 'never',
+                 format: str = 'json', rotate_bytes: int = None, rotate_secs: float = None, compress: bool = True,
+                 delta: str = None, delta_full_every: int = 60, sink=None, blob_store=None,
+                 blob_threshold: int = 65536):
         """
         :param host: IP Address
         :param action:  - Open new log file (open)
-                        - append to previously opened file (append)
-        :param domain: used to direct the command parser to the correct template file
+                        - append to previously opened file (append), ndjson format only
+        :param deferred_parse: (Optional) If True, log_cmd writes the raw record immediately and the
+                                command response is parsed by a pool of worker threads. The parsed
+                                results are available through results_future() and are appended to
+                                the log file when the logger is closed
+        :param parse_workers: (Optional) Number of parse worker threads used when deferred_parse is True
+        :param writer: (Optional) - Write each record on the calling thread (sync)
+                                  - Queue records to a background writer thread that writes them in batches (thread)
+        :param flush_interval: (Optional) writer='thread' only, max secs a queued record waits before it is written
+        :param batch_size: (Optional) writer='thread' only, max number of records written per batch
+        :param fsync: (Optional) - Leave syncing to the OS (never)
+                                 - os.fsync the log file after every write/batch (batch)
+                                 - os.fsync the log file only when the logger is closed (close)
+        :param format: (Optional) - Pretty printed JSON array (json)
+                                  - Newline delimited JSON, one compact record per line (ndjson)
+        :param rotate_bytes: (Optional) Start a new log file segment once the current one reaches this size
+        :param rotate_secs: (Optional) Start a new log file segment once the current one is this many secs old.
+                                Checked when a record is written
+        :param compress: (Optional) When rotation is enabled, gzip closed segments on a background thread
+                                Segments are tracked in log-<host>-<date>.manifest.json
+        :param delta: (Optional) Change-only logging for polled commands, tracked per (host, command, domain)
+                                - Always write the full record (None)
+                                - Write a compact record marked 'delta': 'unchanged' when stdout is the same
+                                  as last time, the output is not parsed again (marker)
+                                - As marker, and when stdout changed write the row level difference of the
+                                  parsed results and the line level difference of stdout, 'delta': 'diff',
+                                  instead of the full record (diff). The full record is written when the
+                                  parsed results did not change or most of stdout did
+                                Compact records carry 'delta_of', the timestamp of the record they refer to
+        :param delta_full_every: (Optional) Write a full record after this many compact records of a command,
+                                so a reader starting mid-file can resynchronize
+        :param sink: (Optional) SQLiteSink, or the file name of a SQLite database, records are written to the
+                                database instead of a log file. A sink created from a file name is closed
+                                with the logger, a shared SQLiteSink is left open
+        :param blob_store: (Optional) BlobStore, or its directory name, command outputs of blob_threshold chars
+                                or more are stored in it once, compressed, and the record keeps their digest
+                                and length ('stdout_blob', 'stdout_len'). log_reader resolves them on read
+        :param blob_threshold: (Optional) min stdout size (chars) kept in the blob store
         """
         self.host = host
         self.action = action
         self.timezone_NE = 'not set'
+        self._record_ctx = _RecordContext(host)
         self._log_fid = None
+        self._closed = False
+        # Held while log_cmd checks _closed and queues work and while close() sets it, so nothing is
+        # queued behind the sentinels close() posts
+        self._queue_lock = threading.Lock()
+        self.writer = writer
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self.fsync = fsync
+        self.format = format
+        self._write_lock = threading.Lock()
+        self._write_q = None
+        self._writer_thread = None
+        self.file_name = None
+        self._owns_sink = isinstance(sink, str)
+        self._sink = SQLiteSink(sink) if isinstance(sink, str) else sink
+        self.blob_store = BlobStore(blob_store) if isinstance(blob_store, str) else blob_store
+        self.blob_threshold = blob_threshold
+ 
+        # Log rotation state. Segment counters are only updated under _write_lock, the manifest is
+        # also updated by the compression thread and has its own lock
+        self.rotate_bytes = rotate_bytes
+        self.rotate_secs = rotate_secs
+        self.compress = compress
+        self._rotate = rotate_bytes is not None or rotate_secs is not None
+        self._segment = None
+        self._manifest = None
+        self._manifest_name = None
+        self._manifest_lock = threading.Lock()
+        self._compress_q = None
+        self._compress_thread = None
+ 
+        # Deferred parse state. Jobs are handed to the workers through a _Log_Q queue, completed
+        # entries are held until close. Futures are only kept alive while a job is pending or a
+        # caller holds a reference to them
+        self.deferred_parse = deferred_parse
+        self._parse_q = None
+        self._parse_workers = []
+        self._parse_id = 0
+        self._parsed_entries = []
+        self._futures = weakref.WeakValueDictionary()
+        self._parse_lock = threading.Lock()
+ 
+        # Change-only logging state, (host, stdin, domain): {'digest', 'entry', 'count'}
+        self.delta = delta
+        self.delta_full_every = max(1, delta_full_every)
+        self._delta_last = {}
+        self._delta_lock = threading.Lock()
+        if delta not in (None, 'marker', 'diff'):
+            raise LoggerAttributeError(delta, message="Valid delta modes [None | marker | diff]")
+        if writer not in ('sync', 'thread'):
+            raise LoggerAttributeError(writer, message="Valid writer modes [sync | thread]")
+        if fsync not in ('never', 'batch', 'close'):
+            raise LoggerAttributeError(fsync, message="Valid fsync policies [never | batch | close]")
+        if format not in LOG_FORMATS:
+            raise LoggerAttributeError(format, message="Valid log formats [json | ndjson]")
+ 
+        if self.deferred_parse is True:
+            self._parse_q = _Log_Q()
+            for _ in range(max(1, parse_workers)):
+                worker = threading.Thread(target=self._parse_worker, name=f'CmdLogger-parse-{self.host}', daemon=True)
+                worker.start()
+                self._parse_workers.append(worker)
  
         # Produce date suffix for the file as yyyy_mm-dd
-        # Although file writes are not thread-safe multiple shells opened within the same user script
-        # run synchronously, hence multiple shells can use the same logger safely
+        # File writes are serialized by _write_lock, so multiple shells, including shells driven from
+        # different threads, can use the same logger safely
         date = datetime.datetime.today().strftime("%Y_%m_%d")
-        if self.action.lower() == 'open':
-            file_name = _file_max_suffix(f'log-{self.host}-{date}')
-            self._log_fid = open(file_name, 'w')
-            self._log_fid.write(_json_prefix())
-            self._log_fid.flush()
+        if self._sink is not None and self.action.lower() in ('open', 'append'):
+            # Records go to the database, there is no log file
+            pass
+        elif self.action.lower() == 'open':
+            self._open_segment(_file_max_suffix(f'log-{self.host}-{date}', ext=self.format), 'w')
         elif self.action.lower() == 'append':
             if self._log_fid is not None:
                 LoggerAttributeError(action, message = "Append action required prior to open file")
+            # NDJSON records are self-contained lines, so the latest log file for the host can be
+            # extended in place. Terminate a partially written last line before appending
+            file_name = _file_last_suffix(f'log-{self.host}-{date}', ext=self.format)
+            if self.format == 'ndjson' and file_name is not None:
+                self._open_segment(file_name, 'a+')
         else:
             raise LoggerAttributeError(self.action)
  
+        if self._rotate is True and self._log_fid is not None:
+            self._manifest_name = f'log-{self.host}-{date}.manifest.json'
+            self._manifest = {'host': self.host, 'format': self.format, 'segments': []}
+            if os.path.isfile(self._manifest_name):
+                with open(self._manifest_name, 'r') as fid:
+                    self._manifest = json.load(fid)
+            if self.compress is True:
+                self._compress_q = _Log_Q()
+                self._compress_thread = threading.Thread(target=self._compress_worker,
+                                                         name=f'CmdLogger-compress-{self.host}', daemon=True)
+                self._compress_thread.start()
+ 
+        if self.writer == 'thread':
+            self._write_q = _Log_Q()
+            self._writer_thread = threading.Thread(target=self._write_worker, name=f'CmdLogger-writer-{self.host}',
+                                                   daemon=True)
+            self._writer_thread.start()
+ 
+        # Background threads hold a reference to the logger, so __del__ will not run while they are
+        # alive. Make sure queued work is drained and the file terminated at interpreter exit
+        if self._parse_workers or self._writer_thread is not None or self._compress_thread is not None:
+            atexit.register(self.close)
+ 
+    def __enter__(self):
+        return self
+ 
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+ 
     def __del__(self):
         try:
-            self._close
+            self.close()
         except AttributeError:
             raise
  
-    def _close(self):
-        self._log_fid.write(_json_suffix())
+    def close(self) -> None:
+        """
+        Wait for any deferred parse jobs to complete and write their parsed entries, drain the
+        writer queue and terminate the log file. Safe to call more than once
+        """
+        with self._queue_lock:
+            if self._closed is True:
+                return
+            self._closed = True
+ 
+        if self._parse_q is not None:
+            for _ in self._parse_workers:
+                self._parse_q.put(None)
+            for worker in self._parse_workers:
+                worker.join()
+            if bool(self._parsed_entries) is True:
+                self._emit(self._parsed_entries)
+                self._parsed_entries = []
+ 
+        if self._writer_thread is not None:
+            self._write_q.put(None)
+            self._writer_thread.join()
+ 
+        with self._write_lock:
+            if self._log_fid is not None:
+                self._close_segment()
+            if self._sink is not None and self._owns_sink is True:
+                self._sink.close()
+ 
+        if self._compress_thread is not None:
+            self._compress_q.put(None)
+            self._compress_thread.join()
+ 
+        if self._parse_workers or self._writer_thread is not None or self._compress_thread is not None:
+            atexit.unregister(self.close)
+ 
+    def _open_segment(self, file_name: str, mode: str) -> None:
+        """
+        Open file_name as the current log file (segment) and write the format prefix. Mode 'a+'
+        extends an existing NDJSON file, terminating a partially written last line first
+        """
+        self.file_name = file_name
+        self._log_fid = open(file_name, mode)
+        if mode == 'a+':
+            if self._log_fid.tell() > 0:
+                self._log_fid.seek(self._log_fid.tell() - 1)
+                if self._log_fid.read(1) != '\n':
+                    self._log_fid.write('\n')
+        elif self.format == 'json':
+            self._log_fid.write(_json_prefix())
+        self._log_fid.flush()
+        self._segment = {'file': file_name,
+                         'start': str(datetime.datetime.now()),
+                         'records': 0,
+                         'bytes': self._log_fid.tell(),
+                         'opened': time.monotonic(),
+                         }
+ 
+    def _close_segment(self) -> None:
+        """
+        Terminate and close the current log file segment. When rotation is enabled the segment
+        is added to the manifest and queued for compression. Caller must hold _write_lock
+        """
+        if self.format == 'json':
+            self._log_fid.write(_json_suffix())
+        self._log_fid.flush()
+        if self.fsync != 'never':
+            os.fsync(self._log_fid.fileno())
         self._log_fid.close()
+        self._log_fid = None
+        # Includes the format suffix
+        self._segment['bytes'] = os.path.getsize(self._segment['file'])
+ 
+        if self._manifest is not None:
+            segment = {'file': self._segment['file'],
+                       'start': self._segment['start'],
+                       'end': str(datetime.datetime.now()),
+                       'records': self._segment['records'],
+                       'bytes': self._segment['bytes'],
+                       'compressed': False,
+                       }
+            with self._manifest_lock:
+                self._manifest['segments'].append(segment)
+                self._write_manifest()
+            if self._compress_q is not None:
+                self._compress_q.put(segment)
+ 
+    def _rotate_segment(self) -> None:
+        """
+        Close the current segment and open the next one. Caller must hold _write_lock
+        """
+        self._close_segment()
+        date = datetime.datetime.today().strftime("%Y_%m_%d")
+        self._open_segment(_file_max_suffix(f'log-{self.host}-{date}', ext=self.format), 'w')
+ 
+    def _write_manifest(self) -> None:
+        """
+        Atomically replace the segment manifest file. Caller must hold _manifest_lock
+        """
+        tmp_name = f'{self._manifest_name}.tmp'
+        with open(tmp_name, 'w') as fid:
+            json.dump(self._manifest, fid, indent=4)
+        os.replace(tmp_name, self._manifest_name)
+ 
+    def _compress_worker(self) -> None:
+        """
+        Background compression thread. gzips closed segments queued by _close_segment, removes the
+        uncompressed file and updates the manifest, until it receives the None sentinel posted by close()
+        """
+        while True:
+            segment = self._compress_q.get()
+            if segment is None:
+                break
+            gz_name = f"{segment['file']}.gz"
+            try:
+                with open(segment['file'], 'rb') as src, gzip.open(gz_name, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(segment['file'])
+            except OSError as err:
+                print(f'Log segment compression failed - {segment["file"]}: {err}')
+                continue
+            with self._manifest_lock:
+                segment['file'] = gz_name
+                segment['compressed'] = True
+                segment['compressed_bytes'] = os.path.getsize(gz_name)
+                self._write_manifest()
+ 
+    def _write_entries(self, entries: list) -> None:
+        """
+        Serialize and write a batch of log entries as a single write, then flush (and fsync
+        when fsync='batch'). With a sink the batch is inserted in one database transaction instead
+        """
+        if self._sink is not None:
+            with self._write_lock:
+                if self._sink.closed is True:
+                    FileNotOpen()
+                    return
+                self._sink.write(entries)
+            return
+        text = ''.join(_format_entry(entry, self.format) for entry in entries)
+        with self._write_lock:
+            if self._log_fid is None:
+                FileNotOpen()
+                return
+            self._log_fid.write(text)
+            self._log_fid.flush()
+            if self.fsync == 'batch':
+                os.fsync(self._log_fid.fileno())
+ 
+            self._segment['records'] += len(entries)
+            # Bytes, not chars, written. isascii() is a flag check, only non-ASCII text is encoded to count it
+            if text.isascii() is True:
+                self._segment['bytes'] += len(text)
+            else:
+                self._segment['bytes'] += len(text.encode(self._log_fid.encoding, self._log_fid.errors))
+            if self._rotate is True:
+                if (self.rotate_bytes is not None and self._segment['bytes'] >= self.rotate_bytes) or \
+                        (self.rotate_secs is not None and
+                         time.monotonic() - self._segment['opened'] >= self.rotate_secs):
+                    self._rotate_segment()
+ 
+    def _emit(self, entries: list) -> None:
+        """
+        Hand log entries to the writer thread, or write them now in sync mode
+        """
+        if self._writer_thread is not None:
+            for entry in entries:
+                self._write_q.put(entry)
+        else:
+            self._write_entries(entries)
+ 
+    def _write_worker(self) -> None:
+        """
+        Background writer thread. Collects queued entries into batches of up to batch_size records,
+        waiting at most flush_interval secs after the first record of a batch, and writes each batch
+        with one call. Exits after writing everything queued ahead of the None sentinel posted by close()
+        """
+        stop = False
+        while stop is False:
+            batch = [self._write_q.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1] is not None and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._write_q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stop = True
+                batch.pop()
+            if bool(batch) is True:
+                self._write_entries(batch)
+ 
+    def _parse_worker(self) -> None:
+        """
+        Deferred parse worker thread. Takes (log entry, domain, future) jobs from the parse queue
+        until it receives the None sentinel posted by close()
+        """
+        while True:
+            job = self._parse_q.get()
+            if job is None:
+                break
+            self._parse_job(*job)
+ 
+    def _parse_job(self, rtn, domain: str, future: Future, write: bool = False) -> None:
+        """
+        Helper func - parse the response of a deferred log entry and resolve its future
+ 
+        :param write: (Optional) If True write the parsed entry now, e.g. once close() has flushed the
+                        parsed entries, else keep it for close()
+        """
+        phases = {}
+        try:
+            dict_output = zip_results(rtn['stdin'], rtn['stdout'], domain, phases=phases)
+        except Exception as err:
+            future.set_exception(err)
+            return
+        rtn['results'] = dict_output
+        parsed = {'timestamp': str(datetime.datetime.now()),
+                  'host': rtn['host'],
+                  'stdin': rtn['stdin'],
+                  'domain': domain,
+                  'parse_id': rtn['parse_id'],
+                  'parse_of': rtn['timestamp'],
+                  'results': dict_output,
+                  'phases (secs)': phases,
+                  }
+        if write is True:
+            self._write_entries([parsed])
+        else:
+            with self._parse_lock:
+                self._parsed_entries.append(parsed)
+        future.set_result(dict_output)
+ 
+    def results_future(self, rtn: dict) -> Future:
+        """
+        Return a future for the parsed results of a log entry returned by log_cmd. For entries
+        that were parsed inline, or whose deferred parse has already completed, the future is
+        already done
+ 
+        :param rtn: Log entry returned by log_cmd
+        :return: concurrent.futures.Future resolving to the entry's parsed results dict
+        """
+        future = self._futures.get(rtn.get('parse_id'))
+        if future is None:
+            future = Future()
+            future.set_result(rtn.get('results', {}))
+        return future
  
     def log_comment(self, cmt: str, telnet_host: str = None) -> None:
         """
@@ -124,7 +898,8 @@ class CmdLogger:
         """
         self.log_cmd(f'Comment: {cmt}', 'na', 'na', 0.0, 'na', telnet_host=telnet_host)
  
-    def build_log_entry(self, stdin: str, stdout: str, stderr: str, cmd_duration: float, domain: str, telnet_host: str = None) -> dict:
+    def build_log_entry(self, stdin: str, stdout: str, stderr: str, cmd_duration: float, domain: str, telnet_host: str = None,
+                        parse: bool = True, results: dict = None, phases: dict = None) -> LogRecord:
         """
         Helper function of log_cmd and use utility to construct a log entry
         NOTE: Params must align with those of log_cmd
@@ -135,30 +910,100 @@ class CmdLogger:
         :param cmd_duration: duration of command execution in secs
         :param telnet_host: (Optional) IP address of telnet host when a telnet session
                                         through existing SSH session is in-use
-        :return: dict - last log result
+        :param parse: (Optional) If False the results field is left empty, used by deferred parsing
+        :param results: (Optional) Already parsed results, stdout is not parsed again
+        :param phases: (Optional) phase durations (secs) of the command, parse phases are added to it and it
+                                is recorded in the entry as 'phases (secs)'
+        :return: LogRecord - last log result
         """
  
         # convert the parsed command output results and list of tuples contain (header, parsed values) into a
         # dictionary with all header values representing the key for all values returned
-        dict_output = zip_results(stdin,  stdout, domain)
+        if results is not None:
+            dict_output = results
+        else:
+            dict_output = zip_results(stdin,  stdout, domain, phases=phases) if parse is True else {}
  
         # Build the complete log entry
-        rtn = {'timestamp': str(datetime.datetime.now()),
-                'host': self.host,
-                'stdin': str(stdin),
-                'stdout': str(stdout),
-                'stderr': str(stderr),
-                'results': dict_output,
-                'cmd_duration (secs)': cmd_duration,
-                'elapsed_time (h:m:s)': str(datetime.datetime.now() - RUN_START),
-                'timezone_NE': self.timezone_NE,
-                'timezone_host': HOST_TZ,
-               }
-        if telnet_host is not None:
-            rtn.update({'telnet_host': telnet_host})
-        return rtn
+        return LogRecord(self._record_ctx, time.time(), str(stdin), self._store_stdout(stdout), str(stderr), dict_output,
+                         cmd_duration, self.timezone_NE, domain, telnet_host=telnet_host, phases=phases)
  
-    def log_cmd(self, stdin: str, stdout: str, stderr: str, cmd_duration: float, domain: str, telnet_host: str = None) -> dict:
+    def _store_stdout(self, stdout):
+        """
+        Helper func - a stdout of blob_threshold chars or more is put in the blob store
+        :return: stdout text or its BlobRef
+        """
+        stdout = str(stdout)
+        if self.blob_store is not None and len(stdout) >= self.blob_threshold:
+            return self.blob_store.put(stdout)
+        return stdout
+ 
+    @staticmethod
+    def _digest(stdout) -> str:
+        return hashlib.blake2b(str(stdout).encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+ 
+    def _log_delta(self, key: tuple, stdin: str, stdout: str, stderr: str, cmd_duration: float, domain: str,
+                   telnet_host: str = None, phases: dict = None):
+        """
+        Change-only logging helper of log_cmd. When the command was logged before and its output is
+        unchanged, or delta is 'diff', build the compact record to write instead of the full one
+ 
+        :return: (log entry returned to the caller, compact record to write), or None if a full record
+                    must be written
+        """
+        digest = self._digest(stdout)
+        with self._delta_lock:
+            last = self._delta_last.get(key)
+            if last is None or str(stderr) != '' or last['count'] >= self.delta_full_every:
+                return None
+            if digest == last['digest']:
+                kind = 'unchanged'
+            elif self.delta == 'diff':
+                kind = 'diff'
+            else:
+                return None
+            last_entry = last['entry']
+ 
+        # The compact record has no stdout, only the returned entry keeps it. An unchanged stdout
+        # shares the text, or blob reference, of the last entry
+        record = self.build_log_entry(stdin, '', stderr, cmd_duration, domain, telnet_host=telnet_host,
+                                      results={}, phases=phases)
+        del record['stdout'], record['results']
+        record['delta'] = kind
+        record['delta_of'] = last_entry['timestamp']
+        rtn = record.copy()
+        rtn.raw_stdout = last_entry.raw_stdout if kind == 'unchanged' else self._store_stdout(stdout)
+        if kind == 'unchanged':
+            rtn['results'] = last_entry.get('results', {})
+        else:
+            # A diff record must rebuild both the output and the results, lines the templates do not
+            # parse, e.g. a header timestamp, are carried by the stdout diff. When the results did not
+            # change, or most of the output did, the full record is written
+            rtn['results'] = zip_results(stdin, stdout, domain, phases=phases)
+            results_diff = diff_results(last_entry.get('results', {}), rtn['results'])
+            if bool(results_diff) is False:
+                return None
+            stdout_diff = diff_stdout(str(last_entry['stdout']), str(stdout))
+            if stdout_diff is None:
+                return None
+            record['results_diff'] = results_diff
+            record['stdout_diff'] = stdout_diff
+ 
+        with self._delta_lock:
+            self._delta_last[key] = {'digest': digest, 'entry': rtn, 'count': last['count'] + 1}
+        return rtn, record
+ 
+    def _emit_timing(self, stdin: str, phases: dict, write_start: float) -> None:
+        """
+        Helper func - report the record's phases plus the log write, timed from write_start, to the timing hooks
+        """
+        if has_timing_hooks() is True:
+            phases = dict(phases)
+            lap(phases, 'log_write', write_start)
+            emit_timing('log_cmd', self.host, str(stdin), phases)
+ 
+    def log_cmd(self, stdin: str, stdout: str, stderr: str, cmd_duration: float, domain: str, telnet_host: str = None,
+                callback=None, results: dict = None, phases: dict = None) -> LogRecord:
         """
         Populate an ordered Dict with the results of the command run against a
         specific host
@@ -169,16 +1014,95 @@ class CmdLogger:
         :param cmd_duration: duration of command execution in secs
         :param telnet_host: (Optional) IP address of telnet host when a telnet session
                                 through existing SSH session is in-use
-        :return: dict - last log result
+        :param callback: (Optional) Called with the log entry once its results have been parsed. In
+                                deferred parse mode this happens on a parse worker thread
+        :param results: (Optional) Already parsed results, e.g. from an incremental parse, stdout is not
+                                parsed again
+        :param phases: (Optional) {phase: secs} timings of the command, e.g. from execute. The parse phases
+                                are added and the breakdown is recorded as 'phases (secs)'. The time taken
+                                by the log write is only reported to the timing hooks, see utils.timing
+        :return: LogRecord - last log result. In deferred parse mode the results field is filled in
+                                once parsing completes, see results_future(). In delta mode this is the
+                                full entry, even when a compact record was written
         """
-        rtn = self.build_log_entry(stdin, stdout, stderr, cmd_duration, domain, telnet_host=telnet_host)
-        if self._log_fid is not None:
-            self._log_fid.write(f"\t\t{json.dumps(rtn, indent=4)}{_json_delim()}")
-            self._log_fid.flush()
-        else:
-            FileNotOpen()
+        phases = dict(phases) if phases is not None else {}
+ 
+        # Change-only logging, comments and connection status records are always written in full
+        delta_key = None
+        if self.delta is not None and domain != 'na' and results is None:
+            delta_key = (telnet_host if telnet_host is not None else self.host, str(stdin), domain)
+            delta = self._log_delta(delta_key, stdin, stdout, stderr, cmd_duration, domain, telnet_host=telnet_host,
+                                    phases=phases)
+            if delta is not None:
+                rtn, record = delta
+                start = time.perf_counter()
+                if self._writer_thread is None or self._enqueue(record) is False:
+                    self._write_entries([record])
+                self._emit_timing(stdin, phases, start)
+                if callback is not None:
+                    callback(rtn)
+                return rtn
+ 
+        # Responses with a domain of 'na' (comments, connection status...) have no template, so there
+        # is nothing to defer
+        # Row level deltas are computed from the previous results, so delta='diff' parses inline
+        defer = self.deferred_parse is True and domain != 'na' and self._closed is False and results is None \
+            and self.delta != 'diff'
+        rtn = self.build_log_entry(stdin, stdout, stderr, cmd_duration, domain, telnet_host=telnet_host,
+                                   parse=not defer, results=results, phases=phases)
+        if delta_key is not None:
+            with self._delta_lock:
+                # A deferred parse fills in rtn['results'] in place
+                self._delta_last[delta_key] = {'digest': self._digest(stdout), 'entry': rtn, 'count': 0}
+        future = None
+        if defer is True:
+            future = Future()
+            with self._parse_lock:
+                self._parse_id += 1
+                rtn['parse_id'] = self._parse_id
+                self._futures[self._parse_id] = future
+ 
+        if callback is not None:
+            if future is None:
+                callback(rtn)
+            else:
+                future.add_done_callback(lambda f: callback(rtn))
+ 
+        start = time.perf_counter()
+        if self._writer_thread is None:
+            self._write_entries([rtn])
+        # Queue a shallow copy, the writer serializes later and the caller (or a deferred parse worker)
+        # may update the returned entry in the meantime. The parse job is queued after the raw record,
+        # the worker updates rtn['results'] in place
+        entry = rtn.copy() if self._writer_thread is not None else None
+        job = (rtn, domain, future) if future is not None else None
+        if (entry is not None or job is not None) and self._enqueue(entry, job) is False:
+            # The logger was closed meanwhile, its writer thread and parse workers are gone
+            if entry is not None:
+                self._write_entries([rtn])
+            if job is not None:
+                self._parse_job(*job, write=True)
+        self._emit_timing(stdin, phases, start)
         return rtn
  
+    def _enqueue(self, entry, parse_job: tuple = None) -> bool:
+        """
+        Helper func - hand a log entry to the writer thread and / or a parse job to the parse workers,
+        unless the logger is closed. The closed check and the queueing are one step against close()
+ 
+        :param entry: log entry or None
+        :param parse_job: (Optional) (log entry, domain, future)
+        :return: False if the logger is closed and nothing was queued
+        """
+        with self._queue_lock:
+            if self._closed is True:
+                return False
+            if entry is not None:
+                self._write_q.put(entry)
+            if parse_job is not None:
+                self._parse_q.put(parse_job)
+        return True
+ 
  
 if __name__ == '__main__':
     print(_file_max_suffix('log-135.104.221.100-2022_08_02'))
\ No newline at end of file
@@ -1,10 +1,16 @@
-<<<<<<< HEAD
+import copy
+import hashlib
 import json
 import os
 import re
+import threading
+import time
 import textfsm
+from collections import OrderedDict
 from pathlib import Path
  
+from utils.timing import lap
+ 
  
 PROJECT_Dir = Path(__file__).parents[1] # Save the project directory which is one level up from the module file location
  
@@ -63,25 +69,357 @@ Cmd_to_Template_Map = {
          },
 }
  
+# Commands that take arguments, or alias another command, are normalized to a
+# Cmd_to_Template_Map key before the template lookup. Rules are evaluated in order
+# and the first match wins.
+# (match type, pattern, <command> key in Cmd_to_Template_Map)
+#   exact - command string equals pattern
+#   in    - pattern is a substring of the command string
+#   re    - regular expression found anywhere in the command string
+Cmd_Normalize_Rules = (
+    ('exact', 'alm', 'show condition'),
+    ('in', '.bm.power', 'bm.power'),
+    ('in', '.bm.report', 'bm.report'),
+    ('in', '.bm.status', 'bm.status'),
+    ('re', r'show card \d+/\d+', 'show card'),
+    ('re', r'show card inv \d+/\d+', 'show card inv'),
+    ('re', r'show pf \d+/\d+', 'show pf'),
+    ('in', 'uptime', 'uptime'),
+)
+ 
+class TemplateCache:
+    """
+    Process-wide cache of compiled TextFSM templates keyed by template file path.
+ 
+    Building a textfsm.TextFSM object parses the template and compiles all of its
+    regular expressions, which for repeated polling of the same commands costs more
+    than the parse itself. The cache keeps the compiled state machine for each
+    template path and recompiles it only when the file modification time changes.
+    The cache is bounded, least recently used templates are dropped first, and the
+    template file is closed as soon as it has been compiled.
+ 
+    TextFSM objects hold parse state, so each entry carries its own lock and
+    callers should use parse() rather than driving the cached object directly.
+    """
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # path: (mtime_ns, TextFSM object, entry lock)
+        self._lock = threading.Lock()
+ 
+    def _get_entry(self, path: str) -> tuple:
+        """
+        Return the (mtime_ns, TextFSM, lock) entry for path, compiling the template when
+        it is not cached or the file changed on disk since it was compiled.
+        Raises FileNotFoundError if the template file is missing.
+        """
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == mtime:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry
+            self.misses += 1
+ 
+        # Compile outside of the cache lock, so a slow template does not block lookups
+        with open(path, 'r') as t_fid:
+            entry = (mtime, textfsm.TextFSM(t_fid), threading.Lock())
+ 
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+ 
+    def parse(self, path: str, text: str) -> tuple:
+        """
+        Parse text with the compiled template stored at path
+ 
+        :param path: Template file path
+        :param text: Command response text
+        :return: (header, parsed rows) - consistent with TextFSM header and ParseText
+        """
+        _, re_table, table_lock = self._get_entry(path)
+        with table_lock:
+            re_table.Reset()
+            return re_table.header, re_table.ParseText(text)
+ 
+    def clone(self, path: str):
+        """
+        Return a private, reset, copy of the compiled template stored at path for callers that
+        keep parse state across calls, e.g. incremental parsing. The compiled regexes are shared
+        """
+        _, re_table, table_lock = self._get_entry(path)
+        with table_lock:
+            re_table.Reset()
+            return copy.deepcopy(re_table)
+ 
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+ 
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self._entries),
+                    'maxsize': self.maxsize,
+                    }
+ 
+ 
+# Compiled templates shared by all parse_cmd callers in the process
+template_cache = TemplateCache()
+ 
+ 
+class TemplateResolver:
+    """
+    Index of NE commands to TextFSM template file paths, built once from the
+    command normalization rules, the command to template map and the template
+    directories.
+ 
+    All normalization rules are compiled into a single regular expression and the
+    template directories are listed when the index is built, so resolve() makes no
+    filesystem calls. Call rebuild() after adding or removing template files.
+    """
+    def __init__(self, template_dirs: dict, cmd_map: dict, rules: tuple = ()):
+        self.template_dirs = template_dirs
+        self.cmd_map = cmd_map
+        self.rules = tuple(rules)
+        self._norm_re = self._compile_rules(self.rules)
+        self._index = {}
+        self.rebuild()
+ 
+    @staticmethod
+    def _compile_rules(rules: tuple):
+        """
+        Combine the normalization rules into one pattern. Each rule is a zero-width
+        lookahead anchored at the start of the command inside its own named group,
+        so the alternation preserves first-match-wins rule order and lastgroup
+        identifies the rule that matched.
+        """
+        alternatives = []
+        for i, (kind, pattern, _) in enumerate(rules):
+            if kind == 'exact':
+                lookahead = f'{re.escape(pattern)}\\Z'
+            elif kind == 'in':
+                lookahead = f'.*?{re.escape(pattern)}'
+            elif kind == 're':
+                lookahead = f'.*?(?:{pattern})'
+            else:
+                raise ValueError(f'Invalid command normalization rule type "{kind}" - valid types [exact | in | re]')
+            alternatives.append(f'(?P<r{i}>(?={lookahead}))')
+        if bool(alternatives) is False:
+            return None
+        return re.compile('|'.join(alternatives), re.DOTALL)
+ 
+    def rebuild(self) -> None:
+        """
+        (Re)build the command index, listing any template directories found on disk.
+        A template path that is a directory contributes every file it contains.
+        """
+        index = {}
+        for domain, cmds in self.cmd_map.items():
+            domain_dir = self.template_dirs.get(domain)
+            if domain_dir is None:
+                continue
+            # Several commands can share a template, only visit each template path once
+            by_template = {}
+            for template_name in set(cmds.values()):
+                template_path = os.path.join(domain_dir, template_name)
+                if os.path.isdir(template_path):
+                    by_template[template_name] = tuple(
+                        os.path.join(template_path, f) for f in sorted(os.listdir(template_path))
+                        if os.path.isfile(os.path.join(template_path, f)))
+                elif os.path.isfile(template_path):
+                    by_template[template_name] = (template_path,)
+                else:
+                    by_template[template_name] = ()
+            index[domain] = {cmd: by_template[template_name] for cmd, template_name in cmds.items()}
+        self._index = index
+ 
+    def normalize(self, cmd: str) -> str:
+        """
+        Map a command string to its Cmd_to_Template_Map key using the normalization rules
+        :param cmd: Cmd string, with params
+        :return: Normalized command string, or cmd unchanged if no rule matches
+        """
+        if self._norm_re is not None:
+            m = self._norm_re.match(cmd)
+            if m is not None:
+                return self.rules[int(m.lastgroup[1:])][2]
+        return cmd
+ 
+    def resolve(self, cmd: str, domain: str) -> tuple:
+        """
+        :param cmd: Cmd string, with params
+        :param domain: used to direct the command parser to the correct template file
+        :return: tuple of template file paths, empty if no template exists
+        """
+        try:
+            return self._index[domain].get(self.normalize(cmd), ())
+        except KeyError:
+            return ()
+ 
  
-def zip_results(cmd,  stdout, domain):
+# Command to template index used by get_templates
+template_resolver = TemplateResolver(TemplateDir, Cmd_to_Template_Map, Cmd_Normalize_Rules)
+ 
+ 
+class ResultCache:
+    """
+    Process-wide LRU cache of parse_cmd results keyed by (normalized command, domain,
+    hash of the command output).
+ 
+    Polled commands often return byte-for-byte the same output as the previous poll,
+    in which case the earlier parse result is returned instead of parsing again. Only
+    a digest of the output is kept, not the output itself. The cache is bounded by
+    entry count and by the approximate size of the cached results, least recently used
+    results are dropped first.
+ 
+    Cached results are frozen, headers and rows are tuples, so a caller can not modify
+    an entry shared with other callers. Each lookup returns a new outer dict. An entry
+    is discarded when any of its template files changed on disk since it was parsed.
+    """
+    def __init__(self, maxsize: int = 256, maxbytes: int = 16 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = OrderedDict()  # key: (template mtimes, frozen result, size)
+        self._lock = threading.Lock()
+ 
+    @staticmethod
+    def key(cmd_str: str, cmd_result: str, domain: str) -> tuple:
+        digest = hashlib.blake2b(cmd_result.encode('utf-8', 'surrogatepass'), digest_size=16).digest()
+        return template_resolver.normalize(cmd_str), domain, digest
+ 
+    @staticmethod
+    def freeze(result: dict) -> tuple:
+        """
+        Helper func - convert a parse_cmd result to its immutable form
+        :return: (frozen result, approximate size in bytes)
+        """
+        frozen = {}
+        size = 0
+        for name, (header, rows) in result.items():
+            f_rows = tuple(tuple(tuple(v) if isinstance(v, list) else v for v in row) for row in rows)
+            frozen[name] = (tuple(header), f_rows)
+            size += len(name) + sum(len(h) for h in header)
+            for row in f_rows:
+                # Per row and per value overhead plus the text itself, List values count each item
+                size += 64 + sum(8 + (sum(len(i) for i in v) if isinstance(v, tuple) else len(v)) for v in row)
+        return frozen, size
+ 
+    @staticmethod
+    def _mtimes(template_paths) -> tuple:
+        mtimes = []
+        for t_path in template_paths:
+            try:
+                mtimes.append(os.stat(t_path).st_mtime_ns)
+            except FileNotFoundError:
+                mtimes.append(None)
+        return tuple(mtimes)
+ 
+    def get(self, key: tuple, template_paths):
+        """
+        :return: a new dict holding the cached frozen result for key, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and entry[0] == self._mtimes(template_paths):
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                self.hits += 1
+            return dict(entry[1])
+        with self._lock:
+            self.misses += 1
+        return None
+ 
+    def put(self, key: tuple, template_paths, result: dict) -> dict:
+        """
+        Store a parse_cmd result. Results larger than maxbytes are not cached
+        :return: a new dict holding the frozen result
+        """
+        mtimes = self._mtimes(template_paths)
+        frozen, size = self.freeze(result)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            if size <= self.maxbytes:
+                self._entries[key] = (mtimes, frozen, size)
+                self.bytes += size
+                while len(self._entries) > self.maxsize or self.bytes > self.maxbytes:
+                    _, (_, _, e_size) = self._entries.popitem(last=False)
+                    self.bytes -= e_size
+                    self.evictions += 1
+        return dict(frozen)
+ 
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+ 
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': round(self.hits / lookups, 4) if lookups > 0 else 0.0,
+                    'evictions': self.evictions,
+                    'size': len(self._entries),
+                    'maxsize': self.maxsize,
+                    'bytes': self.bytes,
+                    'maxbytes': self.maxbytes,
+                    }
+ 
+ 
+# Parse results shared by all parse_cmd callers in the process
+result_cache = ResultCache()
+ 
+ 
+def zip_results(cmd,  stdout, domain, phases: dict = None, columnar: bool = False):
+    """
+    Parse the command response, or take the parse_cmd output passed in as stdout, and key each
+    template's rows by the template header
+ 
+    :param columnar: (Optional) If True each template's result is a dict of columns, see to_columns,
+                        instead of a list of row dicts
+    :return: dict - {template_name: [row dicts]} or {template_name: {column: [values]}}
+    """
     dict_outout= {}
  
     # Check if user passed in a text string for stdout and if so, parse the text.
     # If not, we will assume they passed in a already parsed stdout and just want
     # the zipped version of the date
     if isinstance(stdout, str) is True:
-        parsed_results = parse_cmd(cmd, stdout, domain)
+        parsed_results = parse_cmd(cmd, stdout, domain, phases=phases)
     else:
         parsed_results = stdout
  
+    start = time.perf_counter()
     try:
         for template_file, info in parsed_results.items():
             header, parsed_text = info
-            dict_outout.update({template_file: to_dict(header, parsed_text)})
+            if columnar is True:
+                dict_outout.update({template_file: to_columns(header, parsed_text)})
+            else:
+                dict_outout.update({template_file: to_dict(header, parsed_text)})
     except AttributeError:
         # something went wrong in parsing the current command response, continue
         pass
+    lap(phases, 'zip', start)
     return dict_outout
  
  
@@ -102,268 +440,138 @@ def to_dict(header, result)-> list:
             raise
     return output
  
-def get_templates(cmd: str, domain: str) -> list:
-    """
-    Lookup the command string passed into the NE and determine if a template or
-    set of template files exists to parse the command output. If so return the
-    a list of template file IDs, read-only, otherwise return None
+def _row_key(row: dict) -> str:
+    return json.dumps(row, sort_keys=True, default=str)
  
-    :param cmd: Cmd string, with params
-    :param domain: used to direct the command parser to the correct template file
-    :return: None or TextFSM Template file ID
-    """
-    # ToDo - provide method to morph commands with multiple args that produce input that can be parsed
-    #        using the same template to a common template name, avoid duplicate entries, e.g. last
-    if 'alm' == cmd:
-        cmd = 'show condition'
-    elif '.bm.power' in cmd:
-        cmd = 'bm.power'
-    elif '.bm.report' in cmd:
-        cmd = 'bm.report'
-    elif '.bm.status' in cmd:
-        cmd = 'bm.status'
-    elif re.search('show card \d+/\d+', cmd) is not None:
-        cmd = 'show card'
-    elif re.search('show card inv \d+/\d+', cmd) is not None:
-        cmd = 'show card inv'
-    elif re.search('show pf \d+/\d+', cmd) is not None:
-        cmd = 'show pf'
-    elif 'uptime' in cmd:
-        cmd = 'uptime'
  
-    try:
-        template_dir_name = os.path.join(TemplateDir[domain], Cmd_to_Template_Map[domain][cmd])
- 
-        # Determine if template path is a directory contains more than one temple to process
-        # # output from the current command
-        dir_names = []
-        if os.path.isdir(template_dir_name) is False:
-            dir_names.append(template_dir_name)
-        else:
-            # Is a directory so collect the path and files names for all present
-            # Iterate directory
-            for path in os.listdir(template_dir_name):
-                # check if current path is a file
-                if os.path.isfile(os.path.join(template_dir_name, path)):
-                    dir_names.append(path)
- 
-        # Open each template file found and store its file ID
-        fids = []
-        for dn in dir_names:
-            fids.append(open(os.path.join(template_dir_name, dn), "r"))
- 
-        return fids
-    except KeyError:
-        return []
-    except FileNotFoundError:
-        return []
- 
- 
-def parse_cmd(cmd_str: str, cmd_result: str, domain: str) -> dict:
+def to_columns(header, result) -> dict:
     """
-    Lookup the template file ID to parse the current command result information. If one exists, use
-    the template to parse the information. If not, return None.
- 
-    Some command responses contain a list of tuples [(header, parsed command),(header, parsed command),....]
-    Some command responses require complex command parsing. to support this the utility will can call multiple
-     command parses and return the aggregate results. The output of the format is a list of dictionaries
-     whose parsed output requires multiple header, parsed text information.
-        {template_name: (header info, [dicts containing parsed output]), template_name: (header info, [dicts containing parsed output]),...}
- 
- 
- 
-    :param cmd_str: Original NE command string
-    :param cmd_result: Resulting command string response from the NE
-    :param domain: used to direct the command parser to the correct template file
-    :return: (dict) -
-        {template_name: (header info, [dicts containing parsed output]), template_name: (header info, [dicts containing parsed output]),...}
-        else None
+    Helper func - column oriented alternative to to_dict. Transposes the textFSM parsing result into one
+    list of values per header field, the header strings are shared rather than repeated in every row
+    :param header: textFSM compliant header list
+    :param result: textFSM compliant parsing result
+    :return: dict - {header field: [value per row]}
     """
-    if domain != 'na':
-        template_fids = get_templates(cmd_str, domain)
-        result = {}
-        for t_fid in template_fids:
-            if t_fid is not None:
-                # Extract template file name including the removal or any
-                # file extension that may be present on the right side of the
-                # file name.
-                # NOTE- Users should not label template files with a dot-extension
-                # that is intended to be part of the template name since it will be striped
-                template_filename = os.path.basename(t_fid.name).split('.')[0]
- 
-                # Call unsupported textFSM package with debug support
-                #re_table = textfsm.TextFSM(t_fid, debug=True)
-                re_table = textfsm.TextFSM(t_fid)
- 
-                header = re_table.header
-                # result.append((header, re_table.ParseText(cmd_result)))
-                result.update({template_filename: (header, re_table.ParseText(cmd_result))})
-        if bool(result):
-            return result
- 
-    return {}
-=======
-import json
-import os
-import re
-import textfsm
-from pathlib import Path
+    if bool(result) is False:
+        return {name: [] for name in header}
+    return {name: list(column) for name, column in zip(header, zip(*result))}
  
  
-PROJECT_Dir = Path(__file__).parents[1] # Save the project directory which is one level up from the module file location
- 
-# Location of template files used by the TextFSM package to parser the NE command
-# responses. Dictionary of NE commands with supporting templates available to parse
-# NE output
-TemplateBase = os.path.join(PROJECT_Dir, 'cmd_templates')
-TemplateDir = {
-    'ne': os.path.join(TemplateBase, 'ne'),
-    'root': os.path.join(TemplateBase, 'root', 'linux'),
-    'dbgCutThru': os.path.join(TemplateBase, 'root', 'dbgCutThru'),
-    }
- 
-# key: val
-# <command> : <template file>
-Cmd_to_Template_Map = {
-        # Linux Mapping
-        'root' :{
-                'bootcmd r': 'bootcmd r',
-                'bm.power': 'bm.power',
-                'bm.report': 'bm.report',
-                'bm.status': 'bm.status',
-                'last': 'last',
-                'last reboot': 'last',
-                'last shutdown': 'last',
-                'last -x reboot': 'last',
-                'last -x shutdown': 'last',
-                'ls -l': 'ls -l',
-                'ls -al': 'ls -l',
-                'pwd': 'pwd',
-                'uptime': 'uptime',
-                'vlan_setm r ilan': 'vlan_setm r ilan',
-                'vlan_setm r net': 'vlan_setm r net',
-                'who': 'who',
-                },
-    # dbgCutThru Mapping
-    'dbgCutThru': {},
- 
-    # NE Mapping
-    'ne': {
-        'paging status': 'paging status',
-        'show card': 'show card',
-        'show card inv': 'show card inv',
-        'show card inv *': 'show card inv *',
-        'show condition': 'show condition',
-        'show firmware ne': 'show firmware ne',
-        'show interface brief': 'show interface brief',
-        'show interface topology *': 'show interface topology *',
-        'show odukxc brief': 'show odukxc brief',
-        'show pf': 'show pf',
-        'show slot *': 'show slot *',
-        'show software ne brief': 'show software ne brief',
-        'show version': 'show version',
-        'show xc *': 'show xc *',
-        'who': 'who',
-         },
-}
- 
- 
-def zip_results(cmd,  stdout, domain):
-    dict_outout= {}
+def rows_to_columns(rows: list) -> dict:
+    """
+    Helper func - convert a list of row dicts, e.g. the results of a log record, to columns. The
+    fields of the first row are the columns, a field missing from a later row is None
+    :param rows: list of row dicts
+    :return: dict - {field: [value per row]}
+    """
+    if bool(rows) is False:
+        return {}
+    return {name: [row.get(name) for row in rows] for name in rows[0]}
  
-    # Check if user passed in a text string for stdout and if so, parse the text.
-    # If not, we will assume they passed in a already parsed stdout and just want
-    # the zipped version of the date
-    if isinstance(stdout, str) is True:
-        parsed_results = parse_cmd(cmd, stdout, domain)
-    else:
-        parsed_results = stdout
  
-    try:
-        for template_file, info in parsed_results.items():
-            header, parsed_text = info
-            dict_outout.update({template_file: to_dict(header, parsed_text)})
-    except AttributeError:
-        # something went wrong in parsing the current command response, continue
-        pass
-    return dict_outout
+def diff_results(old: dict, new: dict) -> dict:
+    """
+    Row level difference between two zip_results outputs. Rows are compared as a whole, row order
+    is not significant
  
+    :param old: previous {template_name: [row dicts]}
+    :param new: current {template_name: [row dicts]}
+    :return: {template_name: {'added': [row dicts], 'removed': [row dicts]}} for templates that changed,
+                empty if the results are the same
+    """
+    diff = {}
+    for name in list(old) + [n for n in new if n not in old]:
+        remaining = {}
+        for row in old.get(name, []):
+            remaining.setdefault(_row_key(row), []).append(row)
+        added = []
+        for row in new.get(name, []):
+            same = remaining.get(_row_key(row))
+            if bool(same) is True:
+                same.pop()
+            else:
+                added.append(row)
+        removed = [row for rows in remaining.values() for row in rows]
+        if bool(added) is True or bool(removed) is True:
+            diff[name] = {'added': added, 'removed': removed}
+    return diff
+ 
+ 
+def apply_results_diff(old: dict, diff: dict) -> dict:
+    """
+    Rebuild results from the previous results and a diff_results output. Removed rows are dropped,
+    added rows are appended
  
-def to_dict(header, result)-> list:
+    :param old: previous {template_name: [row dicts]}, not modified
+    :param diff: diff_results output
+    :return: new {template_name: [row dicts]}
     """
-    Helper func - takes as its input header info and results test that is consistent with the output
-    of textFSM header attribute and ParseText method calls and converts the resulting information
-    into a list of dicts
-    :param header: textFSM compliant header list
-    :param result: textFSM compliant parsing result
-    :return:
+    new = {name: list(rows) for name, rows in old.items()}
+    for name, change in diff.items():
+        rows = new.get(name, [])
+        for row in change.get('removed', []):
+            key = _row_key(row)
+            for i, cur in enumerate(rows):
+                if _row_key(cur) == key:
+                    del rows[i]
+                    break
+        rows.extend(change.get('added', []))
+        new[name] = rows
+    return new
+ 
+ 
+def diff_stdout(old: str, new: str, max_ratio: float = 0.5):
     """
-    output = []
-    for item in result:
-        try:
-            output.append(dict(zip(header, item)))
-        except TypeError:
-            raise
-    return output
+    Line level difference between two command outputs, as the lines kept from the start and the end of
+    old and the lines that replace the ones in between. apply_stdout_diff rebuilds new exactly
+ 
+    :param old: previous output
+    :param new: current output
+    :param max_ratio: (Optional) largest share of the new lines the replaced lines may be
+    :return: {'head': lines kept, 'tail': lines kept, 'lines': [new lines]}, or None if more than
+                max_ratio of the output changed
+    """
+    old_lines = old.split('\n')
+    new_lines = new.split('\n')
+    limit = min(len(old_lines), len(new_lines))
+    head = 0
+    while head < limit and old_lines[head] == new_lines[head]:
+        head += 1
+    tail = 0
+    while tail < limit - head and old_lines[-1 - tail] == new_lines[-1 - tail]:
+        tail += 1
+    lines = new_lines[head:len(new_lines) - tail]
+    if len(lines) > max_ratio * len(new_lines):
+        return None
+    return {'head': head, 'tail': tail, 'lines': lines}
+ 
+ 
+def apply_stdout_diff(old: str, diff: dict) -> str:
+    """
+    Rebuild an output from the previous output and a diff_stdout output
+ 
+    :param old: previous output
+    :param diff: diff_stdout output
+    :return: new output
+    """
+    old_lines = old.split('\n')
+    return '\n'.join(old_lines[:diff['head']] + diff['lines'] + old_lines[len(old_lines) - diff['tail']:])
+ 
  
 def get_templates(cmd: str, domain: str) -> list:
     """
     Lookup the command string passed into the NE and determine if a template or
     set of template files exists to parse the command output. If so return the
-    a list of template file IDs, read-only, otherwise return None
+    a list of template file paths, otherwise return an empty list
  
     :param cmd: Cmd string, with params
     :param domain: used to direct the command parser to the correct template file
-    :return: None or TextFSM Template file ID
+    :return: List of TextFSM template file paths
     """
-    # ToDo - provide method to morph commands with multiple args that produce input that can be parsed
-    #        using the same template to a common template name, avoid duplicate entries, e.g. last
-    if 'alm' == cmd:
-        cmd = 'show condition'
-    elif '.bm.power' in cmd:
-        cmd = 'bm.power'
-    elif '.bm.report' in cmd:
-        cmd = 'bm.report'
-    elif '.bm.status' in cmd:
-        cmd = 'bm.status'
-    elif re.search('show card \d+/\d+', cmd) is not None:
-        cmd = 'show card'
-    elif re.search('show card inv \d+/\d+', cmd) is not None:
-        cmd = 'show card inv'
-    elif re.search('show pf \d+/\d+', cmd) is not None:
-        cmd = 'show pf'
-    elif 'uptime' in cmd:
-        cmd = 'uptime'
+    return list(template_resolver.resolve(cmd, domain))
  
-    try:
-        template_dir_name = os.path.join(TemplateDir[domain], Cmd_to_Template_Map[domain][cmd])
- 
-        # Determine if template path is a directory contains more than one temple to process
-        # # output from the current command
-        dir_names = []
-        if os.path.isdir(template_dir_name) is False:
-            dir_names.append(template_dir_name)
-        else:
-            # Is a directory so collect the path and files names for all present
-            # Iterate directory
-            for path in os.listdir(template_dir_name):
-                # check if current path is a file
-                if os.path.isfile(os.path.join(template_dir_name, path)):
-                    dir_names.append(path)
- 
-        # Open each template file found and store its file ID
-        fids = []
-        for dn in dir_names:
-            fids.append(open(os.path.join(template_dir_name, dn), "r"))
- 
-        return fids
-    except KeyError:
-        return []
-    except FileNotFoundError:
-        return []
- 
- 
-def parse_cmd(cmd_str: str, cmd_result: str, domain: str) -> dict:
+ 
+def parse_cmd(cmd_str: str, cmd_result: str, domain: str, use_cache: bool = True, phases: dict = None) -> dict:
     """
     Lookup the template file ID to parse the current command result information. If one exists, use
     the template to parse the information. If not, return None.
@@ -379,31 +587,119 @@ def parse_cmd(cmd_str: str, cmd_result: str, domain: str) -> dict:
     :param cmd_str: Original NE command string
     :param cmd_result: Resulting command string response from the NE
     :param domain: used to direct the command parser to the correct template file
+    :param use_cache: (Optional) If True look the output up in, and add it to, the parse result cache.
+                        Cached results are immutable, header and rows are tuples
+    :param phases: (Optional) dict the durations (secs) of the template_lookup, result_cache and textfsm
+                        phases are added to
     :return: (dict) -
         {template_name: (header info, [dicts containing parsed output]), template_name: (header info, [dicts containing parsed output]),...}
         else None
     """
     if domain != 'na':
-        template_fids = get_templates(cmd_str, domain)
+        start = time.perf_counter()
+        template_paths = get_templates(cmd_str, domain)
+        start = lap(phases, 'template_lookup', start)
+        if bool(template_paths) is False:
+            return {}
+        if use_cache is True:
+            cache_key = result_cache.key(cmd_str, cmd_result, domain)
+            result = result_cache.get(cache_key, template_paths)
+            start = lap(phases, 'result_cache', start)
+            if result is not None:
+                return result
         result = {}
-        for t_fid in template_fids:
-            if t_fid is not None:
-                # Extract template file name including the removal or any
-                # file extension that may be present on the right side of the
-                # file name.
-                # NOTE- Users should not label template files with a dot-extension
-                # that is intended to be part of the template name since it will be striped
-                template_filename = os.path.basename(t_fid.name).split('.')[0]
- 
-                # Call unsupported textFSM package with debug support
-                #re_table = textfsm.TextFSM(t_fid, debug=True)
-                re_table = textfsm.TextFSM(t_fid)
- 
-                header = re_table.header
-                # result.append((header, re_table.ParseText(cmd_result)))
-                result.update({template_filename: (header, re_table.ParseText(cmd_result))})
+        for t_path in template_paths:
+            # Extract template file name including the removal or any
+            # file extension that may be present on the right side of the
+            # file name.
+            # NOTE- Users should not label template files with a dot-extension
+            # that is intended to be part of the template name since it will be striped
+            template_filename = os.path.basename(t_path).split('.')[0]
+ 
+            # Parse using the compiled template held by the cache. To debug a template call the
+            # unsupported textFSM package directly, textfsm.TextFSM(t_fid, debug=True)
+            try:
+                header, parsed_text = template_cache.parse(t_path, cmd_result)
+            except FileNotFoundError:
+                continue
+            result.update({template_filename: (header, parsed_text)})
+        start = lap(phases, 'textfsm', start)
+        if use_cache is True:
+            result = result_cache.put(cache_key, template_paths, result)
+            lap(phases, 'result_cache', start)
         if bool(result):
             return result
  
     return {}
->>>>>>> 6b219add2b71c33eed6d582db83ff9eeba80b039
+ 
+ 
+class StreamParser:
+    """
+    Incremental counterpart of parse_cmd. Command output is fed in as it arrives and the rows
+    completed so far are returned by each call, so a large response never has to be held in
+    memory before it is parsed.
+ 
+    Usage:
+        parser = StreamParser(cmd, domain)
+        for text in chunks:
+            for template_name, row in parser.feed(text): ...
+        for template_name, row in parser.close(): ...
+    """
+    def __init__(self, cmd_str: str, domain: str):
+        self.tables = {}    # template name: [TextFSM copy, rows already returned, trim returned rows]
+        self._partial = ''
+        if domain != 'na':
+            for t_path in get_templates(cmd_str, domain):
+                try:
+                    re_table = template_cache.clone(t_path)
+                except FileNotFoundError:
+                    continue
+                # Rows already returned are dropped from the table to keep memory flat, unless a
+                # Fillup value may still update earlier records
+                trim = not any('Fillup' in value.OptionNames() for value in re_table.values)
+                self.tables[os.path.basename(t_path).split('.')[0]] = [re_table, 0, trim]
+ 
+    def __bool__(self):
+        return bool(self.tables)
+ 
+    @property
+    def headers(self) -> dict:
+        return {name: table[0].header for name, table in self.tables.items()}
+ 
+    def _new_rows(self) -> list:
+        rows = []
+        for name, table in self.tables.items():
+            re_table, returned, trim = table
+            result = re_table._result
+            for item in result[returned:]:
+                rows.append((name, dict(zip(re_table.header, item))))
+            if trim is True:
+                del result[:]
+            table[1] = len(result)
+        return rows
+ 
+    def feed(self, text: str) -> list:
+        """
+        :param text: next piece of command output, lines may be split across calls
+        :return: list of (template name, row dict) completed by this text
+        """
+        if bool(self.tables) is False:
+            return []
+        text = self._partial + text
+        cut = text.rfind('\n') + 1
+        self._partial = text[cut:]
+        if cut == 0:
+            return []
+        for re_table, _, _ in self.tables.values():
+            re_table.ParseText(text[:cut], eof=False)
+        return self._new_rows()
+ 
+    def close(self) -> list:
+        """
+        Parse any trailing partial line and run the templates' end of file processing
+        :return: list of (template name, row dict) completed at end of output
+        """
+        for re_table, _, _ in self.tables.values():
+            re_table.ParseText(self._partial, eof=True)
+        self._partial = ''
+        return self._new_rows()
@@ -9,14 +9,18 @@
 # expect library
 #
  
+import codecs
 import re
 import time
+import uuid
 # https://ktbyers.github.io/netmiko/docs/netmiko/
 # https://github.com/ktbyers/netmiko/blob/develop/EXAMPLES.md
 from netmiko import ConnectHandler
 from netmiko.exceptions import ReadTimeout, NetmikoTimeoutException, NetmikoAuthenticationException
 from utils.conn_Info import get_port, get_password
 from utils.cmd_logger import CmdLogger
+from utils.cmd_parser import StreamParser
+from utils.timing import emit_timing, lap
  
 # ToDo provide login support for PSS4 prompt, simple # (e.g. 135.104.217.32)
 PROMPT_STRINGS = {'admin': r'\s*\S+#\s*$',
@@ -28,7 +32,7 @@ PROMPT_STRINGS = {'admin': r'\s*\S+#\s*$',
                   'dbgCutThru': 'dbgCut>',
     }
 RE_EXP = {
-        'ansi': re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~]) '),
+        'ansi': re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])'),
         'admin': re.compile(PROMPT_STRINGS['admin']),
         'more': re.compile(PROMPT_STRINGS['more'], re.MULTILINE),
         'root': re.compile(".*root@.*"),
@@ -39,6 +43,10 @@ RE_EXP = {
         'valid prompt chars': re.compile('([a-zA-Z0-9-_+~!@#$%^&*.,:`]+#\s*$)'),
 }
  
+# netmiko BaseConnection internals the phased connect relies on. They are private, if a netmiko release
+# drops or changes them Connection falls back to the one step ConnectHandler connect
+_PHASED_CONNECT = ('_modify_connection_params', 'establish_connection', '_try_session_preparation')
+ 
 class SSH_Conn_Failure(Exception):
     def __init__(self, host:str, user:str, port:int, err, message="SSH connection failed"):
         self.host = host
@@ -56,12 +64,226 @@ class SSH_Cmd_Response_Failure(Exception):
         super().__init__(self.message)
  
  
+class OutputAccumulator:
+    """
+    Command response buffer whose total cost is linear in the size of the response. Channel reads,
+    raw bytes or text already decoded by netmiko, are fed in as they arrive. Bytes are decoded
+    incrementally with the receive codec, so a multi-byte character split across reads stays whole.
+    Each read is cleaned in one pass over the new data only, ANSI escape codes stripped and line feeds
+    normalized; an escape sequence or carriage return cut off at the end of a read is held back until
+    the rest of it arrives. More and end prompts are looked for in the tail of the cleaned output only
+    and the cleaned chunks are joined once.
+ 
+    Usage:
+        acc = OutputAccumulator(encoding=conn.rcv_decoding)
+        while acc.more_prompt() is False and acc.at_prompt(prompt_re) is False:
+            acc.feed(channel.recv(65535))
+        acc.finish()
+        output = acc.text()
+    """
+    # The more and end prompts, possibly wrapped in ANSI codes, are at the very end of the output
+    TAIL = 256
+    # ESC E (next line) stands for a line feed, every other escape sequence is dropped
+    NEXT_LINE = '\x1bE'
+    # Incomplete escape sequence, or carriage returns whose line feed may be in the next read, at the end
+    # of a read. Only the last HOLD_MAX chars of a read are searched
+    HOLD_RE = re.compile(r'(?:\x1B(?:\[[0-?]*[ -/]*)?|\r+)$')
+    HOLD_MAX = 32
+ 
+    def __init__(self, encoding: str='ascii', errors: str='replace', tail: int=TAIL, keep: bool=True):
+        """
+        :param encoding: (Optional) codec used to decode bytes reads, e.g. SSH_Connection.rcv_decoding
+        :param errors: (Optional) codec error handling of undecodable bytes
+        :param tail: (Optional) chars at the end of the output searched for the prompts
+        :param keep: (Optional) If False the cleaned output is only counted, not kept, e.g. when the
+                        caller streams it
+        """
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors=errors)
+        self.tail = tail
+        self.keep = keep
+        self._chunks = []
+        self._tail = ''
+        self._held = ''
+        self._size = 0
+        self._erase = False
+ 
+    def __len__(self) -> int:
+        return self._size
+ 
+    def feed(self, data) -> str:
+        """
+        Add a channel read
+        :param data: bytes, decoded with the receive codec, or str
+        :return: the new cleaned text, '' while only an incomplete escape sequence or line end arrived
+        """
+        if isinstance(data, (bytes, bytearray)):
+            data = self._decoder.decode(data)
+        if self._held != '':
+            data = self._held + data
+        m = self.HOLD_RE.search(data, max(0, len(data) - self.HOLD_MAX))
+        if m is not None:
+            self._held = data[m.start():]
+            data = data[:m.start()]
+        else:
+            self._held = ''
+        return self._add(data)
+ 
+    def finish(self) -> str:
+        """
+        Flush the bytes, escape codes and line end chars held back at the end of the response
+        :return: the new cleaned text
+        """
+        data = self._held + self._decoder.decode(b'', final=True)
+        self._held = ''
+        return self._add(data)
+ 
+    def _add(self, data: str) -> str:
+        """
+        Helper func - clean new data and append it to the output
+        """
+        if '\x1b' in data:
+            data = RE_EXP['ansi'].sub('', data.replace(self.NEXT_LINE, '\n'))
+        if '\r' in data:
+            # The line ends of netmiko's normalize_linefeeds, str replaces are much quicker than a regular
+            # expression. Each replace is a full pass, only run the ones the data needs
+            if '\r\r' in data:
+                data = data.replace('\r\r\r\n', '\n').replace('\r\r\n', '\n')
+            data = data.replace('\r\n', '\n')
+            cr = data.find('\r')
+            if cr == 0 and data.find('\r', 1) < 0:
+                # Only the carriage return that starts a page after an answered more-prompt
+                data = f'\n{data[1:]}'
+            elif cr >= 0:
+                data = data.replace('\n\r', '\n').replace('\r', '\n')
+        if self._erase is True and data != '':
+            # The line terminator, or bare carriage return, that ended the answered more-prompt line
+            self._erase = False
+            if data[0] == '\n':
+                data = data[1:]
+        if data == '':
+            return data
+        if self.keep is True:
+            self._chunks.append(data)
+        self._size += len(data)
+        self._tail = data[-self.tail:] if len(data) >= self.tail else (self._tail + data)[-self.tail:]
+        return data
+ 
+    def text(self) -> str:
+        """
+        :return: the cleaned output, '' when the output is not kept
+        """
+        if len(self._chunks) > 1:
+            self._chunks = [''.join(self._chunks)]
+        return self._chunks[0] if bool(self._chunks) is True else ''
+ 
+    def last_line(self) -> str:
+        return self._tail[self._tail.rfind('\n') + 1:]
+ 
+    def more_prompt(self) -> bool:
+        return RE_EXP['more'].search(self._tail) is not None
+ 
+    def at_prompt(self, prompt_re) -> bool:
+        """
+        :param prompt_re: compiled end prompt regular expression
+        :return: True if the last line of the output is a prompt
+        """
+        last_line = self.last_line()
+        return last_line != '' and prompt_re.search(last_line) is not None
+ 
+    def drop_more_prompt(self) -> None:
+        """
+        Drop the whole more-prompt line, including any ANSI codes in front of the prompt. Once the prompt
+        is answered the NE ends or overwrites the line, that line terminator is dropped from the next read
+        """
+        m = RE_EXP['more'].search(self._tail)
+        if m is not None:
+            self._truncate(len(self._tail) - self._tail.rfind('\n', 0, m.start()) - 1)
+            self._erase = True
+ 
+    def drop_last_line(self) -> None:
+        """
+        Drop the last line and the line feed in front of it, e.g. the end prompt
+        """
+        n = len(self.last_line())
+        self._truncate(min(n + 1, self._size))
+ 
+    def _truncate(self, n: int) -> None:
+        """
+        Helper func - drop the last n chars of the output, n is at most the tail size
+        """
+        self._size -= n
+        self._tail = self._tail[:len(self._tail) - n]
+        if self.keep is False:
+            return
+        while n > 0 and bool(self._chunks) is True:
+            chunk = self._chunks.pop()
+            if len(chunk) > n:
+                self._chunks.append(chunk[:len(chunk) - n])
+            n -= len(chunk)
+        # Refill the tail from the kept output
+        parts = []
+        need = self.tail
+        for chunk in reversed(self._chunks):
+            parts.append(chunk[-need:])
+            need -= len(parts[-1])
+            if need <= 0:
+                break
+        self._tail = ''.join(reversed(parts))
+ 
+ 
+class MorePager:
+    """
+    Event driven more-prompt pager. Each page is read with read_until_pattern, which returns as soon
+    as either the end prompt or a more-prompt arrives. A more-prompt is answered immediately and the
+    next page read; the end prompt finishes the response.
+ 
+    Pages are cleaned and checked for a more-prompt by an OutputAccumulator, so each page is scanned
+    once and the cost stays linear in the size of the response.
+    """
+    # The more-prompt, possibly wrapped in ANSI codes and whitespace, is at the very end of a page
+    TAIL = 96
+ 
+    def __init__(self, ssh, prompt: str, read_timeout: float, answer: str='y\n'):
+        """
+        :param ssh: netmiko connection
+        :param prompt: regular expression end of response prompt
+        :param read_timeout: max secs to wait for each page
+        :param answer: (Optional) sent to request the next page. Like the send_command_timing('y') the
+                        pager replaced, the key is followed by a line end
+        """
+        self.ssh = ssh
+        self.pattern = f"{prompt}|{PROMPT_STRINGS['more']}"
+        self.read_timeout = read_timeout
+        self.answer = answer
+        self.pages = 0
+ 
+    def collect(self, first_page: str) -> str:
+        """
+        Page through the remainder of a response
+        :param first_page: output returned by the command send, up to the first prompt matched
+        :return: complete response, ANSI codes and the more-prompts removed
+        """
+        acc = OutputAccumulator(tail=self.TAIL)
+        acc.feed(first_page)
+        self.pages = 1
+        while acc.more_prompt() is True:
+            acc.drop_more_prompt()
+            self.ssh.write_channel(self.answer)
+            acc.feed(self.ssh.read_until_pattern(pattern=self.pattern, read_timeout=self.read_timeout))
+            self.pages += 1
+        acc.finish()
+        if self.pages > 1 and self.ssh.base_prompt in acc.last_line():
+            # send_command strips the prompt from the first page only
+            acc.drop_last_line()
+        return acc.text()
+ 
+ 
 class Connection:
     def __init__(self, host: str, user: str, log_action='open', timeout: float=30.0, read_timeout: float=60.0,
-                 session_log: str=None, response_return="\n"):
+                 session_log: str=None, response_return="\n", port: int=None, disable_paging: bool=False):
         self.host=host
         self.user=user
-        self.port = get_port(user)
+        self.port = port if port is not None else get_port(user)
         self.timeout = timeout      # ssh connection timeout
         self.read_timeout = read_timeout  # send_command respond timeout
         self.domain = 'root'
@@ -76,23 +298,41 @@ class Connection:
             # log file already present
             self.logger = log_action
  
+        # Duration (secs) of each connection setup phase, also reported to the timing hooks
+        self.connect_phases = {}
+        start = time.perf_counter()
+        conn_args = dict(device_type='linux',
+                         host=host,
+                         port=self.port ,
+                         username=user,
+                         password=get_password(user),
+                         timeout=timeout,
+                         session_log=session_log,
+                         response_return=response_return)
+        # Phase in progress outside of _connect_phased, which records its own failed phase
+        phase = None
         try:
-            self.ssh = ConnectHandler(device_type='linux',
-                                        host=host,
-                                        port=self.port ,
-                                        username=user,
-                                        password=get_password(user),
-                                        timeout=timeout,
-                                        session_log=session_log,
-                                        response_return=response_return)
+            # Connect in steps, rather than with auto_connect, so the SSH connection (TCP, handshake and
+            # authentication) and the prompt detection are timed separately
+            self.ssh, start = self._connect_phased(conn_args, start)
+            if self.ssh is None:
+                # netmiko without the phased connect internals, connect in one step timed as ssh_connect
+                phase = 'ssh_connect'
+                self.ssh = ConnectHandler(**conn_args)
+                start = lap(self.connect_phases, 'ssh_connect', start)
+            phase = 'hostname'
             self._default_prompt = f"{PROMPT_STRINGS[self.user]}|{PROMPT_STRINGS['more']}|{self.ssh.base_prompt}"
             self._default_hostname = self.ssh.send_command('hostname', read_timeout=read_timeout,
                                                            expect_string=self._default_prompt)
+            start = lap(self.connect_phases, 'hostname', start)
  
         except (NetmikoTimeoutException, NetmikoAuthenticationException) as err:
+            if phase is not None:
+                lap(self.connect_phases, self._failed_phase(phase, err), start)
             self._default_prompt = ''
             self.ssh = None
-            self.logger.log_cmd(f'{user} Host connection failed', 'na', err, 0.0, self.domain)
+            self.logger.log_cmd(f'{user} Host connection failed', 'na', err, 0.0, self.domain,
+                                phases=self.connect_phases)
             SSH_Conn_Failure(host, user, self.port, err,
                                         message="SSH - TCP connection to device failed.")
             return
@@ -106,6 +346,13 @@ class Connection:
  
         # Set the self.logger.timezone_ME parameter to make the log information more useful
         self.get_TZ()
+        start = lap(self.connect_phases, 'get_TZ', start)
+ 
+        # Turn the NE CLI pager off so long responses come back without more-prompts
+        if disable_paging is True and self.user == 'admin':
+            self.set_paging(False)
+            lap(self.connect_phases, 'set_paging', start)
+        emit_timing('connect', self.host, f'{user} connect', self.connect_phases)
  
         # Update globals
         self._update_globs('root')
@@ -167,6 +414,53 @@ class Connection:
             pass
         self.port = get_port(self.user)
  
+    def _connect_phased(self, conn_args: dict, start: float) -> tuple:
+        """
+        Connect with the netmiko connection steps, timing logger_and_setup, ssh_connect and prompt_detect.
+        The steps are netmiko internals (see _PHASED_CONNECT), when they are missing or their signature
+        changed the caller connects with ConnectHandler instead
+ 
+        :param conn_args: ConnectHandler arguments
+        :param start: time.perf_counter() the connection setup started
+        :return: (netmiko connection, perf_counter() at the end of the last phase), (None, start) if this
+                 netmiko version can not connect in steps
+        """
+        try:
+            ssh = ConnectHandler(**conn_args, auto_connect=False)
+        except TypeError:
+            return None, start
+        if all(callable(getattr(ssh, name, None)) for name in _PHASED_CONNECT) is False:
+            return None, start
+        start = lap(self.connect_phases, 'logger_and_setup', start)
+        phase = 'ssh_connect'
+        try:
+            ssh._modify_connection_params()
+            ssh.establish_connection()
+            start = lap(self.connect_phases, 'ssh_connect', start)
+            phase = 'prompt_detect'
+            ssh._try_session_preparation()
+            start = lap(self.connect_phases, 'prompt_detect', start)
+        except (AttributeError, TypeError):
+            # Internals changed, drop the partial connection and connect in one step
+            ssh.disconnect()
+            return None, start
+        except Exception as err:
+            # Time the phase that failed
+            lap(self.connect_phases, self._failed_phase(phase, err), start)
+            ssh.disconnect()
+            raise
+        return ssh, start
+ 
+    @staticmethod
+    def _failed_phase(phase: str, err: Exception) -> str:
+        """
+        Helper func - phase a connection failure is recorded under. The SSH connection is TCP and the
+        handshake (ssh_connect) followed by authentication, an authentication failure is timed as ssh_auth
+        """
+        if phase == 'ssh_connect' and isinstance(err, NetmikoAuthenticationException) is True:
+            return 'ssh_auth'
+        return phase
+ 
     def get_TZ(self):
         output = self.ssh.send_command('date', read_timeout=self.read_timeout)
         m = re.search("\S+\s*\S+\d{1,2}\s*\d{2}:\d{2}:\d{2}\s*(\S+)", output)
@@ -175,6 +469,14 @@ class Connection:
         else:
             self.logger.timezone_NE = 'Not Set'
  
+    def set_paging(self, enabled: bool) -> dict:
+        """
+        Turn the NE CLI more-prompt pager on or off with the paging status command
+        :param enabled: True - paging status enable, False - paging status disable
+        :return: log response dictionary of the paging command
+        """
+        return self.execute(f"paging status {'enable' if enabled is True else 'disable'}")
+ 
     def reset_root_params(self):
         self.user = 'root'
         self.port = get_port(self.user)
@@ -238,21 +540,18 @@ class Connection:
         if read_timeout is None:
             read_timeout = self.read_timeout
  
+        # Phases: send_command - send and wait for the first prompt (NE response), paging - more-page round
+        # trips and ANSI code stripping. The logger adds the parse phases
+        phases = {}
         start_secs = time.monotonic()
+        start = time.perf_counter()
         try:
             # Send the command and look for the expected prompt, aka command completion, or "More" prompt
             output = self.ssh.send_command(cmd, read_timeout=read_timeout, expect_string=prompt, cmd_verify=cmd_verify)
-            output = self.ssh.strip_ansi_escape_codes(output)
-            # Test for More prompt in output. If present, sen "Y" to collect full response
-            while (RE_EXP['more'].search(output) is not None):
-                more_out = self.response_return + self.ssh.send_command_timing('y',
-                                                                        read_timeout=self.read_timeout,
-                                                                        cmd_verify=False)
-                output += self.response_return + self.ssh.strip_ansi_escape_codes(more_out)
-                # Check is the last chuck of output data contained another more
-                # prompt. If so, continue. If not, break
-                if RE_EXP['more'].search(more_out) is None:
-                    break
+            start = lap(phases, 'send_command', start)
+            # Answer each More prompt as soon as it arrives to collect the full response
+            output = MorePager(self.ssh, prompt, read_timeout, answer=f'y{self.response_return}').collect(output)
+            lap(phases, 'paging', start)
         except ReadTimeout as err:
             output = 'Failed command response'
             cmd_duration = round(time.monotonic() - start_secs, 4)
@@ -261,11 +560,273 @@ class Connection:
  
         # Log the command response and save the newly created log
         cmd_duration = round(time.monotonic() - start_secs, 4)
-        rtn = self.logger.log_cmd(cmd, output, '', cmd_duration, self.domain)
+        rtn = self.logger.log_cmd(cmd, output, '', cmd_duration, self.domain, phases=phases)
         print(f'Host:{self.host} - {cmd} - {cmd_duration} secs')
  
         # Return the last command added to the logger store from above
         return rtn
  
+    def execute_stream(self, cmd: str, prompt: str='', read_timeout: float=None, cmd_verify=True, parse=True,
+                       keep_output=False):
+        """
+        Streaming execution method - a generator that yields the response while it is still arriving
+        instead of returning it once complete. Output is read straight off the channel, cleaned as it
+        arrives, handed on one complete line at a time and parsed incrementally, so memory stays flat
+        however long the response is. More-prompts are answered as soon as they show up.
+ 
+        Usage:
+            for item in conn.execute_stream('show xc *'):
+                if item[0] == 'row':
+                    _, template_name, row = item
+ 
+        Yields:
+            ('chunk', text)                     - cleaned output, always whole lines
+            ('row', template_name, row dict)    - each parsed row, as soon as it is complete
+            ('record', log response dict)       - last item, the command's log record
+ 
+        :param cmd: NE Command string
+        :param prompt: (Optional) regular expression expected prompt
+        :param read_timeout: (Optional) Command response timeout (secs), per page
+        :param cmd_verify: (Optional) If True discard output up to and including the command echo line
+        :param parse: (Optional) If True parse the output with the command's templates as it arrives
+        :param keep_output: (Optional) If True the log record holds the full output and parsed results.
+                                If False only a size summary is logged and nothing is retained
+        """
+        # Check if the connection is still up before we attempt to execute a command
+        try:
+            if self.ssh.is_alive() is False:
+                self.logger.log_cmd('ssh.is_alive()', '', 'abnormal connection closure', 0.0, self.domain)
+                return
+        except AttributeError:
+            raise
+ 
+        if prompt == '':
+            prompt = self._default_prompt
+        if read_timeout is None:
+            read_timeout = self.read_timeout
+        prompt_re = re.compile(prompt)
+ 
+        parser = StreamParser(cmd, self.domain) if parse is True else None
+        acc = OutputAccumulator(keep=False)
+        kept = []
+        results = {}
+        n_chars = 0
+        n_rows = 0
+        stderr = ''
+        pending = ''
+        seen_echo = cmd_verify is False
+ 
+        start_secs = time.monotonic()
+        deadline = start_secs + read_timeout
+        self.ssh.write_channel(f'{cmd}{self.response_return}')
+        while True:
+            data = self.ssh.read_channel()
+            if data == '':
+                if time.monotonic() >= deadline:
+                    stderr = f'Command response timeout-{read_timeout} secs'
+                    SSH_Cmd_Response_Failure(self.host, cmd, stderr)
+                    break
+                time.sleep(0.01)
+                continue
+            pending += acc.feed(data)
+ 
+            if seen_echo is False:
+                # Wait for the complete command echo line, anything before it is the previous prompt
+                echo_at = pending.find(cmd)
+                eol = pending.find('\n', echo_at + len(cmd)) if echo_at >= 0 else -1
+                if eol < 0:
+                    continue
+                pending = pending[eol + 1:]
+                seen_echo = True
+ 
+            # Hand on the complete lines, the incomplete last line is kept back as it may be a prompt
+            cut = pending.rfind('\n') + 1
+            if cut > 0:
+                text = pending[:cut]
+                pending = pending[cut:]
+                n_chars += len(text)
+                if keep_output is True:
+                    kept.append(text)
+                yield 'chunk', text
+                if parser is not None:
+                    for name, row in parser.feed(text):
+                        n_rows += 1
+                        if keep_output is True:
+                            results.setdefault(name, []).append(row)
+                        yield 'row', name, row
+ 
+            if acc.more_prompt() is True:
+                acc.drop_more_prompt()
+                pending = ''
+                self.ssh.write_channel(f'y{self.response_return}')
+                deadline = time.monotonic() + read_timeout
+            elif acc.at_prompt(prompt_re) is True:
+                break
+ 
+        if parser is not None:
+            for name, row in parser.close():
+                n_rows += 1
+                if keep_output is True:
+                    results.setdefault(name, []).append(row)
+                yield 'row', name, row
+ 
+        cmd_duration = round(time.monotonic() - start_secs, 4)
+        if keep_output is True:
+            output = ''.join(kept)
+        else:
+            output = f'<streamed {n_chars} chars, {n_rows} rows, not retained>'
+        rtn = self.logger.log_cmd(cmd, output, stderr, cmd_duration, self.domain, results=results)
+        print(f'Host:{self.host} - {cmd} - {cmd_duration} secs')
+        yield 'record', rtn
+ 
+    def execute_batch(self, cmds: list, read_timeout: float=None) -> list:
+        """
+        Pipelined execution - write the whole command sequence to the shell in one go, each command
+        followed by an echo of a unique marker, then read a single output stream and split it back into
+        per command responses at the markers. Saves one round trip per command on high latency links.
+ 
+        Each command is logged as its own record. Its duration is the time between the previous marker
+        (or the send) and its own marker arriving, which is when the NE finished the command.
+ 
+        Each marker carries its command's index and is checked against the next expected one. When a
+        marker is lost or repeated, or a marker does not arrive in time, the output from that command on
+        can not be split reliably. The shell is then resynchronized, an extra marker is echoed and read
+        together with the prompt after it, and the remaining commands are run one by one with execute().
+        They may have run in the batch already, so batch only commands that are safe to repeat. If the
+        resync times out too, e.g. a command hangs, the remaining commands are logged as failed.
+ 
+        NOTE: markers rely on the shell echo command, so batching applies to the root (Linux) shell.
+              For the admin CLI the commands are run one by one with execute()
+ 
+        :param cmds: list of NE command strings
+        :param read_timeout: (Optional) max secs to wait for each command's marker
+        :return: list of log response dictionaries, one per command
+        """
+        if self.user != 'root':
+            return [self.execute(cmd, read_timeout=read_timeout) for cmd in cmds]
+ 
+        try:
+            if self.ssh.is_alive() is False:
+                self.logger.log_cmd('ssh.is_alive()', '', 'abnormal connection closure', 0.0, self.domain)
+                return []
+        except AttributeError:
+            raise
+ 
+        if read_timeout is None:
+            read_timeout = self.read_timeout
+ 
+        # The marker is quoted in the echo command but not in its output, so the echoed
+        # command line is never mistaken for the marker itself
+        marker = f'__batch_{uuid.uuid4().hex}'
+        marker_re = re.compile(f'^{marker} (\\d+)\\r?\\n', re.MULTILINE)
+        script = ''.join(f"{cmd}{self.response_return}echo '{marker}' {i}{self.response_return}"
+                         for i, cmd in enumerate(cmds))
+ 
+        start_secs = time.monotonic()
+        self.ssh.write_channel(script)
+ 
+        # Read the stream, noting when each marker arrives. Only data after the last marker found is
+        # searched again, so the scan stays linear in the size of the output
+        stream = []
+        pending = ''
+        outputs = []
+        done_at = []
+        desync = False
+        deadline = start_secs + read_timeout
+        while len(outputs) < len(cmds) and desync is False:
+            data = self.ssh.read_channel()
+            now = time.monotonic()
+            if data == '':
+                if now >= deadline:
+                    break
+                time.sleep(0.01)
+                continue
+            pending += data
+            while True:
+                m = marker_re.search(pending)
+                if m is None:
+                    break
+                if int(m.group(1)) != len(outputs):
+                    # A marker was lost or repeated, the output since the last good marker can not be split
+                    desync = True
+                    break
+                stream.append(pending[:m.start()])
+                outputs.append(''.join(stream))
+                done_at.append(now)
+                stream = []
+                pending = pending[m.end():]
+                deadline = now + read_timeout
+            # Keep the possibly incomplete last line for the next search
+            cut = pending.rfind('\n')
+            if cut > 0:
+                stream.append(pending[:cut])
+                pending = pending[cut:]
+ 
+        # Collect the prompt that follows the last marker so the next command starts clean
+        synced = True
+        if len(outputs) == len(cmds):
+            if re.search(self._default_prompt, pending) is None:
+                try:
+                    self.ssh.read_until_pattern(pattern=self._default_prompt, read_timeout=read_timeout)
+                except ReadTimeout:
+                    pass
+        else:
+            err = 'Batch marker out of sequence' if desync is True else \
+                f'Batch marker not received within {read_timeout} secs'
+            SSH_Cmd_Response_Failure(self.host, cmds[len(outputs)], err)
+            synced = self._batch_resync(marker, read_timeout)
+ 
+        rtns = []
+        prev_secs = start_secs
+        for i, cmd in enumerate(cmds):
+            if i < len(outputs):
+                output = self._clean_batch_output(cmd, marker, outputs[i])
+                cmd_duration = round(done_at[i] - prev_secs, 4)
+                prev_secs = done_at[i]
+                rtns.append(self.logger.log_cmd(cmd, output, '', cmd_duration, self.domain))
+            elif synced is True:
+                rtns.append(self.execute(cmd, read_timeout=read_timeout))
+                continue
+            else:
+                cmd_duration = round(time.monotonic() - prev_secs, 4)
+                err = f'Batch marker not received within {read_timeout} secs'
+                rtns.append(self.logger.log_cmd(cmd, 'Failed command response', err, cmd_duration, self.domain))
+                SSH_Cmd_Response_Failure(self.host, cmd, err)
+            print(f'Host:{self.host} - {cmd} - {rtns[-1]["cmd_duration (secs)"]} secs')
+        return rtns
+ 
+    def _batch_resync(self, marker: str, read_timeout: float) -> bool:
+        """
+        Helper func - echo a sync marker behind the batch and discard everything up to it and the prompt
+        that follows, so the shell output lines up with the next command again
+        :return: True if the shell is in sync, False if the sync marker or prompt did not arrive in time
+        """
+        self.ssh.write_channel(f"echo '{marker}' sync{self.response_return}")
+        try:
+            self.ssh.read_until_pattern(pattern=f'^{marker} sync\r?\n', read_timeout=read_timeout,
+                                        re_flags=re.MULTILINE)
+            self.ssh.read_until_pattern(pattern=self._default_prompt, read_timeout=read_timeout)
+        except ReadTimeout:
+            return False
+        return True
+ 
+    def _clean_batch_output(self, cmd: str, marker: str, output: str) -> str:
+        """
+        Helper func - remove ANSI codes, prompts and the echoed command and marker lines from one
+        command's share of a batch output stream
+        """
+        output = self.ssh.strip_ansi_escape_codes(output).replace('\r\n', '\n').replace('\r', '')
+        lines = [line for line in output.split('\n') if f"echo '{marker}'" not in line]
+        # The command echo is the first line that carries the command, anything before it is prompt
+        for i, line in enumerate(lines):
+            if line.rstrip().endswith(cmd):
+                lines = lines[i + 1:]
+                break
+        # Drop a trailing bare prompt line
+        if bool(lines) is True and RE_EXP['valid prompt chars'].search(lines[-1]) is not None \
+                and lines[-1].strip() == lines[-1].strip().split()[0]:
+            lines = lines[:-1]
+        return '\n'.join(lines).strip('\n')
+ 
  
  
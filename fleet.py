@@ -0,0 +1,156 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+ 
+from utils.cmd_logger import CmdLogger
+from utils.connection_base import Connection
+ 
+ 
+class FleetRunner:
+    def __init__(self, hosts: list, user: str, max_workers: int = 32, host_timeout: float = None,
+                 log_action='open', logger_factory=None, connection_factory=None, **conn_kwargs):
+        """
+        Run the same command list against many NEs concurrently. Each host is handled by a single
+        task that opens a Connection and executes the commands in order, so per host ordering is
+        preserved, while max_workers caps the number of hosts worked on at the same time.
+ 
+        :param hosts: list of NE host IP addresses
+        :param user: User login string - [root | admin]
+        :param max_workers: (Optional) global concurrency cap, max number of hosts in progress
+        :param host_timeout: (Optional) max secs allowed per host. A host that runs over is reported as
+                                timed out, its remaining commands are skipped and the run does not wait
+                                for it. Its session is closed, which ends the command in flight and frees
+                                the worker for the next host. A host still connecting holds its worker
+                                until the connect returns or fails
+        :param log_action: (Optional) log_action passed to each Connection, a CmdLogger per host
+        :param logger_factory: (Optional) callable(host) returning the CmdLogger to use for a host. Loggers
+                                returned by the factory are owned, and closed, by the caller
+        :param connection_factory: (Optional) callable(host, user, log_action, **conn_kwargs) returning a
+                                Connection like object, defaults to Connection
+        :param conn_kwargs: (Optional) extra keyword arguments passed to the connection factory
+        """
+        self.hosts = list(dict.fromkeys(hosts))   # drop duplicates, keep order
+        self.user = user
+        self.max_workers = max(1, max_workers)
+        self.host_timeout = host_timeout
+        self.log_action = log_action
+        self.logger_factory = logger_factory
+        self.connection_factory = connection_factory if connection_factory is not None else Connection
+        self.conn_kwargs = conn_kwargs
+        self._cancelled = {}     # host: threading.Event, set when the host ran out of time
+        self._started = {}       # host: monotonic time its task started running
+        self._conns = {}         # host: open connection, so a host that runs out of time can be aborted
+ 
+    def _run_host(self, host: str, cmds: list, result: dict, callback=None) -> dict:
+        """
+        Worker task - connect to host and execute cmds in order, recording progress in result
+        :return: host result dict
+        """
+        start = time.monotonic()
+        self._started[host] = start
+        cancelled = self._cancelled[host]
+        conn = None
+        owns_logger = self.logger_factory is None
+        try:
+            log_action = self.log_action if owns_logger is True else self.logger_factory(host)
+            conn = self.connection_factory(host, self.user, log_action=log_action, **self.conn_kwargs)
+            self._conns[host] = conn
+            if getattr(conn, 'ssh', None) is None:
+                result['error'] = 'Connection Failed'
+                return result
+            for cmd in cmds:
+                if cancelled.is_set():
+                    result['error'] = 'host timeout, remaining commands skipped'
+                    break
+                rtn = conn.execute(cmd)
+                if rtn is None:
+                    # execute found the connection closed, no point in sending the rest
+                    result['error'] = 'abnormal connection closure'
+                    break
+                result['records'].append(rtn)
+        except Exception as err:
+            result['error'] = f'{type(err).__name__}: {err}'
+        finally:
+            self._conns.pop(host, None)
+            if conn is not None:
+                try:
+                    conn.ssh.disconnect()
+                except Exception:
+                    pass
+                if owns_logger is True and isinstance(getattr(conn, 'logger', None), CmdLogger):
+                    conn.logger.close()
+            result['duration (secs)'] = round(time.monotonic() - start, 4)
+            if callback is not None:
+                callback(result)
+        return result
+ 
+    @staticmethod
+    def _abort(conn) -> None:
+        """
+        Helper func - end the session of a host that ran out of time, called from the run() thread. The
+        blocked execute holds the netmiko session lock, so disconnect() would wait for the command to
+        finish. Detaching and closing the channel instead makes the pending read fail at once, the
+        worker then disconnects and closes the logger as usual
+        """
+        ssh = getattr(conn, 'ssh', None)
+        if ssh is None:
+            return
+        remote_conn = getattr(ssh, 'remote_conn', None)
+        try:
+            if getattr(ssh, 'channel', None) is not None:
+                ssh.channel.remote_conn = None
+            if remote_conn is not None:
+                remote_conn.close()
+        except Exception:
+            pass
+ 
+    def run(self, cmds: list, callback=None) -> dict:
+        """
+        Execute cmds on every host
+ 
+        :param cmds: list of NE command strings, executed in order on each host
+        :param callback: (Optional) called with each host result dict as soon as that host completes
+        :return: dict - {host: {'host', 'records': [execute log records], 'error', 'duration (secs)'}, ...}
+                        in host list order
+        """
+        self._cancelled = {host: threading.Event() for host in self.hosts}
+        self._started = {}
+        self._conns = {}
+        progress = {host: {'host': host, 'records': [], 'error': None, 'duration (secs)': 0.0}
+                    for host in self.hosts}
+        results = {}
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='FleetRunner')
+        try:
+            pending = {executor.submit(self._run_host, host, cmds, progress[host], callback): host
+                       for host in self.hosts}
+            poll = None if self.host_timeout is None else min(1.0, self.host_timeout / 4)
+            while bool(pending) is True:
+                done, _ = wait(pending, timeout=poll, return_when=FIRST_COMPLETED)
+                for future in done:
+                    host = pending.pop(future)
+                    results[host] = future.result()
+ 
+                if self.host_timeout is None:
+                    continue
+                # Queued hosts are not charged for time spent waiting on a worker, only running ones
+                now = time.monotonic()
+                for future, host in list(pending.items()):
+                    started = self._started.get(host)
+                    if started is None or now - started < self.host_timeout:
+                        continue
+                    self._cancelled[host].set()
+                    conn = self._conns.get(host)
+                    if conn is not None:
+                        self._abort(conn)
+                    pending.pop(future)
+                    # Report the records collected so far, the task may still append the one in flight
+                    results[host] = {'host': host,
+                                     'records': list(progress[host]['records']),
+                                     'error': 'host timeout',
+                                     'duration (secs)': round(now - started, 4),
+                                     }
+        finally:
+            # Do not block on hosts that timed out, their aborted commands finish in the background
+            executor.shutdown(wait=False)
+ 
+        return {host: results[host] for host in self.hosts if host in results}
@@ -0,0 +1,258 @@
+import datetime
+import hashlib
+import json
+import sqlite3
+import threading
+ 
+# Columns of the commands table filled from the log entry fields of the same name, every other field
+# of an entry (phases, delta results_diff...) is kept in the extra JSON column
+_COMMAND_FIELDS = {'timestamp': 'timestamp',
+                   'host': 'host',
+                   'telnet_host': 'telnet_host',
+                   'stdin': 'stdin',
+                   'stderr': 'stderr',
+                   'domain': 'domain',
+                   'cmd_duration (secs)': 'cmd_duration',
+                   'elapsed_time (h:m:s)': 'elapsed_time',
+                   'timezone_NE': 'timezone_ne',
+                   'timezone_host': 'timezone_host',
+                   'delta': 'delta',
+                   'delta_of': 'delta_of',
+                   'parse_id': 'parse_id',
+                   }
+ 
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outputs (
+    id INTEGER PRIMARY KEY,
+    digest TEXT NOT NULL UNIQUE,
+    stdout TEXT
+);
+CREATE TABLE IF NOT EXISTS commands (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT,
+    host TEXT,
+    telnet_host TEXT,
+    stdin TEXT,
+    stderr TEXT,
+    domain TEXT,
+    cmd_duration REAL,
+    elapsed_time TEXT,
+    timezone_ne TEXT,
+    timezone_host TEXT,
+    delta TEXT,
+    delta_of TEXT,
+    parse_id INTEGER,
+    output_id INTEGER REFERENCES outputs(id),
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    command_id INTEGER NOT NULL REFERENCES commands(id),
+    template TEXT NOT NULL,
+    row_num INTEGER NOT NULL,
+    row TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS result_values (
+    result_id INTEGER NOT NULL REFERENCES results(id),
+    template TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS commands_host ON commands(host, timestamp);
+CREATE INDEX IF NOT EXISTS commands_stdin ON commands(stdin, timestamp);
+CREATE INDEX IF NOT EXISTS commands_timestamp ON commands(timestamp);
+CREATE INDEX IF NOT EXISTS results_command ON results(command_id);
+CREATE INDEX IF NOT EXISTS results_template ON results(template);
+CREATE INDEX IF NOT EXISTS result_values_field ON result_values(template, field, value);
+"""
+ 
+ 
+def _digest(stdout: str) -> str:
+    return hashlib.blake2b(str(stdout).encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+ 
+ 
+def _value(value):
+    """
+    Helper func - TextFSM values are strings or lists of strings, lists are stored as JSON
+    """
+    return value if isinstance(value, str) or value is None else json.dumps(value)
+ 
+ 
+class SQLiteSink:
+    def __init__(self, file_name: str, timeout: float = 30.0):
+        """
+        CmdLogger sink that stores log records in a SQLite database instead of a JSON log file.
+ 
+        Tables
+            commands      - one row per record, indexed on host, command (stdin) and timestamp
+            outputs       - raw command responses, stored once per distinct stdout
+            results       - parsed result rows, one per template row, indexed on template
+            result_values - the fields of each result row, indexed on (template, field, value)
+ 
+        The database is opened in WAL mode, so readers do not block the writer, and each write() call
+        is one transaction. Pair it with CmdLogger(writer='thread') to batch records from the logging
+        threads into larger transactions. A sink can be shared by the CmdLoggers of many hosts
+ 
+        Usage:
+            sink = SQLiteSink('fleet.db')
+            logger = CmdLogger(host, sink=sink, writer='thread')
+            ...
+            sink.find_rows('show_card', SLOT='1/3', TYPE='11QPA4')
+ 
+        :param file_name: database file name, created when it does not exist
+        :param timeout: (Optional) secs to wait for a lock held by another process
+        """
+        self.file_name = file_name
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(file_name, timeout=timeout, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+ 
+    def __enter__(self):
+        return self
+ 
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+ 
+    @property
+    def closed(self) -> bool:
+        return self._db is None
+ 
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+ 
+    def write(self, entries: list) -> None:
+        """
+        Insert a batch of log entries in a single transaction
+ 
+        :param entries: log entry dicts, as built by CmdLogger.build_log_entry
+        """
+        with self._lock:
+            with self._db:
+                for entry in entries:
+                    self._insert(entry)
+ 
+    def _insert(self, entry: dict) -> None:
+        """
+        Helper func - insert one entry, caller must hold _lock and a transaction
+        """
+        if 'parse_of' in entry and 'stdout' not in entry:
+            # Deferred parse results, attach them to the raw record written earlier
+            row = self._db.execute('SELECT id FROM commands WHERE host = ? AND timestamp = ? AND parse_id = ?',
+                                   (entry.get('host'), entry['parse_of'], entry.get('parse_id'))).fetchone()
+            if row is not None:
+                self._insert_results(row['id'], entry.get('results', {}))
+                return
+ 
+        output_id = None
+        if 'stdout' in entry:
+            digest = _digest(entry['stdout'])
+            self._db.execute('INSERT OR IGNORE INTO outputs (digest, stdout) VALUES (?, ?)',
+                             (digest, entry['stdout']))
+            output_id = self._db.execute('SELECT id FROM outputs WHERE digest = ?', (digest,)).fetchone()['id']
+ 
+        extra = {key: value for key, value in entry.items()
+                 if key not in _COMMAND_FIELDS and key not in ('stdout', 'results')}
+        columns = [column for key, column in _COMMAND_FIELDS.items() if key in entry]
+        values = [entry[key] for key in _COMMAND_FIELDS if key in entry]
+        columns += ['output_id', 'extra']
+        values += [output_id, json.dumps(extra) if bool(extra) is True else None]
+        cur = self._db.execute(f"INSERT INTO commands ({', '.join(columns)}) VALUES ({', '.join('?' * len(values))})",
+                               values)
+        self._insert_results(cur.lastrowid, entry.get('results', {}))
+ 
+    def _insert_results(self, command_id: int, results: dict) -> None:
+        """
+        Helper func - insert the parsed result rows of a command, caller must hold _lock and a transaction
+        """
+        for template, rows in results.items():
+            for row_num, row in enumerate(rows):
+                cur = self._db.execute('INSERT INTO results (command_id, template, row_num, row) VALUES (?, ?, ?, ?)',
+                                       (command_id, template, row_num, json.dumps(row)))
+                self._db.executemany('INSERT INTO result_values (result_id, template, field, value) VALUES (?, ?, ?, ?)',
+                                     [(cur.lastrowid, template, field, _value(value)) for field, value in row.items()])
+ 
+    def query(self, sql: str, params=()) -> list:
+        """
+        Run a read only query against the database
+        :return: list of dicts, one per result row
+        """
+        with self._lock:
+            return [dict(row) for row in self._db.execute(sql, params).fetchall()]
+ 
+    def find_rows(self, template: str, host: str = None, start=None, end=None, **values) -> list:
+        """
+        Find the parsed result rows of a template whose fields have the given values, e.g. the NEs
+        with a given card in slot 1/3
+            sink.find_rows('show_card', SLOT='1/3', TYPE='11QPA4')
+ 
+        :param template: template name, key of the record's results dict
+        :param host: (Optional) NE host IP address
+        :param start: (Optional) datetime or ISO format string, records at or after start
+        :param end: (Optional) datetime or ISO format string, records before end
+        :param values: (Optional) field=value filters, list values are matched by their JSON form
+        :return: list of dicts - {'host', 'telnet_host', 'timestamp', 'stdin', 'row'} in timestamp order
+        """
+        sql = ['SELECT c.host, c.telnet_host, c.timestamp, c.stdin, r.row FROM results r',
+               'JOIN commands c ON c.id = r.command_id']
+        where = ['r.template = ?']
+        params = [template]
+        for i, (field, value) in enumerate(values.items()):
+            sql.append(f'JOIN result_values v{i} ON v{i}.result_id = r.id')
+            where.append(f'v{i}.template = ? AND v{i}.field = ? AND v{i}.value = ?')
+            params += [template, field, _value(value)]
+        if host is not None:
+            where.append('c.host = ?')
+            params.append(host)
+        if start is not None:
+            where.append('c.timestamp >= ?')
+            params.append(str(start) if isinstance(start, datetime.datetime) else start)
+        if end is not None:
+            where.append('c.timestamp < ?')
+            params.append(str(end) if isinstance(end, datetime.datetime) else end)
+        sql.append(f"WHERE {' AND '.join(where)} ORDER BY c.timestamp, r.row_num")
+        rows = self.query(' '.join(sql), params)
+        for row in rows:
+            row['row'] = json.loads(row['row'])
+        return rows
+ 
+    def iter_records(self, host: str = None, stdin: str = None, start=None, end=None):
+        """
+        Generator - yields the stored records, rebuilt as log entry dicts, in timestamp order
+ 
+        :param host: (Optional) NE host IP address
+        :param stdin: (Optional) command string, exact match
+        :param start: (Optional) datetime or ISO format string, records at or after start
+        :param end: (Optional) datetime or ISO format string, records before end
+        :return: log entry dicts
+        """
+        where, params = [], []
+        for column, op, value in (('host', '=', host), ('stdin', '=', stdin), ('timestamp', '>=', start),
+                                  ('timestamp', '<', end)):
+            if value is not None:
+                where.append(f'c.{column} {op} ?')
+                params.append(str(value) if isinstance(value, datetime.datetime) else value)
+        sql = 'SELECT c.*, o.stdout FROM commands c LEFT JOIN outputs o ON o.id = c.output_id'
+        if bool(where) is True:
+            sql = f"{sql} WHERE {' AND '.join(where)}"
+        for row in self.query(f'{sql} ORDER BY c.timestamp, c.id', params):
+            entry = {}
+            for key, column in _COMMAND_FIELDS.items():
+                if row[column] is not None:
+                    entry[key] = row[column]
+            if row['output_id'] is not None:
+                entry['stdout'] = row['stdout']
+            results = {}
+            for result in self.query('SELECT template, row FROM results WHERE command_id = ? ORDER BY id',
+                                     (row['id'],)):
+                results.setdefault(result['template'], []).append(json.loads(result['row']))
+            if row['output_id'] is not None or bool(results) is True:
+                entry['results'] = results
+            if row['extra'] is not None:
+                entry.update(json.loads(row['extra']))
+            yield entry
@@ -0,0 +1,280 @@
+import datetime
+import gzip
+import json
+import os
+import re
+ 
+from utils.blob_store import BLOB_DIR, BlobStore
+from utils.cmd_parser import apply_results_diff, apply_stdout_diff
+ 
+# CmdLogger output files, plain or gzip compressed segments. Manifest (log-<host>-<date>.manifest.json)
+# and index files are skipped
+LOG_FILE_RE = re.compile(r'^log-(?!.*\.manifest\.json$).*\.(json|ndjson)(\.gz)?$')
+INDEX_EXT = 'idx'
+INDEX_VERSION = 1
+ 
+# Index record fields, one list per log record
+#   [byte offset, byte length, timestamp, host, stdin, domain, telnet_host]
+_IDX_OFFSET, _IDX_LENGTH, _IDX_TIMESTAMP, _IDX_HOST, _IDX_STDIN, _IDX_DOMAIN, _IDX_TELNET = range(7)
+ 
+ 
+def log_files(path: str) -> list:
+    """
+    Return the CmdLogger files found at path, sorted by name
+ 
+    :param path: log file or directory containing log files
+    :return: list of log file names
+    """
+    if os.path.isdir(path) is False:
+        return [path]
+    return sorted(os.path.join(path, f) for f in os.listdir(path)
+                  if LOG_FILE_RE.match(f) is not None and os.path.isfile(os.path.join(path, f)))
+ 
+ 
+def _open(file_name: str):
+    """
+    Open a log file for binary reads, gzip compressed segments are decompressed on the fly.
+    NOTE: seeking a compressed segment decompresses up to the offset
+    """
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, 'rb')
+    return open(file_name, 'rb')
+ 
+ 
+def _scan(fid, chunk_size: int = 1 << 20):
+    """
+    Generator - yields (byte offset, byte length, entry) for each record of an open log file in either
+    the legacy JSON array or the NDJSON format. Incomplete trailing records and the legacy {} sentinel
+    are skipped.
+ 
+    CmdLogger writes ASCII only JSON, so the data is decoded as latin-1 which maps bytes to chars one
+    to one and keeps char positions equal to byte offsets.
+    """
+    first = fid.read(1)
+    while first.isspace():
+        first = fid.read(1)
+    fid.seek(0)
+ 
+    if first != b'[':
+        offset = 0
+        for line in fid:
+            length = len(line)
+            if line.strip() != b'':
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = None
+                if bool(entry) is True:
+                    yield offset, length, entry
+            offset += length
+        return
+ 
+    decoder = json.JSONDecoder()
+    buf = fid.read(chunk_size).decode('latin-1')
+    base = 0        # file offset of buf[0]
+    pos = 0
+    eof = len(buf) < chunk_size
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,[]':
+            pos += 1
+        if pos >= len(buf):
+            if eof is True:
+                return
+            base += len(buf)
+            buf, pos = fid.read(chunk_size).decode('latin-1'), 0
+            eof = len(buf) < chunk_size
+            continue
+        try:
+            entry, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof is True:
+                return
+            more = fid.read(chunk_size).decode('latin-1')
+            eof = len(more) < chunk_size
+            base += pos
+            buf, pos = buf[pos:] + more, 0
+            continue
+        if bool(entry) is True:
+            yield base + pos, end - pos, entry
+        pos = end
+ 
+ 
+def index_name(file_name: str) -> str:
+    return f'{file_name}.{INDEX_EXT}'
+ 
+ 
+def build_index(file_name: str) -> dict:
+    """
+    Scan a log file and write its sidecar index, <file_name>.idx, holding the byte offset, length,
+    timestamp, host, stdin, domain and telnet_host of every record
+ 
+    :param file_name: log file name
+    :return: index dict
+    """
+    stat = os.stat(file_name)
+    records = []
+    with _open(file_name) as fid:
+        for offset, length, entry in _scan(fid):
+            records.append([offset, length, entry.get('timestamp'), entry.get('host'), entry.get('stdin'),
+                            entry.get('domain'), entry.get('telnet_host')])
+    index = {'version': INDEX_VERSION,
+             'size': stat.st_size,
+             'mtime_ns': stat.st_mtime_ns,
+             'records': records,
+             }
+    tmp_name = f'{index_name(file_name)}.tmp'
+    with open(tmp_name, 'w') as fid:
+        json.dump(index, fid, separators=(',', ':'))
+    os.replace(tmp_name, index_name(file_name))
+    return index
+ 
+ 
+def load_index(file_name: str, rebuild: bool = True):
+    """
+    Load the sidecar index of a log file. The index is stale once the log file size or modification
+    time no longer matches the values recorded when it was built
+ 
+    :param file_name: log file name
+    :param rebuild: (Optional) If True build the index when it is missing or stale, else return None
+    :return: index dict or None
+    """
+    try:
+        with open(index_name(file_name), 'r') as fid:
+            index = json.load(fid)
+        stat = os.stat(file_name)
+        if index.get('version') == INDEX_VERSION and index.get('size') == stat.st_size and \
+                index.get('mtime_ns') == stat.st_mtime_ns:
+            return index
+    except (OSError, ValueError):
+        pass
+    return build_index(file_name) if rebuild is True else None
+ 
+ 
+def _to_datetime(value):
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    return datetime.datetime.fromisoformat(str(value))
+ 
+ 
+def _match(timestamp, host, stdin, domain, telnet_host, f_host, f_stdin, f_domain, start, end) -> bool:
+    """
+    Helper func - True if the record fields satisfy every filter that is set
+    """
+    if f_host is not None and f_host != host and f_host != telnet_host:
+        return False
+    if f_domain is not None and f_domain != domain:
+        return False
+    if f_stdin is not None:
+        if isinstance(f_stdin, re.Pattern):
+            if stdin is None or f_stdin.search(stdin) is None:
+                return False
+        elif f_stdin != stdin:
+            return False
+    if start is not None or end is not None:
+        try:
+            ts = _to_datetime(timestamp)
+        except (TypeError, ValueError):
+            return False
+        if ts is None or (start is not None and ts < start) or (end is not None and ts >= end):
+            return False
+    return True
+ 
+ 
+def expand_deltas(entries):
+    """
+    Generator - rebuild the full form of the compact records written by a CmdLogger in delta mode.
+    'unchanged' records get the stdout and results of the record they refer to, 'diff' records get
+    stdout and results rebuilt from the line and row level differences. A 'diff' record that refers to
+    a stdout left in a blob store keeps its stdout_diff and gets stdout None. A compact record whose
+    earlier full record is not part of entries is passed on unchanged
+ 
+    :param entries: log entry dicts in log order, e.g. from iter_records()
+    :return: log entry dicts
+    """
+    last = {}   # (host, stdin, domain): full entry
+    for entry in entries:
+        key = (entry.get('telnet_host', entry.get('host')), entry.get('stdin'), entry.get('domain'))
+        kind = entry.get('delta')
+        if kind is None:
+            if 'stdout' in entry or 'stdout_blob' in entry:
+                last[key] = entry
+            yield entry
+            continue
+        base = last.get(key)
+        if base is None or base.get('timestamp') != entry.get('delta_of'):
+            yield entry
+            continue
+        entry = dict(entry)
+        if kind == 'unchanged':
+            # A stdout left in a blob store stays a reference
+            for field in ('stdout', 'stdout_blob', 'stdout_len'):
+                if field in base:
+                    entry[field] = base[field]
+            entry['results'] = base.get('results', {})
+        else:
+            if isinstance(base.get('stdout'), str) is True:
+                entry['stdout'] = apply_stdout_diff(base['stdout'], entry.pop('stdout_diff'))
+            else:
+                entry['stdout'] = None
+            entry['results'] = apply_results_diff(base.get('results', {}), entry.pop('results_diff', {}))
+        last[key] = entry
+        yield entry
+ 
+ 
+def iter_records(path: str, host: str = None, stdin=None, domain: str = None, start=None, end=None,
+                 use_index: bool = False, resolve_blobs: bool = True, blob_dir: str = None):
+    """
+    Generator - lazily yields the CmdLogger records stored in a log file or a directory of log files
+    that match all of the filters given
+ 
+    :param path: log file or directory containing log files (plain or .gz segments)
+    :param host: (Optional) NE host IP address, matches host or telnet_host
+    :param stdin: (Optional) command string, exact match, or a compiled regular expression to search for
+    :param domain: (Optional) command domain [root | ne | dbgCutThru | na]
+    :param start: (Optional) datetime or ISO format string, records at or after start
+    :param end: (Optional) datetime or ISO format string, records before end
+    :param use_index: (Optional) If True use, building when needed, the sidecar index of each file so
+                        only the matching records are read
+    :param resolve_blobs: (Optional) If True a stdout kept in a blob store, 'stdout_blob' and 'stdout_len'
+                        fields, is read back into the stdout field. Records whose blob is missing are
+                        yielded unchanged
+    :param blob_dir: (Optional) blob store directory, default the blobs directory next to each log file
+    :return: log entry dicts
+    """
+    start = _to_datetime(start)
+    end = _to_datetime(end)
+    filters = (host, stdin, domain, start, end)
+    stores = {}     # blob store directory: BlobStore
+ 
+    for file_name in log_files(path):
+        if resolve_blobs is True:
+            root = blob_dir if blob_dir is not None else os.path.join(os.path.dirname(file_name), BLOB_DIR)
+            if root not in stores:
+                stores[root] = BlobStore(root, create=False)
+            for entry in _iter_file(file_name, filters, use_index):
+                yield stores[root].resolve(entry)
+        else:
+            yield from _iter_file(file_name, filters, use_index)
+ 
+ 
+def _iter_file(file_name: str, filters: tuple, use_index: bool):
+    """
+    Helper func - iter_records of one log file, without blob resolution
+    """
+    if use_index is True:
+        index = load_index(file_name)
+        hits = [r for r in index['records']
+                if _match(r[_IDX_TIMESTAMP], r[_IDX_HOST], r[_IDX_STDIN], r[_IDX_DOMAIN], r[_IDX_TELNET],
+                          *filters)]
+        if bool(hits) is False:
+            return
+        with _open(file_name) as fid:
+            for r in hits:
+                fid.seek(r[_IDX_OFFSET])
+                yield json.loads(fid.read(r[_IDX_LENGTH]))
+    else:
+        with _open(file_name) as fid:
+            for _, _, entry in _scan(fid):
+                if _match(entry.get('timestamp'), entry.get('host'), entry.get('stdin'), entry.get('domain'),
+                          entry.get('telnet_host'), *filters):
+                    yield entry
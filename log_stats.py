@@ -0,0 +1,427 @@
+import argparse
+import datetime
+import heapq
+import json
+import os
+import re
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+ 
+from utils.cmd_parser import template_resolver
+from utils.log_reader import _open, _scan, _to_datetime, log_files
+ 
+# Record markers counted as failures, see Connection.execute and SSH_Connection.openConnection
+FAILED_RESPONSE = 'Failed command response'
+FAILED_CONNECTION = ('Connection Failed', 'Host connection failed')
+ 
+# Top level fields read by the NDJSON fast path, (key, name, last). A key can only be found outside JSON
+# strings, a quote inside a string is escaped. Fields written before results take the first match, fields
+# written after results (which may hold rows with the same names) take the last. CmdLogger writes NDJSON
+# without a space after the colon, whitespace before the value is skipped so other writers match too
+_FIELDS = ((b'"timestamp":', 'timestamp', False),
+           (b'"host":', 'host', False),
+           (b'"stdin":', 'stdin', False),
+           (b'"stderr":', 'stderr', False),
+           (b'"cmd_duration (secs)":', 'cmd_duration (secs)', True),
+           (b'"telnet_host":', 'telnet_host', True),
+           )
+_NUMBER_RE = re.compile(rb'-?[0-9.eE+-]+')
+_FAILED_TEXT = FAILED_RESPONSE.encode()
+_FAILED_STDOUT_RE = re.compile(rb'"stdout":\s*"' + re.escape(_FAILED_TEXT) + rb'"')
+ 
+PERCENTILES = (50, 90, 95, 99)
+GROUP_BY = ('host', 'cmd', 'bucket')
+ 
+ 
+class LogColumns:
+    def __init__(self):
+        """
+        Columnar form of the latency fields of a set of log records, one array per field. Host and
+        command strings are dictionary encoded, the columns hold the index into hosts / cmds, so the
+        columns stay compact and cheap to send between processes
+        """
+        self.timestamp = array('d')     # POSIX secs
+        self.duration = array('d')      # cmd_duration (secs)
+        self.failed = array('B')        # 1 for a failure record
+        self.host = array('I')          # index into self.hosts
+        self.cmd = array('I')           # index into self.cmds
+        self.hosts = []
+        self.cmds = []
+        self._host_codes = {}
+        self._cmd_codes = {}
+ 
+    def __len__(self) -> int:
+        return len(self.duration)
+ 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['_host_codes'], state['_cmd_codes']
+        return state
+ 
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._host_codes = {host: code for code, host in enumerate(self.hosts)}
+        self._cmd_codes = {cmd: code for code, cmd in enumerate(self.cmds)}
+ 
+    @staticmethod
+    def _code(value: str, values: list, codes: dict) -> int:
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(values)
+            values.append(value)
+        return code
+ 
+    def append(self, timestamp: float, host: str, cmd: str, duration: float, failed: bool) -> None:
+        self.timestamp.append(timestamp)
+        self.duration.append(duration)
+        self.failed.append(1 if failed is True else 0)
+        self.host.append(self._code(host, self.hosts, self._host_codes))
+        self.cmd.append(self._code(cmd, self.cmds, self._cmd_codes))
+ 
+    def extend(self, other) -> None:
+        """
+        Append the columns of another LogColumns, re-mapping its host and command codes
+        """
+        host_map = [self._code(host, self.hosts, self._host_codes) for host in other.hosts]
+        cmd_map = [self._code(cmd, self.cmds, self._cmd_codes) for cmd in other.cmds]
+        self.timestamp.extend(other.timestamp)
+        self.duration.extend(other.duration)
+        self.failed.extend(other.failed)
+        self.host.extend(array('I', map(host_map.__getitem__, other.host)))
+        self.cmd.extend(array('I', map(cmd_map.__getitem__, other.cmd)))
+ 
+ 
+def is_failure(entry: dict) -> bool:
+    """
+    True for the failure records, a command that got no response or a failed connection
+    """
+    if entry.get('stdout') == FAILED_RESPONSE:
+        return True
+    stderr = str(entry.get('stderr', ''))
+    stdin = str(entry.get('stdin', ''))
+    return stderr.startswith(FAILED_CONNECTION[0]) or stdin.endswith(FAILED_CONNECTION[1])
+ 
+ 
+def _fields(line: bytes):
+    """
+    Helper func - NDJSON fast path, extract the latency fields of a record without decoding its
+    stdout and results. Returns None when a value is not a plain string or number, the record is
+    then fully decoded
+ 
+    :return: dict - {'timestamp', 'host', 'stdin', 'stderr', 'cmd_duration (secs)', 'telnet_host', 'stdout'},
+                    missing fields are left out, stdout is only set for failure records
+    """
+    entry = {}
+    for key, name, last in _FIELDS:
+        pos = line.rfind(key) if last is True else line.find(key)
+        if pos < 0:
+            continue
+        pos += len(key)
+        while line[pos:pos + 1] in (b' ', b'\t'):
+            pos += 1
+        if line[pos] == 0x22:   # "
+            end = line.find(b'"', pos + 1)
+            while end > 0 and line[end - 1] == 0x5C:    # \
+                # Escaped quote, unless the backslash is itself escaped
+                slashes = len(line[pos + 1:end]) - len(line[pos + 1:end].rstrip(b'\\'))
+                if slashes % 2 == 0:
+                    break
+                end = line.find(b'"', end + 1)
+            if end < 0:
+                return None
+            value = line[pos + 1:end]
+            entry[name] = value.decode('latin-1') if b'\\' not in value else json.loads(line[pos:end + 1])
+        else:
+            m = _NUMBER_RE.match(line, pos)
+            try:
+                entry[name] = float(m.group())
+            except (AttributeError, ValueError):
+                # null or not a number
+                return None
+    if 'timestamp' not in entry or 'cmd_duration (secs)' not in entry:
+        return None
+    if _FAILED_TEXT in line and _FAILED_STDOUT_RE.search(line) is not None:
+        entry['stdout'] = FAILED_RESPONSE
+    return entry
+ 
+ 
+def _records(fid):
+    """
+    Generator - yields the (partial) entry dict of each record of an open log file, the NDJSON fast
+    path is used when the file is not a legacy JSON array
+    """
+    first = fid.read(1)
+    while first.isspace():
+        first = fid.read(1)
+    fid.seek(0)
+    if first == b'[':
+        for _, _, entry in _scan(fid):
+            yield entry
+        return
+    for line in fid:
+        entry = _fields(line)
+        if entry is None:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+        if bool(entry) is True:
+            yield entry
+ 
+ 
+class _TimestampParser:
+    """
+    Helper class - converts CmdLogger timestamp strings, 'YYYY-MM-DD HH:MM:SS[.ffffff]' local time, to
+    POSIX secs. The local time conversion is done once per hour, the minutes and secs are added to it
+    """
+    def __init__(self):
+        self._hours = {}
+ 
+    def __call__(self, value: str) -> float:
+        hour = self._hours.get(value[:13])
+        if hour is None:
+            hour = datetime.datetime.fromisoformat(value[:13]).timestamp()
+            if len(self._hours) > 100000:
+                self._hours.clear()
+            self._hours[value[:13]] = hour
+        if len(value) in (19, 26) and value[13] == ':' and value[16] == ':':
+            return hour + int(value[14:16]) * 60 + float(value[17:])
+        # Not the CmdLogger layout, e.g. a time zone offset
+        return datetime.datetime.fromisoformat(value).timestamp()
+ 
+ 
+def load_file(file_name: str, normalize: bool = False, host: str = None, start=None, end=None) -> LogColumns:
+    """
+    Stream the records of one log file into a LogColumns. Comment records are skipped
+ 
+    :param file_name: log file name (plain or .gz segment)
+    :param normalize: (Optional) If True commands are grouped by their template map key, e.g. all
+                        show card <slot> commands count as show card
+    :param host: (Optional) NE host IP address, matches host or telnet_host
+    :param start: (Optional) datetime or ISO format string, records at or after start
+    :param end: (Optional) datetime or ISO format string, records before end
+    :return: LogColumns
+    """
+    start = _to_datetime(start)
+    end = _to_datetime(end)
+    start = start.timestamp() if start is not None else None
+    end = end.timestamp() if end is not None else None
+    cols = LogColumns()
+    parse_ts = _TimestampParser()
+    normalized = {}     # stdin: template map key
+    with _open(file_name) as fid:
+        for entry in _records(fid):
+            stdin = str(entry.get('stdin', ''))
+            if stdin.startswith('Comment: '):
+                continue
+            rec_host = entry.get('telnet_host', entry.get('host'))
+            if host is not None and host != rec_host and host != entry.get('host'):
+                continue
+            try:
+                ts = parse_ts(entry['timestamp'])
+                duration = float(entry.get('cmd_duration (secs)', 0.0))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if (start is not None and ts < start) or (end is not None and ts >= end):
+                continue
+            cmd = stdin
+            if normalize is True:
+                cmd = normalized.get(stdin)
+                if cmd is None:
+                    cmd = normalized[stdin] = template_resolver.normalize(stdin)
+            cols.append(ts, str(rec_host), cmd, duration, is_failure(entry))
+    return cols
+ 
+ 
+def load_columns(paths: list, workers: int = None, **kwargs) -> LogColumns:
+    """
+    Load the records of all the log files found at paths, files are read in parallel worker processes
+ 
+    :param paths: list of log files or directories containing log files
+    :param workers: (Optional) max worker processes, defaults to the CPU count. 1 reads the files in
+                        this process
+    :param kwargs: (Optional) load_file filters - normalize, host, start, end
+    :return: LogColumns of all the files, in file name order
+    """
+    files = [file_name for path in paths for file_name in log_files(path)]
+    workers = min(len(files), workers if workers is not None else (os.cpu_count() or 1))
+    cols = LogColumns()
+    if workers <= 1:
+        for file_name in files:
+            cols.extend(load_file(file_name, **kwargs))
+        return cols
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        futures = [ex.submit(load_file, file_name, **kwargs) for file_name in files]
+        for future in futures:
+            cols.extend(future.result())
+    return cols
+ 
+ 
+def _percentile(values: list, p: float):
+    """
+    Helper func - nearest rank percentile of sorted values
+    """
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+ 
+ 
+def _summary(durations: array, failed: int, first: float, last: float, span: float = None) -> dict:
+    """
+    Helper func - latency summary of a group
+ 
+    :param durations: cmd_duration (secs) of the group's successful records
+    :param failed: number of failure records in the group
+    :param first: timestamp of the group's first record
+    :param last: timestamp of the group's last record
+    :param span: (Optional) secs the throughput is measured over, default last - first
+    """
+    ok = sorted(durations)
+    count = len(ok) + failed
+    span = span if span is not None else last - first
+    rtn = {'count': count,
+           'failed': failed,
+           'failure_rate': round(failed / count, 4) if count > 0 else 0.0,
+           'throughput (cmds/sec)': round(count / span, 4) if span > 0 else None,
+           'mean': round(sum(ok) / len(ok), 4) if bool(ok) is True else None,
+           }
+    for p in PERCENTILES:
+        rtn[f'p{p}'] = _percentile(ok, p) if bool(ok) is True else None
+    rtn['max'] = ok[-1] if bool(ok) is True else None
+    return rtn
+ 
+ 
+def group_stats(cols: LogColumns, by: str, bucket: float = 3600.0) -> dict:
+    """
+    Per group latency summary
+ 
+    :param cols: LogColumns
+    :param by: group by [host | cmd | bucket]
+    :param bucket: (Optional) time bucket size (secs) when grouping by bucket
+    :return: {group: summary dict}, bucket groups are keyed by the bucket start time ISO string
+    """
+    if by == 'host':
+        keys, names = cols.host, cols.hosts
+    elif by == 'cmd':
+        keys, names = cols.cmd, cols.cmds
+    elif by == 'bucket':
+        keys = array('q', (int(ts // bucket) for ts in cols.timestamp))
+        names = None
+    else:
+        raise ValueError(f'Invalid group {by} - valid groups {GROUP_BY}')
+ 
+    durations, failed, first, last = {}, {}, {}, {}
+    for key, duration, fail, ts in zip(keys, cols.duration, cols.failed, cols.timestamp):
+        if key not in first:
+            durations[key] = array('d')
+            failed[key] = 0
+            first[key] = last[key] = ts
+        if fail == 1:
+            failed[key] += 1
+        else:
+            durations[key].append(duration)
+        if ts < first[key]:
+            first[key] = ts
+        elif ts > last[key]:
+            last[key] = ts
+ 
+    rtn = {}
+    for key in sorted(first):
+        if names is None:
+            name = datetime.datetime.fromtimestamp(key * bucket).isoformat()
+            rtn[name] = _summary(durations[key], failed[key], first[key], last[key], span=bucket)
+        else:
+            rtn[names[key]] = _summary(durations[key], failed[key], first[key], last[key])
+    return rtn
+ 
+ 
+def slowest(cols: LogColumns, top: int = 10) -> list:
+    """
+    :return: list of the top slowest records, slowest first - [{'timestamp', 'host', 'cmd', 'cmd_duration (secs)'}]
+    """
+    rtn = []
+    for i in heapq.nlargest(top, range(len(cols)), key=cols.duration.__getitem__):
+        rtn.append({'timestamp': datetime.datetime.fromtimestamp(cols.timestamp[i]).isoformat(),
+                    'host': cols.hosts[cols.host[i]],
+                    'cmd': cols.cmds[cols.cmd[i]],
+                    'cmd_duration (secs)': cols.duration[i],
+                    })
+    return rtn
+ 
+ 
+def summarize(paths: list, by: tuple = GROUP_BY, bucket: float = 3600.0, top: int = 10, workers: int = None,
+              **kwargs) -> dict:
+    """
+    Latency analytics of CmdLogger log files
+ 
+    Usage:
+        report = summarize(['logs/'], by=('host', 'cmd'), normalize=True)
+        report['by_host']['10.0.0.1']['p95']
+ 
+    :param paths: list of log files or directories containing log files
+    :param by: (Optional) groupings to report [host | cmd | bucket]
+    :param bucket: (Optional) time bucket size (secs)
+    :param top: (Optional) number of slowest records to report
+    :param workers: (Optional) max worker processes used to read the files
+    :param kwargs: (Optional) load_file filters - normalize, host, start, end
+    :return: dict - {'overall': summary, 'by_<group>': {group: summary}, 'slowest': [records]}
+    """
+    cols = load_columns(paths, workers=workers, **kwargs)
+    failed = sum(cols.failed)
+    durations = array('d', (d for d, fail in zip(cols.duration, cols.failed) if fail == 0))
+    first = min(cols.timestamp) if len(cols) > 0 else 0.0
+    last = max(cols.timestamp) if len(cols) > 0 else 0.0
+    rtn = {'overall': _summary(durations, failed, first, last)}
+    for group in by:
+        rtn[f'by_{group}'] = group_stats(cols, group, bucket=bucket)
+    rtn['slowest'] = slowest(cols, top)
+    return rtn
+ 
+ 
+def _print_table(title: str, groups: dict) -> None:
+    print(f'\n{title}')
+    cols = ['count', 'failure_rate', 'throughput (cmds/sec)', 'mean'] + [f'p{p}' for p in PERCENTILES] + ['max']
+    width = max([len(str(name)) for name in groups] + [len(title)])
+    print(f"{'':<{width}} " + ' '.join(f'{col.split()[0]:>12}' for col in cols))
+    for name, summary in groups.items():
+        print(f'{str(name):<{width}} ' + ' '.join(f"{'-' if summary[col] is None else summary[col]:>12}" for col in cols))
+ 
+ 
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Command latency analytics over CmdLogger log files')
+    parser.add_argument('paths', nargs='+', help='log files or directories containing log files')
+    parser.add_argument('--by', default=','.join(GROUP_BY), help=f'comma separated groupings {",".join(GROUP_BY)}')
+    parser.add_argument('--bucket', type=float, default=3600.0, help='time bucket size (secs)')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest commands reported')
+    parser.add_argument('--workers', type=int, help='max worker processes, default CPU count')
+    parser.add_argument('--normalize', action='store_true', help='group commands by their template map key')
+    parser.add_argument('--host', help='only records of this NE host')
+    parser.add_argument('--start', help='only records at or after this ISO format time')
+    parser.add_argument('--end', help='only records before this ISO format time')
+    parser.add_argument('--json', dest='json_file', help="write the report JSON to this file, '-' for stdout")
+    args = parser.parse_args(argv)
+ 
+    by = tuple(group for group in args.by.split(',') if group != '')
+    invalid = [group for group in by if group not in GROUP_BY]
+    if bool(invalid) is True:
+        parser.error(f'Invalid groups {invalid} - valid groups {GROUP_BY}')
+    report = summarize(args.paths, by=by, bucket=args.bucket, top=args.top, workers=args.workers,
+                       normalize=args.normalize, host=args.host, start=args.start, end=args.end)
+ 
+    if args.json_file == '-':
+        json.dump(report, sys.stdout, indent=2)
+        return 0
+    if args.json_file is not None:
+        with open(args.json_file, 'w') as fid:
+            json.dump(report, fid, indent=2)
+ 
+    _print_table('overall', {'all': report['overall']})
+    for group in by:
+        _print_table(f'by {group}', report[f'by_{group}'])
+    print('\nslowest')
+    for rec in report['slowest']:
+        print(f"{rec['cmd_duration (secs)']:>10} {rec['timestamp']} {rec['host']} {rec['cmd']}")
+    return 0
+ 
+ 
+if __name__ == '__main__':
+    sys.exit(main())
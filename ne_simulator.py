@@ -0,0 +1,564 @@
+import argparse
+import asyncio
+import codecs
+import datetime
+import json
+import random
+import shlex
+import socket
+import threading
+import time
+ 
+import paramiko
+ 
+# Matches PROMPT_STRINGS['more'] in connection_base
+MORE_PROMPT = '...more? y=[yes]'
+ 
+# Canned responses, per domain. A response is the text or a callable(simulator, command) -> text
+DEFAULT_RESPONSES = {
+    'admin': {
+        'show version': 'System Version: 12.0.45\nSystem Type: PSS-32\nUptime: 12 days 03:41:07',
+        'show card': '\n'.join(['Slot   Card Type    Admin  Oper  SW Version',
+                                '-----  -----------  -----  ----  ----------'] +
+                               [f'1/{slot:<4} 11QPA4       up     up    12.0.{40 + slot}' for slot in range(1, 33)] +
+                               ['', 'Total cards: 32']),
+        'show xc *': '\n'.join(['Cross-Connect ID                Source          Destination     Dir    Rate     State',
+                                '------------------------------  --------------  --------------  -----  -------  --------'] +
+                               [f'xc-1/{1 + i // 80}/L{1 + i % 80}-1/{2 + i // 80}/C{1 + i % 80}    1/{1 + i // 80}/L{1 + i % 80}'
+                                f'    1/{2 + i // 80}/C{1 + i % 80}    2way   ODU4   ok' for i in range(400)] +
+                               ['', 'Total cross-connects: 400']),
+        },
+    'root': {
+        'uptime': ' 14:02:11 up 12 days,  3:41,  2 users,  load average: 0.08, 0.12, 0.10',
+        'pwd': '/root',
+        'who': 'root     pts/0        2026-10-17 10:01 (10.0.0.1)\nroot     pts/1        2026-10-17 11:15 (10.0.0.2)',
+        },
+    'dbgCutThru': {
+        'help': 'dbgCut commands: help, exit',
+        },
+    }
+ 
+ 
+class NESimulatorSession:
+    """
+    One interactive shell session. Emulates the NE line discipline: typed characters are echoed,
+    the admin CLI pages long responses with the more-prompt and root can enter the dbgCut subshell
+    """
+    def __init__(self, sim, channel, user: str):
+        self.sim = sim
+        self.channel = channel
+        self.domain = 'admin' if user == 'admin' else 'root'
+        self.paging = True
+        # Set when a carriage return ended a more-prompt answer, the line feed of a CR LF line end is skipped
+        self._skip_lf = False
+ 
+    @property
+    def prompt(self) -> str:
+        if self.domain == 'admin':
+            return f'{self.sim.hostname}# '
+        if self.domain == 'dbgCutThru':
+            return 'dbgCut> '
+        return f'root@{self.sim.hostname}:~# '
+ 
+    def send(self, text: str) -> None:
+        """
+        Write text to the channel, throttled to the simulator bandwidth when one is set
+        """
+        data = text.encode('utf-8')
+        if self.sim.bandwidth is None:
+            self.channel.sendall(data)
+            return
+        chunk = max(1, min(4096, int(self.sim.bandwidth / 100)))
+        for start in range(0, len(data), chunk):
+            self.channel.sendall(data[start:start + chunk])
+            time.sleep(len(data[start:start + chunk]) / self.sim.bandwidth)
+ 
+    def _read_char(self):
+        data = self.channel.recv(1)
+        char = data.decode('utf-8', 'replace') if data else None
+        if char == '\n' and self._skip_lf is True:
+            data = self.channel.recv(1)
+            char = data.decode('utf-8', 'replace') if data else None
+        self._skip_lf = False
+        return char
+ 
+    def _read_answer(self):
+        """
+        Read a more-prompt answer. Like the NE CLI the answer is a line, 'y' then Enter, and its first
+        char decides; nothing happens until the line end arrives
+        :return: first char of the answer line, '' for an empty line, None if the session ended
+        """
+        answer = ''
+        while True:
+            char = self._read_char()
+            if char is None:
+                return None
+            if char in '\r\n':
+                self._skip_lf = char == '\r'
+                return answer[:1]
+            answer += char
+ 
+    def _delay(self) -> None:
+        latency = self.sim.latency
+        if isinstance(latency, (tuple, list)):
+            latency = random.uniform(*latency)
+        if latency > 0:
+            time.sleep(latency)
+ 
+    def run(self) -> None:
+        self.send(f"Last login: {datetime.datetime.now().strftime('%a %b %d %H:%M:%S %Y')} from 127.0.0.1\r\n")
+        self.send(self.prompt)
+        line = []
+        last = ''
+        while self.sim.running is True:
+            char = self._read_char()
+            if char is None:
+                return
+            if char in '\r\n':
+                if char == '\n' and last == '\r':
+                    last = char
+                    continue
+                last = char
+                self.send('\r\n')
+                if self.execute(''.join(line).strip()) is False:
+                    return
+                line = []
+                self.send(self.prompt)
+                continue
+            last = char
+            if char < ' ' and char != '\t' and char not in '\x7f\x08':
+                # Other control characters, e.g. NUL keepalives, are ignored
+                continue
+            if char in '\x7f\x08':
+                if bool(line) is True:
+                    line.pop()
+                    self.send('\x08 \x08')
+                continue
+            line.append(char)
+            self.send(char)
+ 
+    def execute(self, cmd: str) -> bool:
+        """
+        Run one command line
+        :return: False when the session should end
+        """
+        self.sim.count('commands')
+        if cmd == '':
+            return True
+        if cmd in ('exit', 'logout', 'quit'):
+            if self.domain == 'dbgCutThru':
+                self.domain = 'root'
+                return True
+            return False
+ 
+        self._delay()
+        output = self.sim.respond(self.domain, cmd, self)
+        if output is None:
+            return True
+        lines = output.split('\n')
+        if self.domain == 'admin' and self.paging is True and len(lines) > self.sim.page_lines:
+            return self._paginate(lines)
+        if output != '':
+            self.send('\r\n'.join(lines) + '\r\n')
+        return True
+ 
+    def _paginate(self, lines: list) -> bool:
+        for start in range(0, len(lines), self.sim.page_lines):
+            self.send('\r\n'.join(lines[start:start + self.sim.page_lines]) + '\r\n')
+            if start + self.sim.page_lines >= len(lines):
+                break
+            self.send(MORE_PROMPT)
+            answer = self._read_answer()
+            if answer is None:
+                return False
+            # Erase the more-prompt before the next page
+            self.send('\r\x1b[K')
+            if answer == '' or answer not in 'yY ':
+                break
+        return True
+ 
+ 
+class _PipeChannel:
+    """
+    Helper class - in-process stand-in for the paramiko channel of a session, see NESimulator.connector
+    """
+    def __init__(self, on_send, on_idle=None):
+        """
+        :param on_send: called with the bytes the session sends, on the session thread
+        :param on_idle: (Optional) called on the session thread before it waits for input
+        """
+        self._on_send = on_send
+        self._on_idle = on_idle
+        self._buffer = bytearray()
+        self._closed = False
+        self._cond = threading.Condition()
+ 
+    def feed(self, data: bytes) -> None:
+        """
+        Client side - data typed into the session
+        """
+        with self._cond:
+            self._buffer += data
+            self._cond.notify()
+ 
+    def recv(self, n: int) -> bytes:
+        if self._on_idle is not None:
+            with self._cond:
+                idle = bool(self._buffer) is False and self._closed is False
+            if idle is True:
+                self._on_idle()
+        with self._cond:
+            while bool(self._buffer) is False and self._closed is False:
+                self._cond.wait()
+            data = bytes(self._buffer[:n])
+            del self._buffer[:n]
+            return data
+ 
+    def sendall(self, data: bytes) -> None:
+        if self._closed is True:
+            raise OSError('Channel closed')
+        self._on_send(data)
+ 
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+ 
+ 
+class _InProcessSession:
+    """
+    Helper class - AsyncConnection session served by a NESimulatorSession thread in the same process
+    """
+    def __init__(self, sim, user: str, coalesce: bool = False):
+        """
+        :param coalesce: (Optional) If True all the session sends until it waits for input, e.g. the
+                            command echo, the response and the prompt, is delivered as one read
+        """
+        self._sim = sim
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._pending = bytearray() if coalesce is True else None
+        if coalesce is True:
+            self.channel = _PipeChannel(self._pending.extend, on_idle=self._flush)
+        else:
+            self.channel = _PipeChannel(self._received)
+        with sim._lock:
+            sim._pipes.add(self.channel)
+        self._thread = threading.Thread(target=self._run, args=(user,), name='NESimulator-inprocess', daemon=True)
+        self._thread.start()
+ 
+    def _received(self, data: bytes) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, data)
+        except RuntimeError:
+            # The event loop is closed, nobody is reading any more
+            self.channel.close()
+ 
+    def _flush(self) -> None:
+        if bool(self._pending) is True:
+            data = bytes(self._pending)
+            self._pending.clear()
+            self._received(data)
+ 
+    def _run(self, user: str) -> None:
+        try:
+            NESimulatorSession(self._sim, self.channel, user).run()
+        except OSError:
+            pass
+        finally:
+            if self._pending is not None:
+                self._flush()
+            self._sim.count('active', -1)
+            with self._sim._lock:
+                self._sim._pipes.discard(self.channel)
+            self.channel.close()
+            try:
+                self._loop.call_soon_threadsafe(self._queue.put_nowait, b'')
+            except RuntimeError:
+                pass
+ 
+    async def read(self, n: int) -> str:
+        while True:
+            data = await self._queue.get()
+            if data == b'':
+                # End of session, keep reporting it to later reads
+                self._queue.put_nowait(b'')
+                return ''
+            text = self._decoder.decode(data)
+            if text != '':
+                return text
+ 
+    def write(self, data: str) -> None:
+        self.channel.feed(data.encode('utf-8'))
+ 
+    def is_closing(self) -> bool:
+        return self._thread.is_alive() is False
+ 
+    async def close(self) -> None:
+        self.channel.close()
+ 
+ 
+class _SimServer(paramiko.ServerInterface):
+    def __init__(self, sim):
+        self.sim = sim
+        self.user = None
+        self.shell = threading.Event()
+        self.exec_cmd = None
+ 
+    def get_allowed_auths(self, username):
+        return 'password'
+ 
+    def check_auth_password(self, username, password):
+        if username in self.sim.users and self.sim.users[username] in (None, password):
+            self.user = username
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+ 
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+ 
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+ 
+    def check_channel_shell_request(self, channel):
+        self.shell.set()
+        return True
+ 
+    def check_channel_exec_request(self, channel, command):
+        self.exec_cmd = command.decode('utf-8', 'replace') if isinstance(command, bytes) else command
+        self.shell.set()
+        return True
+ 
+ 
+class NESimulator:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, hostname: str = 'NE-SIM', users: dict = None,
+                 responses: dict = None, latency=0.0, bandwidth: float = None, page_lines: int = 24,
+                 host_key: paramiko.PKey = None, backlog: int = 1024):
+        """
+        Local SSH server that emulates an NE for load testing Connection, SSH_Connection and the fleet
+        tools offline. Every client connection gets its own session thread, so many concurrent sessions
+        can be served from one process.
+ 
+        Usage:
+            with NESimulator(latency=0.05) as sim:
+                conn = Connection('127.0.0.1', 'admin', port=sim.port)
+ 
+        :param host: (Optional) listen address
+        :param port: (Optional) listen port, 0 picks a free port, see the port attribute
+        :param hostname: (Optional) NE name used in the prompts and by the hostname command
+        :param users: (Optional) {user: password} accepted logins, a None password accepts any password.
+                        The user decides the shell: admin gets the NE CLI, anyone else the root shell
+        :param responses: (Optional) canned responses merged over DEFAULT_RESPONSES,
+                        {domain: {command: text or callable(simulator, command)}}, domain [admin | root | dbgCutThru]
+        :param latency: (Optional) secs waited before each response, or a (min, max) range
+        :param bandwidth: (Optional) max bytes/sec sent per session, None for unlimited
+        :param page_lines: (Optional) admin CLI lines per page before the more-prompt
+        :param host_key: (Optional) server host key, a 2048 bit RSA key is generated by default
+        :param backlog: (Optional) listen backlog
+        """
+        self.host = host
+        self.port = port
+        self.hostname = hostname
+        self.users = users if users is not None else {'admin': None, 'root': None}
+        self.responses = {domain: dict(cmds) for domain, cmds in DEFAULT_RESPONSES.items()}
+        for domain, cmds in (responses or {}).items():
+            self.responses.setdefault(domain, {}).update(cmds)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.page_lines = max(1, page_lines)
+        self.host_key = host_key
+        self.backlog = backlog
+        self.running = False
+        self._sock = None
+        self._accept_thread = None
+        self._transports = set()
+        self._pipes = set()
+        self._lock = threading.Lock()
+        self.stats = {'connections': 0, 'active': 0, 'commands': 0, 'auth_failures': 0}
+ 
+    def __enter__(self):
+        self.start()
+        return self
+ 
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+ 
+    def count(self, name: str, delta: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += delta
+ 
+    def respond(self, domain: str, cmd: str, session: NESimulatorSession = None):
+        """
+        Response text for a command, built-in commands first, then the canned responses
+        :return: response text, None for no output
+        """
+        if cmd == 'hostname':
+            return self.hostname
+        if cmd == 'date':
+            return datetime.datetime.now(datetime.timezone.utc).strftime('%a %b %d %H:%M:%S UTC %Y')
+        if domain == 'admin' and cmd.startswith('paging status'):
+            if session is not None:
+                session.paging = cmd.split()[-1] == 'enable'
+            return None
+        if domain == 'root':
+            if cmd in ('dbgCut', 'dbgCutThru'):
+                if session is not None:
+                    session.domain = 'dbgCutThru'
+                return None
+            if cmd.startswith('echo'):
+                try:
+                    return ' '.join(shlex.split(cmd)[1:])
+                except ValueError:
+                    return cmd[5:]
+ 
+        response = self.responses.get(domain, {}).get(cmd)
+        if callable(response):
+            return response(self, cmd)
+        if response is not None:
+            return response
+        if domain == 'root':
+            return f'-bash: {cmd.split()[0]}: command not found'
+        return f'Error: Invalid command "{cmd}"'
+ 
+    def start(self) -> int:
+        """
+        Start listening
+        :return: listen port
+        """
+        if self.host_key is None:
+            self.host_key = paramiko.RSAKey.generate(2048)
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        self._sock.listen(self.backlog)
+        self._sock.settimeout(0.5)
+        self.port = self._sock.getsockname()[1]
+        self.running = True
+        self._accept_thread = threading.Thread(target=self._accept, name='NESimulator-accept', daemon=True)
+        self._accept_thread.start()
+        return self.port
+ 
+    def stop(self) -> None:
+        self.running = False
+        if self._accept_thread is not None:
+            self._accept_thread.join()
+            self._accept_thread = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        with self._lock:
+            transports = list(self._transports)
+            pipes = list(self._pipes)
+        for transport in transports:
+            transport.close()
+        for pipe in pipes:
+            pipe.close()
+ 
+    def connector(self, coalesce: bool = False):
+        """
+        Return an AsyncConnection connector that serves the shell session in-process, without SSH or
+        sockets, so the async path can be driven from a test or an event loop with no NE. The session
+        is the same NESimulatorSession the SSH server runs, the simulator must be started
+ 
+        :param coalesce: (Optional) If True the session output up to each wait for input arrives in a
+                            single read, e.g. the command echo together with a whole response page
+ 
+        Usage:
+            with NESimulator() as sim:
+                conn = AsyncConnection('127.0.0.1', 'admin', port=sim.port, connector=sim.connector())
+                await conn.connect()
+        """
+        async def connect(host: str, port: int, username: str, password: str, timeout: float):
+            if self.running is False:
+                raise ConnectionRefusedError(f'NE simulator {self.host}:{self.port} is not running')
+            if username not in self.users or self.users[username] not in (None, password):
+                self.count('auth_failures')
+                raise PermissionError(f'Authentication failed: {username}')
+            with self._lock:
+                self.stats['connections'] += 1
+                self.stats['active'] += 1
+            return _InProcessSession(self, username, coalesce=coalesce)
+        return connect
+ 
+    def _accept(self) -> None:
+        while self.running is True:
+            try:
+                client, _ = self._sock.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            threading.Thread(target=self._serve, args=(client,), name='NESimulator-session', daemon=True).start()
+ 
+    def _serve(self, client) -> None:
+        """
+        Session thread - SSH handshake, then run the shell or exec request of the first channel
+        """
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        server = _SimServer(self)
+        with self._lock:
+            self._transports.add(transport)
+            self.stats['connections'] += 1
+            self.stats['active'] += 1
+        try:
+            transport.start_server(server=server)
+            channel = transport.accept(30)
+            if channel is None:
+                if server.user is None:
+                    self.count('auth_failures')
+                return
+            if server.shell.wait(30) is False:
+                return
+            if server.exec_cmd is not None:
+                self.count('commands')
+                output = self.respond('root' if server.user != 'admin' else 'admin', server.exec_cmd.strip())
+                if output:
+                    channel.sendall((output + '\n').encode('utf-8'))
+                channel.send_exit_status(0)
+            else:
+                NESimulatorSession(self, channel, server.user).run()
+            channel.close()
+        except (paramiko.SSHException, EOFError, OSError):
+            pass
+        finally:
+            transport.close()
+            with self._lock:
+                self._transports.discard(transport)
+                self.stats['active'] -= 1
+ 
+ 
+def main(argv: list = None) -> None:
+    parser = argparse.ArgumentParser(description='Local NE simulator SSH server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2222)
+    parser.add_argument('--hostname', default='NE-SIM')
+    parser.add_argument('--latency', type=float, default=0.0, help='secs before each response')
+    parser.add_argument('--bandwidth', type=float, default=None, help='max bytes/sec per session')
+    parser.add_argument('--page-lines', type=int, default=24)
+    parser.add_argument('--responses', help='JSON file {domain: {command: response text}}')
+    args = parser.parse_args(argv)
+ 
+    responses = None
+    if args.responses is not None:
+        with open(args.responses, 'r') as fid:
+            responses = json.load(fid)
+    sim = NESimulator(host=args.host, port=args.port, hostname=args.hostname, responses=responses,
+                      latency=args.latency, bandwidth=args.bandwidth, page_lines=args.page_lines)
+    sim.start()
+    print(f'NE simulator listening on {sim.host}:{sim.port}')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+ 
+ 
+if __name__ == '__main__':
+    main()
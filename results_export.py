@@ -0,0 +1,197 @@
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+ 
+from utils.cmd_parser import rows_to_columns
+from utils.log_reader import expand_deltas, iter_records
+ 
+# Parquet output needs pyarrow, without it the exporter writes CSV
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+ 
+EXPORT_FORMATS = ('parquet', 'csv')
+ 
+# Record fields added as columns to every exported result row, {column: record field}. The column names
+# are prefixed so they can not clash with the field names of a template
+RECORD_COLUMNS = {'_host': 'host', '_timestamp': 'timestamp', '_stdin': 'stdin'}
+ 
+ 
+def _value(value):
+    """
+    Helper func - TextFSM values are strings or lists of strings, lists are written as JSON
+    """
+    return value if isinstance(value, str) or value is None else json.dumps(value)
+ 
+ 
+class _Part:
+    def __init__(self, file_name: str, header: tuple, fmt: str):
+        """
+        Helper class - an open output file of one template and header
+        """
+        self.file_name = file_name
+        self.header = header
+        self.format = fmt
+        self.columns = {name: [] for name in header}
+        self.rows = 0
+        self.written = 0
+        if fmt == 'parquet':
+            self._schema = pyarrow.schema([(name, pyarrow.string()) for name in header])
+            self._writer = pyarrow.parquet.ParquetWriter(file_name, self._schema)
+        else:
+            self._fid = open(file_name, 'w', newline='')
+            self._writer = csv.writer(self._fid)
+            self._writer.writerow(header)
+ 
+    def flush(self) -> None:
+        if self.rows == 0:
+            return
+        if self.format == 'parquet':
+            self._writer.write_table(pyarrow.Table.from_pydict(self.columns, schema=self._schema))
+        else:
+            self._writer.writerows(zip(*(self.columns[name] for name in self.header)))
+        self.written += self.rows
+        self.rows = 0
+        self.columns = {name: [] for name in self.header}
+ 
+    def close(self) -> None:
+        self.flush()
+        if self.format == 'parquet':
+            self._writer.close()
+        else:
+            self._fid.close()
+ 
+ 
+class ResultExporter:
+    def __init__(self, out_dir: str, format: str = None, batch_rows: int = 65536):
+        """
+        Write column oriented parse results, zip_results(..., columnar=True), to one file per template.
+        Columns are buffered and written in batches of batch_rows rows, a Parquet row group or a block
+        of CSV lines per batch. All values are written as strings, list values as JSON. A template
+        whose header changes, e.g. after a template edit, continues in a new file <template>-<n>
+ 
+        Usage:
+            with ResultExporter('export') as exporter:
+                exporter.add(zip_results(cmd, stdout, domain, columnar=True), _host=host, _stdin=cmd)
+ 
+        :param out_dir: output directory, created when it does not exist
+        :param format: (Optional) [parquet | csv], default parquet when pyarrow is installed, else csv
+        :param batch_rows: (Optional) rows buffered per template before they are written
+        """
+        if format is None:
+            format = 'parquet' if pyarrow is not None else 'csv'
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f'Invalid export format {format} - valid formats {EXPORT_FORMATS}')
+        if format == 'parquet' and pyarrow is None:
+            raise ValueError('Parquet export requires pyarrow, install it or use format csv')
+        self.out_dir = out_dir
+        self.format = format
+        self.batch_rows = max(1, batch_rows)
+        self._parts = {}        # (template, header): _Part
+        self._count = {}        # template: parts opened
+        os.makedirs(out_dir, exist_ok=True)
+ 
+    def __enter__(self):
+        return self
+ 
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+ 
+    def _part(self, template: str, header: tuple) -> _Part:
+        part = self._parts.get((template, header))
+        if part is None:
+            n = self._count.get(template, 0)
+            self._count[template] = n + 1
+            name = re.sub(r'[^\w.-]', '_', template) + (f'-{n}' if n > 0 else '')
+            part = _Part(os.path.join(self.out_dir, f'{name}.{self.format}'), header, self.format)
+            self._parts[(template, header)] = part
+        return part
+ 
+    def add(self, results: dict, **record) -> None:
+        """
+        Add the column oriented results of one command
+ 
+        :param results: {template_name: {column: [values]}}, as returned by zip_results(..., columnar=True)
+        :param record: (Optional) record fields, e.g. _host, _timestamp, _stdin, added as a column to every
+                        row of the command's results. A record field named like a template field raises
+                        ValueError
+        """
+        for template, columns in results.items():
+            rows = len(next(iter(columns.values()), []))
+            if rows == 0:
+                continue
+            clash = [name for name in record if name in columns]
+            if bool(clash) is True:
+                raise ValueError(f'Record columns {clash} clash with the fields of template {template}')
+            header = tuple(record) + tuple(columns)
+            part = self._part(template, header)
+            for name, value in record.items():
+                part.columns[name].extend([_value(value)] * rows)
+            for name, values in columns.items():
+                part.columns[name].extend(map(_value, values))
+            part.rows += rows
+            if part.rows >= self.batch_rows:
+                part.flush()
+ 
+    def close(self) -> dict:
+        """
+        Write the buffered rows and close the output files
+        :return: dict - {file name: rows written}
+        """
+        rtn = {}
+        for part in self._parts.values():
+            part.close()
+            rtn[part.file_name] = part.written
+        self._parts = {}
+        return rtn
+ 
+ 
+def export_log(path: str, out_dir: str, format: str = None, batch_rows: int = 65536, **filters) -> dict:
+    """
+    Export the parsed results of the records in CmdLogger log files. The compact records of delta mode
+    logs are rebuilt with expand_deltas, a compact record whose full record is filtered out, e.g. by
+    start, has no results and is not exported
+ 
+    :param path: log file or directory containing log files
+    :param out_dir: output directory
+    :param format: (Optional) [parquet | csv], default parquet when pyarrow is installed, else csv
+    :param batch_rows: (Optional) rows buffered per template before they are written
+    :param filters: (Optional) iter_records filters - host, stdin, domain, start, end
+    :return: dict - {file name: rows written}
+    """
+    with ResultExporter(out_dir, format=format, batch_rows=batch_rows) as exporter:
+        for entry in expand_deltas(iter_records(path, resolve_blobs=False, **filters)):
+            results = entry.get('results')
+            if bool(results) is False:
+                continue
+            record = {column: entry.get('telnet_host', entry.get('host')) if name == 'host' else entry.get(name)
+                      for column, name in RECORD_COLUMNS.items()}
+            exporter.add({template: rows_to_columns(rows) for template, rows in results.items()}, **record)
+        return exporter.close()
+ 
+ 
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description='Export the parsed results of CmdLogger log files')
+    parser.add_argument('path', help='log file or directory containing log files')
+    parser.add_argument('out_dir', help='output directory, one file per template')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, help='default parquet when pyarrow is installed, else csv')
+    parser.add_argument('--batch-rows', type=int, default=65536, help='rows per written batch')
+    parser.add_argument('--host', help='only records of this NE host')
+    parser.add_argument('--start', help='only records at or after this ISO format time')
+    parser.add_argument('--end', help='only records before this ISO format time')
+    args = parser.parse_args(argv)
+ 
+    written = export_log(args.path, args.out_dir, format=args.format, batch_rows=args.batch_rows,
+                         host=args.host, start=args.start, end=args.end)
+    for file_name, rows in written.items():
+        print(f'{rows:>10} {file_name}')
+    return 0
+ 
+ 
+if __name__ == '__main__':
+    sys.exit(main())
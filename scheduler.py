@@ -0,0 +1,286 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+ 
+from utils.session_pool import SessionPool
+ 
+ 
+class PollJob:
+    def __init__(self, name: str, host: str, user: str, cmds: list, interval: float, jitter: float = 0.0):
+        """
+        A command set run against one host at a fixed cadence
+ 
+        :param name: unique job name
+        :param host: NE host IP address
+        :param user: User login string - [root | admin]
+        :param cmds: list of NE command strings, executed in order
+        :param interval: secs between runs
+        :param jitter: (Optional) each run is delayed by a random 0..jitter secs from its slot, which
+                        spreads the load of many jobs sharing the same interval
+        """
+        self.name = name
+        self.host = host
+        self.user = user
+        self.cmds = list(cmds)
+        self.interval = interval
+        self.jitter = jitter
+        self.slot = 0.0         # monotonic time of the current cadence slot, without jitter
+        self.due = 0.0          # monotonic time the current run is due, slot plus jitter
+        self.busy = False       # True from dispatch until the run completes
+        self.removed = False
+        self.stats = {'runs': 0, 'skipped': 0, 'failed': 0, 'last_lag (secs)': None, 'last_duration (secs)': None}
+ 
+ 
+class PollScheduler:
+    def __init__(self, max_workers: int = 32, max_per_host: int = 1, pool: SessionPool = None,
+                 lag_window: int = 1000, callback=None, **pool_kwargs):
+        """
+        Run per host command sets at fixed intervals. Runs follow a fixed cadence, slot n of a job is at
+        start + n * interval plus jitter, so a slow run does not shift the following ones. When a job's
+        previous run is still in progress at its next slot that tick is skipped rather than queued, so
+        a slow NE can not pile up work.
+ 
+        Sessions are checked out of a SessionPool for each run and returned afterwards, so steady state
+        polling reuses open SSH sessions.
+ 
+        Usage:
+            sched = PollScheduler(max_workers=64)
+            sched.add(host, 'admin', ['show card', 'show condition'], interval=60, jitter=5)
+            sched.start()
+            ...
+            sched.stop()
+ 
+        :param max_workers: (Optional) global concurrency cap, max runs in progress
+        :param max_per_host: (Optional) per NE concurrency cap, max runs in progress against one host
+        :param pool: (Optional) SessionPool to take sessions from, by default the scheduler creates one, and
+                        closes it on stop, using pool_kwargs
+        :param lag_window: (Optional) number of recent runs kept for the schedule lag statistics
+        :param callback: (Optional) called with each run result dict as soon as the run completes
+        :param pool_kwargs: (Optional) keyword arguments of the SessionPool created when pool is None
+        """
+        self.max_workers = max(1, max_workers)
+        self.max_per_host = max(1, max_per_host)
+        self.callback = callback
+        self._owns_pool = pool is None
+        if pool is None:
+            pool_kwargs.setdefault('max_per_host', self.max_per_host)
+            pool = SessionPool(**pool_kwargs)
+        self.pool = pool
+ 
+        self._jobs = {}                 # name: PollJob
+        self._heap = []                 # (due, seq, job name) next tick of each job
+        self._ready = deque()           # jobs due but waiting for a free worker or host slot
+        self._seq = itertools.count()
+        self._running = 0
+        self._host_running = {}         # host: runs in progress
+        self._lags = deque(maxlen=max(1, lag_window))
+        self._cond = threading.Condition()
+        self._executor = None
+        self._dispatcher = None
+        self._stopping = False
+        self.stats = {'runs': 0, 'skipped': 0, 'failed': 0}
+ 
+    def __enter__(self):
+        self.start()
+        return self
+ 
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+ 
+    def add(self, host: str, user: str, cmds: list, interval: float, jitter: float = 0.0, name: str = None) -> str:
+        """
+        Add a command set to the schedule. The first run is due after a random 0..jitter secs
+ 
+        :param host: NE host IP address
+        :param user: User login string - [root | admin]
+        :param cmds: list of NE command strings, executed in order
+        :param interval: secs between runs
+        :param jitter: (Optional) max random delay (secs) added to each run
+        :param name: (Optional) job name, defaults to host:user:<first command>
+        :return: job name
+        """
+        if interval <= 0:
+            raise ValueError(f'Invalid poll interval {interval} - must be > 0')
+        name = name if name is not None else f"{host}:{user}:{cmds[0] if bool(cmds) is True else ''}"
+        with self._cond:
+            if name in self._jobs:
+                raise ValueError(f'Poll job "{name}" already scheduled')
+            job = PollJob(name, host, user, cmds, interval, jitter)
+            job.slot = time.monotonic()
+            self._schedule(job)
+            self._jobs[name] = job
+            self._cond.notify_all()
+        return name
+ 
+    def remove(self, name: str) -> None:
+        """
+        Remove a job from the schedule, a run in progress is allowed to finish
+        """
+        with self._cond:
+            job = self._jobs.pop(name, None)
+            if job is not None:
+                job.removed = True
+ 
+    def _schedule(self, job: PollJob) -> None:
+        """
+        Push the job's current slot, plus jitter, on the timer heap, caller must hold _cond
+        """
+        job.due = job.slot + (random.uniform(0, job.jitter) if job.jitter > 0 else 0.0)
+        heapq.heappush(self._heap, (job.due, next(self._seq), job.name))
+ 
+    def _next_slot(self, job: PollJob, now: float) -> None:
+        """
+        Advance the job to its next cadence slot in the future, counting any slots that were
+        missed, caller must hold _cond
+        """
+        job.slot += job.interval
+        if job.slot <= now:
+            missed = int((now - job.slot) // job.interval) + 1
+            job.slot += missed * job.interval
+            job.stats['skipped'] += missed
+            self.stats['skipped'] += missed
+        self._schedule(job)
+ 
+    def start(self) -> None:
+        with self._cond:
+            if self._dispatcher is not None:
+                return
+            self._stopping = False
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='PollScheduler')
+            self._dispatcher = threading.Thread(target=self._dispatch, name='PollScheduler-dispatch', daemon=True)
+            self._dispatcher.start()
+ 
+    def stop(self, wait: bool = True) -> None:
+        """
+        Stop dispatching runs. Runs in progress are waited for when wait is True
+        """
+        with self._cond:
+            if self._dispatcher is None:
+                return
+            self._stopping = True
+            self._cond.notify_all()
+        self._dispatcher.join()
+        self._executor.shutdown(wait=wait)
+        with self._cond:
+            self._dispatcher = None
+            self._executor = None
+            # Jobs that were waiting to start are released and moved to their next slot
+            now = time.monotonic()
+            for job in self._ready:
+                job.busy = False
+                self._next_slot(job, now)
+            self._ready.clear()
+        if self._owns_pool is True:
+            self.pool.close()
+ 
+    def _dispatch(self) -> None:
+        """
+        Dispatcher thread - moves due jobs to the ready queue and starts ready jobs while the global
+        and per host caps allow
+        """
+        with self._cond:
+            while self._stopping is False:
+                now = time.monotonic()
+                while bool(self._heap) is True and self._heap[0][0] <= now:
+                    _, _, name = heapq.heappop(self._heap)
+                    job = self._jobs.get(name)
+                    if job is None or job.removed is True:
+                        continue
+                    if job.busy is True:
+                        # Previous run still in progress, skip this tick
+                        job.stats['skipped'] += 1
+                        self.stats['skipped'] += 1
+                        self._next_slot(job, now)
+                        continue
+                    job.busy = True
+                    self._ready.append(job)
+ 
+                # Start ready jobs in due order, a job whose host is at its cap waits without holding
+                # back jobs for other hosts
+                waiting = deque()
+                while bool(self._ready) is True and self._running < self.max_workers:
+                    job = self._ready.popleft()
+                    if job.removed is True:
+                        job.busy = False
+                        continue
+                    if self._host_running.get(job.host, 0) >= self.max_per_host:
+                        waiting.append(job)
+                        continue
+                    self._running += 1
+                    self._host_running[job.host] = self._host_running.get(job.host, 0) + 1
+                    self._executor.submit(self._run, job, job.due)
+                    self._next_slot(job, now)
+                waiting.extend(self._ready)
+                self._ready = waiting
+ 
+                timeout = None if bool(self._heap) is False else max(0.0, self._heap[0][0] - time.monotonic())
+                self._cond.wait(timeout)
+ 
+    def _run(self, job: PollJob, due: float) -> dict:
+        """
+        Worker task - execute the job's commands on a pooled session
+        :return: run result dict
+        """
+        start = time.monotonic()
+        lag = round(start - due, 4)
+        result = {'job': job.name, 'host': job.host, 'records': [], 'error': None, 'lag (secs)': lag,
+                  'duration (secs)': 0.0}
+        try:
+            with self.pool.session(job.host, job.user) as conn:
+                for cmd in job.cmds:
+                    rtn = conn.execute(cmd)
+                    if rtn is None:
+                        # execute found the connection closed, discard the session
+                        raise ConnectionError('abnormal connection closure')
+                    result['records'].append(rtn)
+        except Exception as err:
+            result['error'] = f'{type(err).__name__}: {err}'
+        result['duration (secs)'] = round(time.monotonic() - start, 4)
+ 
+        with self._cond:
+            self._running -= 1
+            self._host_running[job.host] -= 1
+            job.busy = False
+            job.stats['runs'] += 1
+            job.stats['last_lag (secs)'] = lag
+            job.stats['last_duration (secs)'] = result['duration (secs)']
+            self.stats['runs'] += 1
+            if result['error'] is not None:
+                job.stats['failed'] += 1
+                self.stats['failed'] += 1
+            self._lags.append(lag)
+            self._cond.notify_all()
+ 
+        if self.callback is not None:
+            self.callback(result)
+        return result
+ 
+    def lag_stats(self) -> dict:
+        """
+        Schedule lag, secs between the time a run was due and the time it started, over the most
+        recent runs
+        :return: dict - {'count', 'mean', 'p50', 'p95', 'p99', 'max'}
+        """
+        with self._cond:
+            lags = sorted(self._lags)
+        if bool(lags) is False:
+            return {'count': 0, 'mean': None, 'p50': None, 'p95': None, 'p99': None, 'max': None}
+ 
+        def pct(p):
+            return lags[min(len(lags) - 1, int(p / 100 * len(lags)))]
+ 
+        return {'count': len(lags),
+                'mean': round(sum(lags) / len(lags), 4),
+                'p50': pct(50),
+                'p95': pct(95),
+                'p99': pct(99),
+                'max': lags[-1],
+                }
+ 
+    def job_stats(self) -> dict:
+        with self._cond:
+            return {name: dict(job.stats, busy=job.busy) for name, job in self._jobs.items()}
@@ -0,0 +1,277 @@
+import threading
+import time
+from contextlib import contextmanager
+ 
+from utils.conn_Info import get_port
+from utils.connection_base import Connection, SSH_Conn_Failure
+ 
+ 
+class SessionPoolTimeout(Exception):
+    def __init__(self, host: str, user: str, port: int, timeout: float, message="No pooled session available"):
+        self.host = host
+        self.port = port
+        self.message = f'{message} within {timeout} secs: {host}@{user} (via {port})'
+        print(self.message)
+        super().__init__(self.message)
+ 
+ 
+class SessionPoolClosed(Exception):
+    def __init__(self, host: str, user: str, port: int, message="Session pool is closed"):
+        self.host = host
+        self.port = port
+        self.message = f'{message}: {host}@{user} (via {port})'
+        print(self.message)
+        super().__init__(self.message)
+ 
+ 
+class SessionPool:
+    def __init__(self, max_per_host: int = 4, idle_timeout: float = 300.0, keepalive: int = 30,
+                 reap_interval: float = 30.0, log_action='open', connection_factory=None, **conn_kwargs):
+        """
+        Pool of open, already verified, Connection objects keyed by (host, user, port). A pooled session
+        keeps the prompt, hostname and timezone found when it was first opened, so reusing it skips the
+        SSH handshake and the hostname/date/prompt round trips.
+ 
+        Usage:
+            pool = SessionPool()
+            with pool.session(host, 'admin') as conn:
+                conn.execute('show card')
+ 
+        :param max_per_host: (Optional) max sessions, in use plus idle, per (host, user, port)
+        :param idle_timeout: (Optional) idle sessions older than this many secs are closed
+        :param keepalive: (Optional) SSH transport keepalive interval (secs) set on pooled sessions, 0 disables
+        :param reap_interval: (Optional) how often the background reaper closes idle sessions (secs),
+                                None disables the reaper and idle sessions are only evicted on acquire/release
+        :param log_action: (Optional) log_action passed to each new Connection
+        :param connection_factory: (Optional) callable(host, user, log_action=, port=, **conn_kwargs) returning
+                                a Connection like object, defaults to Connection
+        :param conn_kwargs: (Optional) extra keyword arguments passed to the connection factory
+        """
+        self.max_per_host = max(1, max_per_host)
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.reap_interval = reap_interval
+        self.log_action = log_action
+        self.connection_factory = connection_factory if connection_factory is not None else Connection
+        self.conn_kwargs = conn_kwargs
+ 
+        self._idle = {}         # key: [(conn, monotonic time released), ...] most recently released last
+        self._count = {}        # key: sessions open, in use plus idle, plus being opened
+        self._keys = {}         # id(conn): key, for sessions checked out of the pool
+        self._cond = threading.Condition()
+        self._closed = False
+        self._reaper = None
+        self.stats = {'created': 0, 'reused': 0, 'evicted_idle': 0, 'evicted_dead': 0}
+ 
+    @staticmethod
+    def _is_healthy(conn) -> bool:
+        try:
+            return conn.ssh is not None and conn.ssh.is_alive() is True
+        except Exception:
+            return False
+ 
+    def _close_sessions(self, conns: list) -> None:
+        """
+        Disconnect sessions dropped from the pool and close their loggers, which terminates the log file
+        and stops the logger threads. A CmdLogger shared through log_action is left open. Called without
+        holding _cond, a slow SSH teardown must not block the other pool users
+        """
+        for conn in conns:
+            try:
+                conn.ssh.disconnect()
+            except Exception:
+                pass
+            logger = getattr(conn, 'logger', None)
+            if logger is not None and logger is not self.log_action:
+                try:
+                    logger.close()
+                except Exception:
+                    pass
+ 
+    def _set_keepalive(self, conn) -> None:
+        if not self.keepalive:
+            return
+        try:
+            conn.ssh.remote_conn.get_transport().set_keepalive(self.keepalive)
+        except AttributeError:
+            pass
+ 
+    def _start_reaper(self) -> None:
+        """
+        Start the background idle session reaper, caller must hold _cond
+        """
+        if self._reaper is None and self.reap_interval is not None:
+            self._reaper = threading.Thread(target=self._reap, name='SessionPool-reaper', daemon=True)
+            self._reaper.start()
+ 
+    def _reap(self) -> None:
+        while True:
+            with self._cond:
+                if self._closed is True:
+                    return
+                self._cond.wait(self.reap_interval)
+                if self._closed is True:
+                    return
+                evicted = self._evict_idle()
+            self._close_sessions(evicted)
+ 
+    def _evict_idle(self) -> list:
+        """
+        Drop sessions that have been idle longer than idle_timeout, caller must hold _cond
+        :return: the dropped sessions, for the caller to close once it has released _cond
+        """
+        now = time.monotonic()
+        evicted = []
+        for key, idle in self._idle.items():
+            keep = []
+            for conn, released in idle:
+                if now - released >= self.idle_timeout:
+                    evicted.append(conn)
+                    self._count[key] -= 1
+                    self.stats['evicted_idle'] += 1
+                else:
+                    keep.append((conn, released))
+            if len(keep) != len(idle):
+                idle[:] = keep
+                self._cond.notify_all()
+        return evicted
+ 
+    def evict_idle(self) -> None:
+        with self._cond:
+            evicted = self._evict_idle()
+        self._close_sessions(evicted)
+ 
+    def acquire(self, host: str, user: str, port: int = None, timeout: float = None):
+        """
+        Check a session out of the pool. An idle session is health checked before it is handed out,
+        dead ones are dropped. A new session is opened when none is idle and the host is below
+        max_per_host, otherwise the call waits for a session to be released. Health checks and connects
+        run without holding the pool lock, is_alive() writes to the channel and can block
+ 
+        :param host: NE host IP address
+        :param user: User login string - [root | admin]
+        :param port: (Optional) normally set automatically based on user string
+        :param timeout: (Optional) max secs to wait for a session, None waits forever
+        :return: Connection
+        """
+        port = port if port is not None else get_port(user)
+        key = (host, user, port)
+        deadline = None if timeout is None else time.monotonic() + timeout
+ 
+        # Sessions dropped while looking for one are closed once the lock is released
+        dropped = []
+        try:
+            while True:
+                conn = None
+                with self._cond:
+                    if self._closed is True:
+                        raise SessionPoolClosed(host, user, port)
+                    self._start_reaper()
+                    dropped.extend(self._evict_idle())
+                    while True:
+                        idle = self._idle.setdefault(key, [])
+                        if bool(idle) is True:
+                            # Its slot stays counted while it is checked
+                            conn, _ = idle.pop()
+                            break
+                        if self._count.get(key, 0) < self.max_per_host:
+                            # Reserve the slot, the connection is opened without holding the lock
+                            self._count[key] = self._count.get(key, 0) + 1
+                            break
+ 
+                        remaining = None if deadline is None else deadline - time.monotonic()
+                        if remaining is not None and remaining <= 0:
+                            raise SessionPoolTimeout(host, user, port, timeout)
+                        self._cond.wait(remaining)
+                        if self._closed is True:
+                            raise SessionPoolClosed(host, user, port)
+                if conn is None:
+                    break
+                healthy = self._is_healthy(conn)
+                with self._cond:
+                    if healthy is True:
+                        self._keys[id(conn)] = key
+                        self.stats['reused'] += 1
+                        return conn
+                    self._count[key] -= 1
+                    self.stats['evicted_dead'] += 1
+                    self._cond.notify_all()
+                dropped.append(conn)
+        finally:
+            self._close_sessions(dropped)
+ 
+        try:
+            conn = self.connection_factory(host, user, log_action=self.log_action, port=port, **self.conn_kwargs)
+        except Exception:
+            self._release_slot(key)
+            raise
+        if self._is_healthy(conn) is False:
+            self._release_slot(key)
+            self._close_sessions([conn])
+            raise SSH_Conn_Failure(host, user, port, 'session pool connect failed')
+ 
+        self._set_keepalive(conn)
+        with self._cond:
+            self._keys[id(conn)] = key
+            self.stats['created'] += 1
+        return conn
+ 
+    def _release_slot(self, key: tuple) -> None:
+        with self._cond:
+            self._count[key] -= 1
+            self._cond.notify_all()
+ 
+    def release(self, conn, discard: bool = False) -> None:
+        """
+        Return a session to the pool
+ 
+        :param conn: Connection obtained from acquire
+        :param discard: (Optional) If True close the session instead of keeping it for reuse
+        """
+        with self._cond:
+            key = self._keys.pop(id(conn), None)
+            if key is None:
+                return
+            dropped = self._evict_idle()
+        # The health check runs without the lock, the session's slot stays counted meanwhile
+        keep = discard is False and self._closed is False and self._is_healthy(conn) is True
+        with self._cond:
+            if keep is True and self._closed is False:
+                self._idle.setdefault(key, []).append((conn, time.monotonic()))
+            else:
+                dropped.append(conn)
+                self._count[key] -= 1
+            self._cond.notify_all()
+        self._close_sessions(dropped)
+ 
+    @contextmanager
+    def session(self, host: str, user: str, port: int = None, timeout: float = None):
+        """
+        Context manager around acquire/release. The session is discarded if the block raises
+        """
+        conn = self.acquire(host, user, port=port, timeout=timeout)
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, discard=True)
+            raise
+        self.release(conn)
+ 
+    def close(self) -> None:
+        """
+        Close every idle session and stop the reaper. Sessions still checked out are closed when released,
+        acquire raises SessionPoolClosed from now on
+        """
+        dropped = []
+        with self._cond:
+            self._closed = True
+            for key, idle in self._idle.items():
+                for conn, _ in idle:
+                    dropped.append(conn)
+                    self._count[key] -= 1
+            self._idle.clear()
+            self._cond.notify_all()
+        self._close_sessions(dropped)
+        if self._reaper is not None:
+            self._reaper.join()
+            self._reaper = None
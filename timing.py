@@ -0,0 +1,98 @@
+import threading
+import time
+from contextlib import contextmanager
+ 
+# Hooks called with every timing event, see add_timing_hook
+_hooks = []
+_hooks_lock = threading.Lock()
+ 
+ 
+def add_timing_hook(hook) -> None:
+    """
+    Register a callable that receives every timing event, e.g. to feed an external metrics system.
+    Hooks run on the thread that produced the event and must be quick, exceptions are ignored
+ 
+    event dict - {'event': [connect | open_connection | log_cmd], 'host', 'cmd', 'phases': {phase: secs},
+                  'total': secs}
+    """
+    with _hooks_lock:
+        if hook not in _hooks:
+            _hooks.append(hook)
+ 
+ 
+def remove_timing_hook(hook) -> None:
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+ 
+ 
+def has_timing_hooks() -> bool:
+    return bool(_hooks)
+ 
+ 
+def emit_timing(event: str, host: str, cmd: str, phases: dict) -> None:
+    """
+    Hand a timing event to the registered hooks
+    """
+    if bool(_hooks) is False:
+        return
+    data = {'event': event,
+            'host': host,
+            'cmd': cmd,
+            'phases': dict(phases),
+            'total': round(sum(phases.values()), 6),
+            }
+    for hook in list(_hooks):
+        try:
+            hook(data)
+        except Exception:
+            pass
+ 
+ 
+def lap(phases: dict, name: str, start: float) -> float:
+    """
+    Add the secs elapsed since start to phases[name], nothing is recorded when phases is None
+ 
+    :param phases: phase durations dict or None
+    :param name: phase name, phases entered more than once accumulate
+    :param start: time.perf_counter() value at the start of the phase
+    :return: time.perf_counter() now, the start of the next phase
+    """
+    now = time.perf_counter()
+    if phases is not None:
+        phases[name] = round(phases.get(name, 0.0) + now - start, 6)
+    return now
+ 
+ 
+class PhaseTimer:
+    """
+    Collects the duration of the named phases of an operation
+ 
+    Usage:
+        timer = PhaseTimer()
+        with timer.phase('handshake'):
+            ...
+        timer.phases -> {'handshake': 0.0123}
+    """
+    def __init__(self, phases: dict = None):
+        """
+        :param phases: (Optional) dict to add the phase durations (secs) to, a new one by default
+        """
+        self.phases = phases if phases is not None else {}
+ 
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+ 
+    def add(self, name: str, secs: float) -> None:
+        """
+        Add secs to a phase, phases entered more than once accumulate
+        """
+        self.phases[name] = round(self.phases.get(name, 0.0) + secs, 6)
+ 
+    def lap(self, name: str, start: float) -> float:
+        return lap(self.phases, name, start)